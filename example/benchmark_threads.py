@@ -0,0 +1,54 @@
+import os
+import time
+import numpy as np
+import matplotlib.pyplot as plt
+
+# import mre last to use (possibly) specified pyplot backend
+import mrestimator as mre
+
+# ------------------------------------------------------------------ #
+# scaling of coefficients() with the number of threads
+# ------------------------------------------------------------------ #
+
+# save next to this script file, without changing the working directory
+outdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'output')
+os.makedirs(outdir, exist_ok=True)
+
+# only show warnings, the info logs would be timed, too
+mre.ut._logstreamhandler.setLevel('WARNING')
+
+bp = mre.simulate_branching(m=0.98, a=100, numtrials=32, length=100000,
+    seed=42)
+steps = (1, 1000)
+maxthreads = os.cpu_count()
+
+threads = []
+n = 1
+while n < maxthreads:
+    threads.append(n)
+    n *= 2
+threads.append(maxthreads)
+
+timings = {}
+for method in ['trialseparated', 'stationarymean']:
+    # compile the kernels before timing
+    mre.coefficients(bp[:2, :5000], steps=(1, 10), method=method, numboot=0)
+
+    timings[method] = []
+    for nthreads in threads:
+        start = time.perf_counter()
+        mre.coefficients(bp, steps=steps, method=method, numboot=0,
+            nthreads=nthreads)
+        timings[method].append(time.perf_counter() - start)
+        print('{:>16} {:>3d} threads: {:8.3f} s'.format(
+            method, nthreads, timings[method][-1]))
+
+fig, ax = plt.subplots()
+for method in timings:
+    speedup = timings[method][0]/np.array(timings[method])
+    ax.plot(threads, speedup, 'o-', label=method)
+ax.plot(threads, threads, ':', color='gray', label='ideal')
+ax.set_xlabel('Threads')
+ax.set_ylabel('Speedup')
+ax.legend()
+fig.savefig(os.path.join(outdir, 'benchmark_threads.pdf'))
@@ -6,7 +6,10 @@ from mrestimator import utility as ut
 ut.initialize()
 log = ut.log
 
-from .coefficients import CoefficientResult, coefficients
+from .coefficients import CoefficientResult, coefficients, \
+    CoefficientAccumulator, coefficients_windowed, benchmark_engines, \
+    CoefficientResultStack, PackedRaster, SpikeTimes, RaggedTrials, \
+    TrialFiles
 from .fit          import *
 from .input_output import *
 from .simulate     import *
@@ -1,55 +1,95 @@
+import os
+import json
 import logging
+import operator
+import contextlib
 from collections import namedtuple
+from collections.abc import Sequence
 
 import numpy as np
 
 from mrestimator import utility as ut
 log = ut.log
 
+try:
+    # scipy >= 1.4, allows multithreaded transforms
+    from scipy import fft as scipy_fft
+except ImportError:
+    scipy_fft = None
+
 # set precision of temporary results for numpy and numba
 # ftype = np.longdouble # very slow, maybe float64 is enough
 ftype=np.float64
 
+# number of time steps read at once by the 'tiled' engine
+tilesize=2**18
+
+# number of replicas computed at once by the streaming bootstrap
+streamsize=2**10
+
+# number of trials summed sequentially before combining pairwise,
+# in the deterministic reductions
+pairblock=64
+
+# number of consecutive steps computed per matrix product, 'blas' engine
+lagblock=64
+
+# number of time steps aggregated at once into a population
+poptile=2**12
+
 try:
     from numba import jit, prange
     # raise ImportError
     log.info('Using numba for parallelizable functions')
+    use_numba = True
+
+    try:
+        from numba import get_num_threads, set_num_threads
+        from numba import config as numba_config
+        maxthreads = numba_config.NUMBA_NUM_THREADS
+    except ImportError:
+        # numba < 0.49 has no runtime control of threads
+        get_num_threads = None
+        set_num_threads = None
+        maxthreads = None
 
     # implement needed sum functions to be compiled by numba:
-    # parallelize higher level loops, during sm and ts methods
+    # parallelize higher level loops, during sm and ts methods.
+    # the helpers run serially within the threads of those loops
     @jit(nopython=True, parallel=False, fastmath=True, cache=True)
     def sum_1d(a):
         total = ftype(0)
-        for i in prange(a.shape[0]):
+        for i in range(a.shape[0]):
             total += ftype(a[i])
         return total
 
     @jit(nopython=True, parallel=False, fastmath=True, cache=True)
     def sum_2d(a):
         total = ftype(0)
-        for i in prange(a.shape[0]):
-            for j in prange(a.shape[1]):
+        for i in range(a.shape[0]):
+            for j in range(a.shape[1]):
                 total += ftype(a[i,j])
         return total
 
     @jit(nopython=True, parallel=False, fastmath=True, cache=True)
     def sum_2d_ax0(a):
         total = np.zeros((a.shape[1]), dtype=ftype)
-        for i in prange(a.shape[0]):
-            for j in prange(a.shape[1]):
+        for i in range(a.shape[0]):
+            for j in range(a.shape[1]):
                 total[j] += ftype(a[i,j])
         return total
 
     @jit(nopython=True, parallel=False, fastmath=True, cache=True)
     def sum_2d_ax1(a):
         total = np.zeros((a.shape[0]), dtype=ftype)
-        for i in prange(a.shape[0]):
-            for j in prange(a.shape[1]):
+        for i in range(a.shape[0]):
+            for j in range(a.shape[1]):
                 total[i] += ftype(a[i,j])
         return total
 
 except ImportError:
     log.info('Numba not available, skipping parallelization')
+    use_numba = False
     # replace numba functions if numba not available:
     # we only use jit and prange
     # helper needed for decorators with kwargs
@@ -67,6 +107,10 @@ except ImportError:
     def prange(*args):
         return range(*args)
 
+    get_num_threads = None
+    set_num_threads = None
+    maxthreads = None
+
     def sum_1d(a):
         return np.sum(a, dtype=ftype)
 
@@ -80,16 +124,74 @@ except ImportError:
         return np.sum(a, axis=1, dtype=ftype)
 
 
+def _check_nthreads(nthreads):
+    """
+        Number of threads requested via argument or, if `None`, via the
+        environment variable `MRE_NUM_THREADS`. `None` if neither is set.
+    """
+    if nthreads is None:
+        nthreads = os.environ.get('MRE_NUM_THREADS', None)
+    if nthreads is None or nthreads == '':
+        return None
+    try:
+        nthreads = int(nthreads)
+        assert nthreads >= 1
+    except Exception as e:
+        log.exception('Number of threads needs to be an integer >= 1')
+        raise ValueError from e
+    return nthreads
+
+@contextlib.contextmanager
+def num_threads(nthreads=None):
+    """
+        Context in which the numba kernels use (at most) `nthreads` threads.
+        Without argument, `MRE_NUM_THREADS` from the environment is used and
+        if that is not set either, numbas default (all cores, or
+        `NUMBA_NUM_THREADS`). The threading layer is chosen by numba,
+        set `NUMBA_THREADING_LAYER` before importing to change it.
+    """
+    nthreads = _check_nthreads(nthreads)
+    if nthreads is None:
+        yield
+    elif set_num_threads is None:
+        log.debug('Setting the number of threads needs numba >= 0.49, ' +
+            'ignoring nthreads={}'.format(nthreads))
+        yield
+    else:
+        if nthreads > maxthreads:
+            log.debug('Requested {} threads, numba is limited to {}'.format(
+                nthreads, maxthreads))
+            nthreads = maxthreads
+        previous = get_num_threads()
+        set_num_threads(nthreads)
+        try:
+            yield
+        finally:
+            set_num_threads(previous)
+
+def _current_threads():
+    """
+        Number of threads the numba kernels currently use, 1 without numba.
+    """
+    if get_num_threads is None:
+        return 1
+    return get_num_threads()
+
 # ------------------------------------------------------------------ #
 # Core routines for differnt coefficient methods
 # ------------------------------------------------------------------ #
 
 @jit(nopython=True, parallel=True, fastmath=True, cache=True)
-def sm_precompute(data, steps):
+def sm_precompute(data, steps, dtype=ftype, offset=0.0):
     """
         Part 1 of the >= v0.1.5 stationary mean method.
         Works for m>1
         Computes terms that are reused during bootstrapping.
+        Sums are accumulated in ftype, the tables are stored as `dtype`.
+        The tables (but not mm and mm_squ) hold the terms of
+        `data - offset`, the method is invariant to this common shift. With
+        `offset` close to the mean, the terms are small and lose less
+        precision when stored as float32.
     """
 
     numsteps  = steps.shape[0]
@@ -97,25 +199,51 @@ def sm_precompute(data, steps):
     numels    = data.shape[1]
 
     # (x-mx)(y-my) = x*y + mx*my - my*x - mx*y
-    x_y   = np.empty(shape=(numsteps, numtrials))
-    x_x   = np.empty(shape=(numsteps, numtrials))
-    mx    = np.empty(shape=(numsteps, numtrials))
-    my    = np.empty(shape=(numsteps, numtrials))
+    x_y   = np.empty(shape=(numsteps, numtrials), dtype=dtype)
+    x_x   = np.empty(shape=(numsteps, numtrials), dtype=dtype)
+    mx    = np.empty(shape=(numsteps, numtrials), dtype=dtype)
+    my    = np.empty(shape=(numsteps, numtrials), dtype=dtype)
 
-    # precompute things that can be separated by trial and k
-    mm     = sum_2d_ax1(data[:, :]   )
-    mm_squ = sum_2d_ax1(data[:, :]**2)
+    # sums over the first and last j values of each trial, for j up to the
+    # largest step, head[:, j] = sum(data[:, 0:j]) and
+    # tail[:, j] = sum(data[:, numels-j:]). the edge corrections for every
+    # k are then lookups, instead of summing data[:, 0:k] and data[:, -k:]
+    # again for each step, and the tables stay small for long trials
+    kmax = min(numels, np.max(steps))
+    head     = np.zeros(shape=(numtrials, kmax+1), dtype=ftype)
+    tail     = np.zeros(shape=(numtrials, kmax+1), dtype=ftype)
+    tail_squ = np.zeros(shape=(numtrials, kmax+1), dtype=ftype)
+    mm       = np.zeros(shape=(numtrials), dtype=ftype)
+    mm_squ   = np.zeros(shape=(numtrials), dtype=ftype)
+    for tdx in prange(numtrials):
+        total = ftype(0)
+        squ   = ftype(0)
+        for j in range(numels):
+            total += ftype(data[tdx, j])
+            squ   += ftype(data[tdx, j])**2
+        mm[tdx]     = total
+        mm_squ[tdx] = squ
+        for j in range(kmax):
+            head[tdx, j+1] = head[tdx, j] + ftype(data[tdx, j])
+            tail[tdx, j+1] = tail[tdx, j] + ftype(data[tdx, numels-1-j])
+            tail_squ[tdx, j+1] = tail_squ[tdx, j] \
+                + ftype(data[tdx, numels-1-j])**2
 
-    for idx in prange(len(steps)):
+    # parallelize over all pairs of trials and steps, without temporaries
+    for jdx in prange(numtrials*numsteps):
+        tdx = jdx // numsteps
+        idx = jdx %  numsteps
         k = steps[idx]
-        x = data[:, 0:-k]
-        y = data[:, k:  ]
-        l = data[:, 0: k]
-        r = data[:,-k:  ]
-        x_y[idx] =           sum_2d_ax1(x*y) /(numels-k)
-        x_x[idx] = (mm_squ - sum_2d_ax1(r*r))/(numels-k)
-        mx [idx] = (mm     - sum_2d_ax1(r  ))/(numels-k)
-        my [idx] = (mm     - sum_2d_ax1(l  ))/(numels-k)
+        total = ftype(0)
+        for j in range(numels-k):
+            total += ftype(data[tdx, j])*ftype(data[tdx, j+k])
+        mxv = (mm[tdx] - tail[tdx, k])/(numels-k)
+        myv = (mm[tdx] - head[tdx, k])/(numels-k)
+        x_y[idx, tdx] = total/(numels-k) - offset*(mxv+myv) + offset**2
+        x_x[idx, tdx] = (mm_squ[tdx] - tail_squ[tdx, k])/(numels-k) \
+            - 2*offset*mxv + offset**2
+        mx [idx, tdx] = mxv - offset
+        my [idx, tdx] = myv - offset
 
     return mm, mm_squ, mx, my, x_y, x_x
 
@@ -155,31 +283,78 @@ def sm_method(precomputed, steps, choices = None):
     return res
 
 @jit(nopython=True, parallel=True, fastmath=True, cache=True)
-def ts_precompute(data, steps):
+def ts_precompute(data, steps, dtype=ftype, intshift=False):
     """
         Part 1 of the trialseparated method.
         Containts the core of the method.
         For ts, precomputing is not needed, this is only for consistency with
         sm. Hence, ts_method only does one reduction based on the bootstrap
         trial choices.
+        Fused kernel: front mean, front variance, back mean and lagged
+        covariance of each trial and step are accumulated in one pass over
+        the data, without temporary arrays. Values are shifted by the trial
+        mean so that the one-pass variance stays precise.
+        Sums are accumulated in ftype, the result is stored as `dtype`.
+        With `intshift`, the shift is the integer part of the mean. For
+        integer data, values and sums then stay integers, which ftype
+        represents exactly below 2**53 (see _int_exact): the sums are exact,
+        in any order, and only the normalization rounds.
     """
     N = data.shape[0]
     T = data.shape[1]
-    res = np.zeros(shape=(N, len(steps)), dtype=np.float64)
-    for idx in prange(len(steps)):
-        k = steps[idx]
-        frontmean = np.empty((N,1), ftype)
-        backmean  = np.empty((N,1), ftype)
-        frontmean[:,0] = sum_2d_ax1( data[:,  :-k]              )/(T-k)
-        frontvar       = sum_2d_ax1((data[:,  :-k]-frontmean)**2)/(T-k)
-        backmean[:,0]  = sum_2d_ax1( data[:, k:  ]              )/(T-k)
+    numsteps = len(steps)
+    res = np.zeros(shape=(N, numsteps), dtype=dtype)
+
+    shift = np.empty(N, dtype=ftype)
+    for tdx in prange(N):
+        total = ftype(0)
+        for j in range(T):
+            total += ftype(data[tdx, j])
+        shift[tdx] = total/T
+        if intshift:
+            shift[tdx] = np.floor(shift[tdx])
 
-        res[:, idx] = \
-            sum_2d_ax1((data[:, :-k] - frontmean)*(data[:, k:] - backmean)) \
-            / frontvar / (T-k)
+    # parallelize over all pairs of trials and steps, trial-major so that
+    # consecutive iterations reuse the same trial from cache
+    for jdx in prange(N*numsteps):
+        tdx = jdx // numsteps
+        idx = jdx %  numsteps
+        k = steps[idx]
+        c = shift[tdx]
+        sx  = ftype(0)
+        sy  = ftype(0)
+        sxx = ftype(0)
+        sxy = ftype(0)
+        for j in range(T-k):
+            x = ftype(data[tdx, j  ]) - c
+            y = ftype(data[tdx, j+k]) - c
+            sx  += x
+            sy  += y
+            sxx += x*x
+            sxy += x*y
+        frontmean = sx/(T-k)
+        backmean  = sy/(T-k)
+        frontvar  = sxx/(T-k) - frontmean**2
+        res[tdx, idx] = (sxy/(T-k) - frontmean*backmean) / frontvar
 
     return res
 
+def _int_exact(data):
+    """
+        Whether sums over `data` are exact in ftype: integer (or boolean)
+        values, and sums of squares over a trial that stay below 2**53,
+        where ftype stops representing all integers.
+        sm_precompute then is exact without changes, ts_precompute needs
+        `intshift`.
+    """
+    if data.dtype.kind == 'b':
+        return True
+    if data.dtype.kind not in 'iu' or data.size == 0:
+        return False
+    bound = max(abs(int(np.max(data))), abs(int(np.min(data))))
+    # differences to the shift in ts are bounded by twice that
+    return data.shape[1] * (2*bound)**2 < 2**53
+
 @jit(nopython=True, parallel=True, fastmath=True, cache=True)
 def ts_method(precomputed, steps, choices = None):
     """
@@ -192,6 +367,906 @@ def ts_method(precomputed, steps, choices = None):
     # res = np.mean(precomputed[choices], axis=0, dtype=ftype)
     return res
 
+@jit(nopython=True, parallel=True, fastmath=False, cache=True)
+def weighted_sums(weights, table):
+    """
+        Deterministic np.dot(weights, table.T), weights of shape
+        (numreplicas, numtrials) and table of shape (numcols, numtrials).
+        Trials are summed in blocks of fixed size, and the block sums are
+        combined pairwise in fixed order. Every output is computed by one
+        thread, without fastmath, so the result does not depend on the
+        number of threads (nor on the BLAS library).
+    """
+    numrep    = weights.shape[0]
+    numtrials = weights.shape[1]
+    numcols   = table.shape[0]
+    numblocks = (numtrials + pairblock - 1) // pairblock
+    res = np.empty(shape=(numrep, numcols), dtype=ftype)
+    for rdx in prange(numrep):
+        partial = np.empty(numblocks, dtype=ftype)
+        for cdx in range(numcols):
+            for bdx in range(numblocks):
+                total = ftype(0)
+                for tdx in range(bdx*pairblock,
+                    min((bdx+1)*pairblock, numtrials)):
+                    total += ftype(weights[rdx, tdx])*table[cdx, tdx]
+                partial[bdx] = total
+            width = numblocks
+            while width > 1:
+                for bdx in range(width//2):
+                    partial[bdx] = partial[2*bdx] + partial[2*bdx+1]
+                if width % 2 == 1:
+                    partial[width//2] = partial[width-1]
+                width = (width+1)//2
+            res[rdx, cdx] = partial[0]
+    return res
+
+def _weighted_dot(weights, table, deterministic=False):
+    """
+        np.dot(weights, table) for a table of shape (numtrials, numcols),
+        accumulated in ftype. Tables of lower precision are converted in
+        blocks of trials, instead of copying them at once.
+    """
+    if deterministic:
+        return weighted_sums(weights,
+            np.ascontiguousarray(np.transpose(table)))
+    if table.dtype == ftype:
+        return np.dot(weights, table)
+    numtrials = table.shape[0]
+    blocksize = max(1, int(2**22 / max(1, table.shape[1])))
+    res = np.zeros(shape=(weights.shape[0], table.shape[1]), dtype=ftype)
+    for start in range(0, numtrials, blocksize):
+        stop = min(start+blocksize, numtrials)
+        res += np.dot(weights[:, start:stop],
+            table[start:stop].astype(ftype))
+    return res
+
+def ts_method_weighted(precomputed, weights, deterministic=False,
+    stepweights=None):
+    """
+        Batched ts_method for many replicas at once. `weights` has shape
+        (numreplicas, numtrials) and contains how often each trial
+        contributes to a replica (e.g. bootstrap counts).
+        One matrix product instead of one reduction per replica.
+        With `deterministic`, uses weighted_sums instead of BLAS.
+        Optional `stepweights` of shape (numtrials, numsteps) additionally
+        weight each trial per step (e.g. by T-k for trials of different
+        length), where zero excludes the (NaN) entry.
+    """
+    weights = np.asarray(weights, dtype=ftype)
+    if stepweights is None:
+        norm = np.sum(weights, axis=1, keepdims=True)
+        return _weighted_dot(weights, precomputed, deterministic) / norm
+    table = np.where(stepweights > 0, precomputed, 0) * stepweights
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return _weighted_dot(weights, table, deterministic) \
+            / _weighted_dot(weights, stepweights, deterministic)
+
+def sm_method_weighted(precomputed, weights, deterministic=False,
+    stepweights=None):
+    """
+        Batched sm_method, see ts_method_weighted.
+        With weighted means over trials, the sm estimator reduces to
+        (<x_y> - <mx><my>) / (<x_x> - <mx>^2).
+    """
+    mm, mm_squ, mx, my, x_y, x_x = precomputed
+    weights = np.asarray(weights, dtype=ftype)
+    if stepweights is None:
+        norm = np.sum(weights, axis=1, keepdims=True)
+        def dot(table):
+            return _weighted_dot(weights, np.transpose(table), deterministic)
+    else:
+        norm = _weighted_dot(weights, stepweights, deterministic)
+        def dot(table):
+            table = np.where(stepweights > 0, np.transpose(table), 0)
+            return _weighted_dot(weights, table * stepweights, deterministic)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mxk  = dot(mx ) / norm
+        myk  = dot(my ) / norm
+        x_yk = dot(x_y) / norm
+        x_xk = dot(x_x) / norm
+        return (x_yk - mxk*myk) / (x_xk - mxk**2)
+
+def _leave_one_out(table, deterministic=False, stepweights=None):
+    """
+        Sums over all trials but one, for each trial, of a table of shape
+        (numtrials, numcols), and their normalization: the number of trials
+        or the sum of `stepweights` (see ts_method_weighted).
+    """
+    numtrials = table.shape[0]
+    ones = np.ones(shape=(1, numtrials), dtype=ftype)
+    if stepweights is None:
+        return _weighted_dot(ones, table, deterministic) - table, \
+            numtrials - 1
+    table = np.where(stepweights > 0, table, 0) * stepweights
+    return _weighted_dot(ones, table, deterministic) - table, \
+        _weighted_dot(ones, stepweights, deterministic) - stepweights
+
+def ts_method_jackknife(precomputed, deterministic=False, stepweights=None):
+    """
+        Delete-one jackknife of ts_method, the coefficients of the
+        `numtrials` replicas that each leave out one trial, shape
+        (numtrials, numsteps).
+        Same as ts_method_weighted with weights `1 - identity`, but from
+        the sums over all trials minus each trial, so all replicas cost
+        O(numtrials) instead of O(numtrials**2).
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        total, norm = _leave_one_out(precomputed, deterministic, stepweights)
+        return total / norm
+
+def sm_method_jackknife(precomputed, deterministic=False, stepweights=None):
+    """
+        Delete-one jackknife of sm_method, see ts_method_jackknife and
+        sm_method_weighted.
+    """
+    mm, mm_squ, mx, my, x_y, x_x = precomputed
+    def mean(table):
+        total, norm = _leave_one_out(np.transpose(table), deterministic,
+            stepweights)
+        return total / norm
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mxk  = mean(mx )
+        myk  = mean(my )
+        x_yk = mean(x_y)
+        x_xk = mean(x_x)
+        return (x_yk - mxk*myk) / (x_xk - mxk**2)
+
+def bootstrap_counts(numtrials, numboot):
+    """
+        Draws `numboot` bootstrap replicas of `numtrials` trials and returns
+        how often each trial was chosen, shape (numboot, numtrials).
+        Consumes the random stream exactly like drawing the replicas one at
+        a time with `np.random.choice`.
+    """
+    counts = np.zeros(shape=(numboot, numtrials), dtype=np.int64)
+    # draw in blocks of replicas to limit memory of the drawn indices
+    blocksize = max(1, int(2**22 / numtrials))
+    for start in range(0, numboot, blocksize):
+        stop    = min(start+blocksize, numboot)
+        choices = np.random.choice(np.arange(0, numtrials),
+            size=(stop-start, numtrials))
+        choices += numtrials*np.arange(0, stop-start)[:, np.newaxis]
+        counts[start:stop] = np.bincount(choices.ravel(),
+            minlength=(stop-start)*numtrials).reshape(stop-start, numtrials)
+    return counts
+
+def hierarchical_counts(groups, numboot):
+    """
+        Draws `numboot` two-level bootstrap replicas and returns how often
+        each trial was chosen, shape (numboot, numtrials). `groups` holds
+        the index (0 to numgroups-1) of the group of each trial.
+        Each replica first draws numgroups groups with replacement, and
+        then, for every drawn group, as many of its trials as it has, with
+        replacement. A group that is drawn c times contributes c*size
+        draws from its trials.
+    """
+    groups    = np.asarray(groups)
+    numtrials = len(groups)
+    members   = [np.flatnonzero(groups == gdx)
+        for gdx in range(int(np.max(groups))+1)]
+
+    groupcounts = bootstrap_counts(len(members), numboot)
+    counts = np.zeros(shape=(numboot, numtrials), dtype=np.int64)
+    # draw in blocks of replicas to limit memory of the drawn indices
+    blocksize = max(1, int(2**22 / numtrials))
+    for start in range(0, numboot, blocksize):
+        stop = min(start+blocksize, numboot)
+        for gdx, idx in enumerate(members):
+            size    = len(idx)
+            reps    = np.repeat(np.arange(0, stop-start),
+                groupcounts[start:stop, gdx]*size)
+            choices = np.random.randint(0, size, size=len(reps))
+            counts[start:stop, idx] = np.bincount(reps*size + choices,
+                minlength=(stop-start)*size).reshape(stop-start, size)
+    return counts
+
+def fft_precompute(data, steps, workers=None, dtype=ftype, offset=0.0):
+    """
+        Alternative to sm_precompute, returning the same terms.
+        The lagged products x_y for all steps are obtained at once from the
+        autocorrelation of each trial via fast fourier transform
+        (Wiener-Khinchin), O(numels log numels) per trial instead of one
+        O(numels) pass per step.
+        The remaining terms are read from cumulative sums.
+        `workers` sets the threads of scipy.fft, if available.
+        `dtype` and `offset` as for sm_precompute. With `offset=None`, the
+        terms stay relative to the mean of each trial.
+    """
+    numsteps  = len(steps)
+    numtrials = data.shape[0]
+    numels    = data.shape[1]
+
+    x_y   = np.empty(shape=(numsteps, numtrials), dtype=dtype)
+    x_x   = np.empty(shape=(numsteps, numtrials), dtype=dtype)
+    mx    = np.empty(shape=(numsteps, numtrials), dtype=dtype)
+    my    = np.empty(shape=(numsteps, numtrials), dtype=dtype)
+    mm    = np.empty(shape=(numtrials), dtype=ftype)
+    mm_squ= np.empty(shape=(numtrials), dtype=ftype)
+
+    # zero padding to avoid wrap around of the circular correlation
+    nfft = 1 << int(numels + np.max(steps) - 1).bit_length()
+
+    # transform blocks of trials to limit the memory footprint
+    blocksize = max(1, int(2**22 / nfft))
+    for start in range(0, numtrials, blocksize):
+        stop  = min(start+blocksize, numtrials)
+        block = np.asarray(data[start:stop], dtype=ftype)
+
+        # shifting by the trial mean improves precision of the transform
+        shift = np.mean(block, axis=1, keepdims=True)
+        cent  = block - shift
+
+        if scipy_fft is None:
+            spec = np.fft.rfft(cent, n=nfft, axis=1)
+            acf  = np.fft.irfft(spec.real**2 + spec.imag**2, n=nfft, axis=1)
+        else:
+            spec = scipy_fft.rfft(cent, n=nfft, axis=1, workers=workers)
+            acf  = scipy_fft.irfft(spec.real**2 + spec.imag**2, n=nfft,
+                axis=1, workers=workers)
+        acf  = acf[:, steps]
+
+        _centered_terms(cent, shift, acf, steps,
+            (mm, mm_squ, mx, my, x_y, x_x), start, stop, offset)
+
+    return mm, mm_squ, mx, my, x_y, x_x
+
+def _centered_terms(cent, shift, lagged, steps, out, start, stop,
+    offset=0.0):
+    """
+        Completes the terms of sm_precompute for the trials `start:stop`,
+        from trials `cent` that were shifted by their mean `shift` and
+        their lagged products `lagged` of shape (numtrials, numsteps).
+        Edge terms are read from cumulative sums, then the shift is undone,
+        up to the common `offset` (see sm_precompute). With `offset=None`,
+        the shift is kept, which is all the per-trial coefficients need.
+    """
+    mm, mm_squ, mx, my, x_y, x_x = out
+    numels = cent.shape[1]
+    nn     = (numels - steps).astype(ftype)
+
+    csum = np.zeros(shape=(stop-start, numels+1), dtype=ftype)
+    csqu = np.zeros(shape=(stop-start, numels+1), dtype=ftype)
+    np.cumsum(cent,    axis=1, out=csum[:, 1:])
+    np.cumsum(cent**2, axis=1, out=csqu[:, 1:])
+
+    front = csum[:, numels-steps]
+    back  = csum[:, -1:] - csum[:, steps]
+    squ   = csqu[:, numels-steps]
+
+    # undo the shift
+    rel = 0.0 if offset is None else shift - offset
+    x_y[:, start:stop] = (
+        (lagged + rel*(front+back))/nn + rel**2).T
+    x_x[:, start:stop] = (squ/nn + 2*rel*front/nn + rel**2).T
+    mx [:, start:stop] = (front/nn + rel).T
+    my [:, start:stop] = (back /nn + rel).T
+    mm    [start:stop] = csum[:, -1] + numels*shift[:, 0]
+    mm_squ[start:stop] = \
+        csqu[:, -1] + 2*shift[:, 0]*csum[:, -1] + numels*shift[:, 0]**2
+
+def blas_precompute(data, steps, dtype=ftype, offset=0.0):
+    """
+        Alternative to sm_precompute, returning the same terms, with numpy
+        only. Meant for systems without numba, where the kernels above
+        would run as python loops.
+        Each trial is cut into rows of `lagblock` values. For a block of
+        `lagblock` consecutive steps starting at k0, the matrix product of
+        these rows with the (overlapping) rows of twice the length, starting
+        at k0, holds all products x[j]*x[j+k] of the block. The lagged sums
+        are then the sums along the diagonals. Zero padding beyond the end
+        of the trial takes care of the edges, so the sums are exact.
+        The products run in BLAS, batched over trials.
+        `dtype` and `offset` as for sm_precompute. With `offset=None`, the
+        terms stay relative to the mean of each trial.
+    """
+    numsteps  = len(steps)
+    numtrials = data.shape[0]
+    numels    = data.shape[1]
+
+    x_y   = np.empty(shape=(numsteps, numtrials), dtype=dtype)
+    x_x   = np.empty(shape=(numsteps, numtrials), dtype=dtype)
+    mx    = np.empty(shape=(numsteps, numtrials), dtype=dtype)
+    my    = np.empty(shape=(numsteps, numtrials), dtype=dtype)
+    mm    = np.empty(shape=(numtrials), dtype=ftype)
+    mm_squ= np.empty(shape=(numtrials), dtype=ftype)
+
+    bb     = lagblock
+    numrow = -(-numels // bb)
+    blocks = np.unique(steps // bb)
+    # pad so that rows of length 2*bb exist from the last block of steps
+    numpad = (blocks[-1]+1)*bb + numrow*bb + bb
+    # indices of the diagonals, diag[d, c] = (c, c+d)
+    col  = np.arange(bb)
+    diag = col[np.newaxis, :] + col[:, np.newaxis]
+
+    # blocks of trials to limit the memory footprint
+    blocksize = max(1, int(2**22 / numpad))
+    for start in range(0, numtrials, blocksize):
+        stop  = min(start+blocksize, numtrials)
+        block = np.asarray(data[start:stop], dtype=ftype)
+
+        # shifting by the trial mean improves precision of the products
+        shift = np.mean(block, axis=1, keepdims=True)
+        cent  = block - shift
+
+        padded = np.zeros(shape=(stop-start, numpad), dtype=ftype)
+        padded[:, 0:numels] = cent
+        rows = padded[:, 0:numrow*bb].reshape(stop-start, numrow, bb)
+        rows = np.transpose(rows, (0, 2, 1))
+
+        lagged = np.empty(shape=(stop-start, numsteps), dtype=ftype)
+        for blk in blocks:
+            k0   = blk*bb
+            sel  = np.nonzero(steps // bb == blk)[0]
+            # overlapping rows as a view, like sliding_window_view but
+            # available for all supported numpy versions
+            wide = np.lib.stride_tricks.as_strided(padded[:, k0:],
+                shape=(stop-start, numrow, 2*bb),
+                strides=(padded.strides[0], bb*padded.strides[1],
+                    padded.strides[1]),
+                writeable=False)
+            prod = np.matmul(rows, np.ascontiguousarray(wide))
+            sums = np.sum(prod[:, col[np.newaxis, :], diag], axis=2)
+            lagged[:, sel] = sums[:, steps[sel] - k0]
+
+        _centered_terms(cent, shift, lagged, steps,
+            (mm, mm_squ, mx, my, x_y, x_x), start, stop, offset)
+
+    return mm, mm_squ, mx, my, x_y, x_x
+
+@jit(nopython=True, parallel=True, fastmath=True, cache=True)
+def lagged_sums(buf, start, steps, res):
+    """
+        Adds the lagged products buf[j-k]*buf[j] of all j >= start to res,
+        for every step k. Used to continue the sums of x_y block by block,
+        where buf[:start] holds the end of the previous block.
+    """
+    for idx in prange(len(steps)):
+        k = steps[idx]
+        total = ftype(0)
+        for j in range(max(start, k), buf.shape[0]):
+            total += buf[j-k]*buf[j]
+        res[idx] += total
+
+@jit(nopython=True, parallel=True, fastmath=True, cache=True)
+def windowed_update(data, steps, shift, sums, prev, start, window):
+    """
+        Moves the running sums of every trial and step from the window
+        data[:, prev:prev+window] to data[:, start:start+window], in place.
+        `sums` of shape (4, numtrials, numsteps) holds the sums of x, y,
+        x*x and x*y over the pairs x = data[t] - shift, y = data[t+k] - shift
+        with t in [start, start+window-k). Pairs that leave the window are
+        subtracted and those that enter are added, instead of summing the
+        whole window again. With `prev < 0`, or if the windows do not
+        overlap, the sums start from scratch.
+    """
+    N = data.shape[0]
+    numsteps = len(steps)
+
+    for jdx in prange(N*numsteps):
+        tdx = jdx // numsteps
+        idx = jdx %  numsteps
+        k = steps[idx]
+        n = window - k
+        c = shift[tdx]
+        if prev < 0 or start - prev >= n:
+            sums[:, tdx, idx] = 0
+            leave = (0, 0)
+            enter = (start, start+n)
+        else:
+            leave = (prev,   start  )
+            enter = (prev+n, start+n)
+        sx  = sums[0, tdx, idx]
+        sy  = sums[1, tdx, idx]
+        sxx = sums[2, tdx, idx]
+        sxy = sums[3, tdx, idx]
+        for j in range(leave[0], leave[1]):
+            x = ftype(data[tdx, j  ]) - c
+            y = ftype(data[tdx, j+k]) - c
+            sx  -= x
+            sy  -= y
+            sxx -= x*x
+            sxy -= x*y
+        for j in range(enter[0], enter[1]):
+            x = ftype(data[tdx, j  ]) - c
+            y = ftype(data[tdx, j+k]) - c
+            sx  += x
+            sy  += y
+            sxx += x*x
+            sxy += x*y
+        sums[0, tdx, idx] = sx
+        sums[1, tdx, idx] = sy
+        sums[2, tdx, idx] = sxx
+        sums[3, tdx, idx] = sxy
+
+@jit(nopython=True, parallel=False, fastmath=True, cache=True)
+def popcount(x):
+    """
+        Number of set bits of the uint64 `x`, compiled to the popcount
+        instruction where available.
+    """
+    x = x - ((x >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    x = (x & np.uint64(0x3333333333333333)) \
+        + ((x >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    x = (x + (x >> np.uint64(4))) & np.uint64(0x0f0f0f0f0f0f0f0f)
+    return np.int64((x * np.uint64(0x0101010101010101)) >> np.uint64(56))
+
+@jit(nopython=True, parallel=False, fastmath=True, cache=True)
+def packed_ones(words, counts, tdx, pos):
+    """
+        Number of ones in the bins `0:pos` of trial `tdx`, from the ones
+        before each word in `counts`.
+    """
+    wdx = pos // 64
+    rem = pos %  64
+    total = counts[tdx, wdx]
+    if rem > 0:
+        total += popcount(words[tdx, wdx] >> np.uint64(64 - rem))
+    return total
+
+@jit(nopython=True, parallel=True, fastmath=True, cache=True)
+def packed_precompute(words, numels, steps, dtype=ftype, offset=0.0):
+    """
+        Alternative to sm_precompute for binary data packed into bits,
+        returning the same terms. `words` holds the bins of each trial in
+        uint64, most significant bit first, followed by at least one word
+        of zeros (see PackedRaster).
+        The lagged product of 64 bins is the popcount of the AND of a word
+        with the word shifted by k bins. Bins beyond the end of the trial
+        are zero, so no masking is needed. For binary data x*x = x, and all
+        sums are exact integers.
+    """
+    numsteps  = steps.shape[0]
+    numtrials = words.shape[0]
+    numwords  = words.shape[1]
+
+    x_y   = np.empty(shape=(numsteps, numtrials), dtype=dtype)
+    x_x   = np.empty(shape=(numsteps, numtrials), dtype=dtype)
+    mx    = np.empty(shape=(numsteps, numtrials), dtype=dtype)
+    my    = np.empty(shape=(numsteps, numtrials), dtype=dtype)
+
+    # ones before each word
+    counts = np.zeros(shape=(numtrials, numwords+1), dtype=np.int64)
+    for tdx in prange(numtrials):
+        for wdx in range(numwords):
+            counts[tdx, wdx+1] = counts[tdx, wdx] + popcount(words[tdx, wdx])
+
+    mm     = counts[:, numwords].astype(ftype)
+    mm_squ = mm.copy()
+
+    for jdx in prange(numtrials*numsteps):
+        tdx = jdx // numsteps
+        idx = jdx %  numsteps
+        k   = steps[idx]
+        q   = k // 64
+        r   = np.uint64(k % 64)
+        total = np.int64(0)
+        for wdx in range((numels - k + 63) // 64):
+            y = words[tdx, wdx+q]
+            if r > 0:
+                y = (y << r) | (words[tdx, wdx+q+1] >> (np.uint64(64) - r))
+            total += popcount(words[tdx, wdx] & y)
+        nn    = ftype(numels - k)
+        front = packed_ones(words, counts, tdx, numels - k)
+        back  = counts[tdx, numwords] - packed_ones(words, counts, tdx, k)
+        mxv = front/nn
+        myv = back /nn
+        x_y[idx, tdx] = total/nn - offset*(mxv+myv) + offset**2
+        x_x[idx, tdx] = mxv - 2*offset*mxv + offset**2
+        mx [idx, tdx] = mxv - offset
+        my [idx, tdx] = myv - offset
+
+    return mm, mm_squ, mx, my, x_y, x_x
+
+@jit(nopython=True, parallel=True, fastmath=True, cache=True)
+def events_precompute(indices, offsets, numels, steps, dtype=ftype,
+    offset=0.0):
+    """
+        Alternative to sm_precompute for sparse data given as sorted bin
+        indices of events, returning the same terms. Trial `i` holds the
+        events `indices[offsets[i]:offsets[i+1]]`, several events in one bin
+        add up.
+        The lagged sum of step k is the number of pairs of events that are
+        k bins apart, so each event is only paired with the following events
+        up to the largest step: O(events * neighbours within maxstep),
+        independent of `numels`.
+        The edge terms are read from cumulative counts per bin. All sums are
+        exact integers.
+    """
+    numsteps  = steps.shape[0]
+    numtrials = offsets.shape[0] - 1
+    maxstep   = np.max(steps)
+
+    x_y   = np.empty(shape=(numsteps, numtrials), dtype=dtype)
+    x_x   = np.empty(shape=(numsteps, numtrials), dtype=dtype)
+    mx    = np.empty(shape=(numsteps, numtrials), dtype=dtype)
+    my    = np.empty(shape=(numsteps, numtrials), dtype=dtype)
+    mm    = np.empty(shape=(numtrials), dtype=ftype)
+    mm_squ= np.empty(shape=(numtrials), dtype=ftype)
+
+    for tdx in prange(numtrials):
+        ev = indices[offsets[tdx]:offsets[tdx+1]]
+        numev = ev.shape[0]
+
+        # number of pairs of events at each distance
+        pairs = np.zeros(maxstep+1, dtype=np.int64)
+        for p in range(numev):
+            for q in range(p+1, numev):
+                lag = ev[q] - ev[p]
+                if lag > maxstep:
+                    break
+                pairs[lag] += 1
+
+        # occupied bins, their counts and cumulative sums of counts
+        # and squared counts
+        bins = np.empty(numev, dtype=np.int64)
+        csum = np.zeros(numev+1, dtype=np.int64)
+        csqu = np.zeros(numev+1, dtype=np.int64)
+        numbins = 0
+        p = 0
+        while p < numev:
+            q = p
+            while q < numev and ev[q] == ev[p]:
+                q += 1
+            bins[numbins] = ev[p]
+            csum[numbins+1] = csum[numbins] + (q-p)
+            csqu[numbins+1] = csqu[numbins] + (q-p)**2
+            numbins += 1
+            p = q
+        bins = bins[0:numbins]
+        mm[tdx]     = csum[numbins]
+        mm_squ[tdx] = csqu[numbins]
+
+        for idx in range(numsteps):
+            k  = steps[idx]
+            nn = ftype(numels - k)
+            # occupied bins before numels-k, and before k
+            front = np.searchsorted(bins, numels - k)
+            head  = np.searchsorted(bins, k)
+            mxv = csum[front]                      /nn
+            myv = (csum[numbins] - csum[head])     /nn
+            x_y[idx, tdx] = pairs[k]/nn - offset*(mxv+myv) + offset**2
+            x_x[idx, tdx] = csqu[front]/nn - 2*offset*mxv + offset**2
+            mx [idx, tdx] = mxv - offset
+            my [idx, tdx] = myv - offset
+
+    return mm, mm_squ, mx, my, x_y, x_x
+
+@jit(nopython=True, parallel=True, fastmath=True, cache=True)
+def masked_precompute(data, valid, steps, dtype=ftype, offset=0.0):
+    """
+        Alternative to sm_precompute for data with gaps, returning the same
+        terms and the number of valid pairs, shape (numsteps, numtrials).
+        Only pairs (t, t+k) where both values are `valid` contribute, and
+        each term is normalized by the number of such pairs instead of T-k.
+        Invalid values (e.g. NaN) are never read.
+        The front and back sums depend on the validity of both values of a
+        pair, so instead of the cumulative sums of sm_precompute they are
+        accumulated with the lagged products, in one pass per step.
+        Values are shifted by the mean of the valid values of the trial.
+        `dtype` and `offset` as for sm_precompute, terms without any pair
+        are NaN.
+    """
+    numsteps  = steps.shape[0]
+    numtrials = data.shape[0]
+    numels    = data.shape[1]
+
+    x_y   = np.empty(shape=(numsteps, numtrials), dtype=dtype)
+    x_x   = np.empty(shape=(numsteps, numtrials), dtype=dtype)
+    mx    = np.empty(shape=(numsteps, numtrials), dtype=dtype)
+    my    = np.empty(shape=(numsteps, numtrials), dtype=dtype)
+    pairs = np.empty(shape=(numsteps, numtrials), dtype=ftype)
+    mm    = np.empty(shape=(numtrials), dtype=ftype)
+    mm_squ= np.empty(shape=(numtrials), dtype=ftype)
+    shift = np.empty(shape=(numtrials), dtype=ftype)
+
+    for tdx in prange(numtrials):
+        total = ftype(0)
+        squ   = ftype(0)
+        num   = 0
+        for j in range(numels):
+            if valid[tdx, j]:
+                x = ftype(data[tdx, j])
+                total += x
+                squ   += x*x
+                num   += 1
+        mm[tdx]     = total
+        mm_squ[tdx] = squ
+        shift[tdx]  = total/num if num > 0 else ftype(0)
+
+    for jdx in prange(numtrials*numsteps):
+        tdx = jdx // numsteps
+        idx = jdx %  numsteps
+        k = steps[idx]
+        c = shift[tdx]
+        num = 0
+        sx  = ftype(0)
+        sy  = ftype(0)
+        sxx = ftype(0)
+        sxy = ftype(0)
+        for j in range(numels-k):
+            if valid[tdx, j] and valid[tdx, j+k]:
+                x = ftype(data[tdx, j  ]) - c
+                y = ftype(data[tdx, j+k]) - c
+                num += 1
+                sx  += x
+                sy  += y
+                sxx += x*x
+                sxy += x*y
+        pairs[idx, tdx] = num
+        if num == 0:
+            x_y[idx, tdx] = np.nan
+            x_x[idx, tdx] = np.nan
+            mx [idx, tdx] = np.nan
+            my [idx, tdx] = np.nan
+        else:
+            # undo the shift, up to the common offset
+            rel = c - offset
+            mxv = sx/num
+            myv = sy/num
+            x_y[idx, tdx] = sxy/num + rel*(mxv+myv) + rel**2
+            x_x[idx, tdx] = sxx/num + 2*rel*mxv + rel**2
+            mx [idx, tdx] = mxv + rel
+            my [idx, tdx] = myv + rel
+
+    return (mm, mm_squ, mx, my, x_y, x_x), pairs
+
+def fft_masked_precompute(data, valid, steps, workers=None, dtype=ftype,
+    offset=0.0):
+    """
+        Alternative to masked_precompute via fast fourier transforms, see
+        fft_precompute. With invalid values set to zero, the number of
+        valid pairs, the front and back sums and the lagged products of all
+        steps are cross-correlations of the trial, its square and its
+        mask.
+    """
+    numsteps  = len(steps)
+    numtrials = data.shape[0]
+    numels    = data.shape[1]
+
+    x_y   = np.empty(shape=(numsteps, numtrials), dtype=dtype)
+    x_x   = np.empty(shape=(numsteps, numtrials), dtype=dtype)
+    mx    = np.empty(shape=(numsteps, numtrials), dtype=dtype)
+    my    = np.empty(shape=(numsteps, numtrials), dtype=dtype)
+    pairs = np.empty(shape=(numsteps, numtrials), dtype=ftype)
+    mm    = np.empty(shape=(numtrials), dtype=ftype)
+    mm_squ= np.empty(shape=(numtrials), dtype=ftype)
+
+    nfft = 1 << int(numels + np.max(steps) - 1).bit_length()
+
+    def rfft(a):
+        if scipy_fft is None:
+            return np.fft.rfft(a, n=nfft, axis=1)
+        return scipy_fft.rfft(a, n=nfft, axis=1, workers=workers)
+
+    def corr(a, b):
+        # sum_j a[j] * b[j+k], for the given steps
+        if scipy_fft is None:
+            res = np.fft.irfft(np.conj(a)*b, n=nfft, axis=1)
+        else:
+            res = scipy_fft.irfft(np.conj(a)*b, n=nfft, axis=1,
+                workers=workers)
+        return res[:, steps]
+
+    blocksize = max(1, int(2**22 / nfft))
+    for start in range(0, numtrials, blocksize):
+        stop  = min(start+blocksize, numtrials)
+        vld   = np.asarray(valid[start:stop], dtype=bool)
+        block = np.where(vld, np.asarray(data[start:stop], dtype=ftype), 0)
+
+        num   = np.sum(vld, axis=1, keepdims=True)
+        total = np.sum(block, axis=1, keepdims=True)
+        shift = total / np.maximum(num, 1)
+        cent  = np.where(vld, block - shift, 0)
+        mm    [start:stop] = total[:, 0]
+        mm_squ[start:stop] = np.sum(block**2, axis=1)
+
+        spec_v = rfft(vld.astype(ftype))
+        spec_c = rfft(cent)
+        spec_s = rfft(cent**2)
+        # counts are integers, undo the rounding of the transforms
+        nn  = np.rint(corr(spec_v, spec_v))
+        sx  = corr(spec_c, spec_v)
+        sy  = corr(spec_v, spec_c)
+        sxx = corr(spec_s, spec_v)
+        sxy = corr(spec_c, spec_c)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            nn_  = np.where(nn > 0, nn, np.nan)
+            mxv  = sx/nn_
+            myv  = sy/nn_
+            rel  = shift - offset
+            x_y[:, start:stop] = (sxy/nn_ + rel*(mxv+myv) + rel**2).T
+            x_x[:, start:stop] = (sxx/nn_ + 2*rel*mxv + rel**2).T
+            mx [:, start:stop] = (mxv + rel).T
+            my [:, start:stop] = (myv + rel).T
+        pairs[:, start:stop] = nn.T
+
+    return (mm, mm_squ, mx, my, x_y, x_x), pairs
+
+@jit(nopython=True, parallel=True, fastmath=True, cache=True)
+def block_precompute(data, blocksize, steps, dtype=ftype, offset=0.0):
+    """
+        Terms of sm_precompute for consecutive blocks of `blocksize` values
+        of each trial, for the block bootstrap. Block `b` holds the pairs
+        (t, t+k) whose first value lies in the block, where t+k may lie in
+        the following block. The sums over all blocks of a trial are then
+        those of the whole trial. Each term is normalized by the number of
+        pairs of its block, which is returned as well, shape
+        (numsteps, numtrials*numblocks) with blocks trial-major. Terms
+        without pairs are NaN. Returns mx, my, x_y and x_x only.
+        `dtype` and `offset` as for sm_precompute.
+    """
+    numsteps  = steps.shape[0]
+    numtrials = data.shape[0]
+    numels    = data.shape[1]
+    numblocks = (numels + blocksize - 1) // blocksize
+    numcols   = numtrials*numblocks
+
+    x_y   = np.empty(shape=(numsteps, numcols), dtype=dtype)
+    x_x   = np.empty(shape=(numsteps, numcols), dtype=dtype)
+    mx    = np.empty(shape=(numsteps, numcols), dtype=dtype)
+    my    = np.empty(shape=(numsteps, numcols), dtype=dtype)
+    pairs = np.empty(shape=(numsteps, numcols), dtype=ftype)
+
+    # values are shifted by the trial mean for precision
+    shift = np.empty(numtrials, dtype=ftype)
+    for tdx in prange(numtrials):
+        total = ftype(0)
+        for j in range(numels):
+            total += ftype(data[tdx, j])
+        shift[tdx] = total/numels
+
+    for jdx in prange(numcols*numsteps):
+        col = jdx // numsteps
+        idx = jdx %  numsteps
+        tdx = col // numblocks
+        k = steps[idx]
+        c = shift[tdx]
+        start = (col % numblocks)*blocksize
+        stop  = min(start+blocksize, numels-k)
+        sx  = ftype(0)
+        sy  = ftype(0)
+        sxx = ftype(0)
+        sxy = ftype(0)
+        for j in range(start, stop):
+            x = ftype(data[tdx, j  ]) - c
+            y = ftype(data[tdx, j+k]) - c
+            sx  += x
+            sy  += y
+            sxx += x*x
+            sxy += x*y
+        num = max(0, stop-start)
+        pairs[idx, col] = num
+        if num == 0:
+            x_y[idx, col] = np.nan
+            x_x[idx, col] = np.nan
+            mx [idx, col] = np.nan
+            my [idx, col] = np.nan
+        else:
+            # undo the shift, up to the common offset
+            rel = c - offset
+            mxv = sx/num
+            myv = sy/num
+            x_y[idx, col] = sxy/num + rel*(mxv+myv) + rel**2
+            x_x[idx, col] = sxx/num + 2*rel*mxv + rel**2
+            mx [idx, col] = mxv + rel
+            my [idx, col] = myv + rel
+
+    return (mx, my, x_y, x_x), pairs
+
+@jit(nopython=True, parallel=True, fastmath=True, cache=True)
+def population_precompute(data, chans, wts, ptr, steps):
+    """
+        Terms of sm_precompute for the activity of populations of channels,
+        without creating the array of population activities. `data` has
+        shape (numchannels, numtrials, numels) and population `g` is the
+        sum of the channels `chans[ptr[g]:ptr[g+1]]`, weighted by `wts`.
+        Parallelized over all pairs of populations and trials, which are
+        independent. Each pair is aggregated in tiles of `poptile` time
+        steps that stay in cache, and the lagged sums are continued tile by
+        tile from the last `maxstep` values, as in CoefficientAccumulator.
+        The edge terms are taken from the first and last `maxstep` values.
+        Returns the terms with trials population-major (shape
+        (numsteps, numpops*numtrials)), relative to zero, and the mean and
+        variance of each population and trial.
+    """
+    numpops   = ptr.shape[0] - 1
+    numtrials = data.shape[1]
+    numels    = data.shape[2]
+    numsteps  = steps.shape[0]
+    kmax      = np.max(steps)
+    numcols   = numpops*numtrials
+
+    x_y   = np.empty(shape=(numsteps, numcols), dtype=ftype)
+    x_x   = np.empty(shape=(numsteps, numcols), dtype=ftype)
+    mx    = np.empty(shape=(numsteps, numcols), dtype=ftype)
+    my    = np.empty(shape=(numsteps, numcols), dtype=ftype)
+    mm    = np.empty(shape=(numcols), dtype=ftype)
+    mm_squ= np.empty(shape=(numcols), dtype=ftype)
+    act   = np.empty(shape=(numcols), dtype=ftype)
+    var   = np.empty(shape=(numcols), dtype=ftype)
+
+    for col in prange(numcols):
+        gdx = col // numtrials
+        tdx = col %  numtrials
+        # the last kmax values of the population, followed by the tile
+        buf   = np.zeros(kmax+poptile, dtype=ftype)
+        head  = np.zeros(kmax, dtype=ftype)
+        lag   = np.zeros(numsteps, dtype=ftype)
+        c     = ftype(0)
+        total = ftype(0)
+        squ   = ftype(0)
+
+        for start in range(0, numels, poptile):
+            width = min(poptile, numels-start)
+            hist  = min(kmax, start)
+            for j in range(width):
+                buf[kmax+j] = 0
+            for q in range(ptr[gdx], ptr[gdx+1]):
+                cdx = chans[q]
+                w   = wts[q]
+                for j in range(width):
+                    buf[kmax+j] += w*ftype(data[cdx, tdx, start+j])
+
+            # shifting by the mean of the first tile improves precision
+            if start == 0:
+                first = ftype(0)
+                for j in range(width):
+                    first += buf[kmax+j]
+                c = first/width
+            for j in range(width):
+                buf[kmax+j] -= c
+                total += buf[kmax+j]
+                squ   += buf[kmax+j]**2
+            for j in range(max(0, min(width, kmax-start))):
+                head[start+j] = buf[kmax+j]
+
+            for idx in range(numsteps):
+                k = steps[idx]
+                partial = ftype(0)
+                for j in range(max(0, k-hist), width):
+                    partial += buf[kmax+j-k]*buf[kmax+j]
+                lag[idx] += partial
+
+            # keep the last kmax values
+            for j in range(kmax):
+                buf[j] = buf[width+j]
+
+        # sums over the first and last k values
+        hsum = np.zeros(kmax+1, dtype=ftype)
+        tsum = np.zeros(kmax+1, dtype=ftype)
+        tsqu = np.zeros(kmax+1, dtype=ftype)
+        for j in range(kmax):
+            hsum[j+1] = hsum[j] + head[j]
+            tsum[j+1] = tsum[j] + buf[kmax-1-j]
+            tsqu[j+1] = tsqu[j] + buf[kmax-1-j]**2
+        for idx in range(numsteps):
+            k   = steps[idx]
+            nn  = ftype(numels - k)
+            mxv = (total - tsum[k])/nn
+            myv = (total - hsum[k])/nn
+            x_y[idx, col] = lag[idx]/nn + c*(mxv+myv) + c**2
+            x_x[idx, col] = (squ - tsqu[k])/nn + 2*c*mxv + c**2
+            mx [idx, col] = mxv + c
+            my [idx, col] = myv + c
+        mm[col]     = total + numels*c
+        mm_squ[col] = squ + 2*c*total + numels*c**2
+        act[col]    = total/numels + c
+        var[col]    = (squ - total**2/numels)/(numels-1)
+
+    return (mm, mm_squ, mx, my, x_y, x_x), act, var
+
+def ts_from_sm_precompute(precomputed):
+    """
+        Per-trial coefficients, as from ts_precompute, assembled from the
+        terms of sm_precompute (or fft_precompute).
+    """
+    mm, mm_squ, mx, my, x_y, x_x = precomputed
+
+    return np.transpose((x_y - mx*my) / (x_x - mx**2))
+
 def sm_method_naive(data, steps):
     """
         Native version of stationary mean method.
@@ -231,7 +1306,10 @@ class CoefficientResult(namedtuple('CoefficientResultBase', [
     'description',
     'numtrials',
     'numboot',
-    'numsteps'])):
+    'numsteps',
+    'engine',
+    'precision',
+    'resampling'])):
     """
         Result returned by `coefficients()`. Subclassed from
         :obj:`~collections.namedtuple`.
@@ -277,15 +1355,36 @@ class CoefficientResult(namedtuple('CoefficientResultBase', [
         numsteps : int,
             Number of steps in `coefficients`, `steps` and `stderrs`.
 
-        bootstrapcrs : list
+        engine : str or None
+            The engine that computed the coefficients, e.g. the one
+            chosen by ``coefficients(engine='auto')``.
+
+        precision : str or None
+            Floating point type in which the per-trial terms were stored,
+            `'float64'` or `'float32'`. Sums are always accumulated in
+            `'float64'`.
+
+        resampling : str or None
+            How the replicas in `bootstrapcrs` were created, `'bootstrap'`,
+            `'jackknife'`, `'block'` or `'hierarchical'`. None if there are
+            no replicas.
+
+        bootstrapcrs : list or CoefficientResultSequence
             List containing the `numboot` :obj:`CoefficientResult` instances
             that were calculated from the resampled input data. The List is
             empty if bootstrapping was skipped (`numboot=0`).
+            For the jackknife, replica `i` leaves out trial `i`.
+            Returned by :func:`coefficients` as a lazy
+            :obj:`CoefficientResultSequence`, the coefficients of all
+            replicas are available as 2d array via
+            ``.bootstrapcrs.coefficients``.
 
-        trialcrs : list
+        trialcrs : list or CoefficientResultSequence
             List of the :obj:`CoefficientResult` instances calculated
             from individual trials. Only has length `numtrials` if the
             `trialseparated` method was used, otherwise it is empty.
+            Like `bootstrapcrs`, a lazy sequence when returned by
+            :func:`coefficients`.
 
         Note
         ----
@@ -345,7 +1444,10 @@ class CoefficientResult(namedtuple('CoefficientResultBase', [
         bootstrapcrs    = np.array([]),
         trialcrs        = np.array([]),
         description     = None,
-        desc            = None):
+        desc            = None,
+        engine          = None,
+        precision       = None,
+        resampling      = None):
 
         # given attr check
         coefficients    = np.asarray(coefficients)
@@ -355,12 +1457,15 @@ class CoefficientResult(namedtuple('CoefficientResultBase', [
         stderrs         = None if stderrs is None else np.asarray(stderrs)
         trialactivities = np.asarray(trialactivities)
         trialvariances  = np.asarray(trialvariances)
-        bootstrapcrs    = bootstrapcrs if isinstance(bootstrapcrs, list) else \
-            [bootstrapcrs]
-        trialcrs        = trialcrs if isinstance(trialcrs, list) else \
-            [trialcrs]
+        bootstrapcrs    = bootstrapcrs if isinstance(bootstrapcrs,
+            (list, CoefficientResultSequence)) else [bootstrapcrs]
+        trialcrs        = trialcrs if isinstance(trialcrs,
+            (list, CoefficientResultSequence)) else [trialcrs]
         description     = None if description is None else str(description)
         desc            = '' if description is None else str(description)
+        engine          = None if engine is None else str(engine)
+        precision       = None if precision is None else str(precision)
+        resampling      = None if resampling is None else str(resampling)
 
         # derived attr
         numtrials = len(trialactivities)
@@ -382,7 +1487,10 @@ class CoefficientResult(namedtuple('CoefficientResultBase', [
             description,
             numtrials,
             numboot,
-            numsteps)
+            numsteps,
+            engine,
+            precision,
+            resampling)
 
     # printed representation
     def __repr__(self):
@@ -396,92 +1504,2856 @@ class CoefficientResult(namedtuple('CoefficientResultBase', [
     def __eq__(self, other):
         return self is other
 
+class CoefficientResultView(CoefficientResult):
+    """
+        :obj:`CoefficientResult` that is created on access, by the lazy
+        :obj:`CoefficientResultSequence` and :obj:`CoefficientResultStack`.
 
- # for idx, k in enumerate(steps):
+        Every access creates a new instance. Views of the same element of
+        the same sequence compare equal, so that ``seq[0] == seq[0]`` and
+        ``seq[0] in seq`` hold like for lists.
+    """
 
-# ------------------------------------------------------------------ #
-# Wrapper
-# ------------------------------------------------------------------ #
+    # no __slots__, tuples allow no other slots than a __dict__
+    def __new__(cls, source, index, **kwargs):
+        self = super(CoefficientResultView, cls).__new__(cls, **kwargs)
+        self._source = source
+        self._index  = index
+        return self
 
-def coefficients(
-    data,
-    steps=None,
-    dt=1, dtunit='ms',
-    method=None,
-    numboot=100,
-    seed=5330,
-    description=None,
-    desc=None,
-    ):
+    def __eq__(self, other):
+        if isinstance(other, CoefficientResultView):
+            return self._source is other._source \
+                and self._index == other._index
+        return self is other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((id(self._source), self._index))
+
+class CoefficientResultSequence(Sequence):
     """
-        Calculates the coefficients of correlation :math:`r_k`.
+        Lazy, read-only list of :obj:`CoefficientResult` instances, used for
+        `bootstrapcrs` and `trialcrs`.
 
-        Parameters
+        Only the coefficients of all elements are stored, as one contiguous
+        2d array. A :obj:`CoefficientResult` is created when an element is
+        accessed.
+
+        Attributes
         ----------
-        data : ~numpy.ndarray
-            Input data, containing the time series of activity in the trial
-            structure. If a one dimensional array is provieded instead, we
-            assume a single trial and reshape the input.
+        coefficients : ~numpy.ndarray
+            Coefficients of all elements, of shape (len, numsteps).
 
-        steps : ~numpy.array, optional
-            Specify the steps :math:`k` for which to compute coefficients
-            :math:`r_k`.
-            If an array of length two is provided, e.g.
-            ``steps=(minstep, maxstep)``, all enclosed integer values will be
-            used.
-            Arrays larger than two are assumed to contain a manual choice of
-            steps. Strides other than one are possible.
+        trialactivities : ~numpy.ndarray
+            Mean activity of each element.
 
-        dt : float, optional
-            The size of each step in `dtunits`. Default is 1.
+        trialvariances : ~numpy.ndarray
+            Variance of the activity of each element.
 
-        dtunit : str, optional
-            Units of step size. Default is `'ms'`.
+        stderrs : ~numpy.ndarray or None
+            Standard errors of the coefficients of each element, same shape
+            as `coefficients`.
 
-        description : str, optional
+        engine : str or None
+            The engine that computed the coefficients.
+
+        precision : str or None
+            Floating point type of the per-trial terms.
+    """
+
+    def __init__(self,
+        coefficients,
+        trialactivities,
+        trialvariances,
+        steps,
+        dt          = 1.0,
+        dtunit      = 'ms',
+        label       = '',
+        description = None,
+        stderrs     = None,
+        engine      = None,
+        precision   = None):
+
+        self.coefficients    = np.asarray(coefficients)
+        self.trialactivities = np.asarray(trialactivities)
+        self.trialvariances  = np.asarray(trialvariances)
+        self.stderrs         = None if stderrs is None else np.asarray(stderrs)
+        self.steps           = steps
+        self.dt              = dt
+        self.dtunit          = dtunit
+        self.label           = label
+        self.description     = description
+        self.engine          = engine
+        self.precision       = precision
+
+    def __len__(self):
+        return self.coefficients.shape[0]
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        idx = operator.index(idx)
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError('CoefficientResultSequence index out of range')
+
+        tempdesc = '{} {}'.format(self.label, idx)
+        if self.description is not None:
+            tempdesc = '{} ({})'.format(self.description, tempdesc)
+        coefficients, activity, variance = self._element(idx)
+        return CoefficientResultView(self, idx,
+            coefficients    = coefficients,
+            trialactivities = activity,
+            trialvariances  = variance,
+            steps           = self.steps,
+            stderrs         = None if self.stderrs is None \
+                else self.stderrs[idx],
+            dt              = self.dt,
+            dtunit          = self.dtunit,
+            description     = tempdesc,
+            engine          = self.engine,
+            precision       = self.precision)
+
+    def _element(self, idx):
+        return self.coefficients[idx], self.trialactivities[idx:idx+1], \
+            self.trialvariances[idx:idx+1]
+
+    def __repr__(self):
+        return '<%s.%s of %d elements at %s>' % (
+        self.__class__.__module__,
+        self.__class__.__name__,
+        len(self),
+        hex(id(self))
+    )
+
+class CoefficientResultStream(CoefficientResultSequence):
+    """
+        Lazy, read-only list of the bootstrap replicas of
+        ``coefficients(streaming=True)``, used for `bootstrapcrs`.
+
+        The replicas are not stored. When accessed, the batch of
+        `streamsize` replicas that holds the element is computed again, from
+        the per-trial terms and the state of the random number generator
+        at the start of the batch. The last batch is cached, so that
+        iterating over all replicas (as :func:`fit` does) only needs the
+        memory of one batch.
+
+        Attributes
+        ----------
+        coefficients, trialactivities, trialvariances : ~numpy.ndarray
+            As for :obj:`CoefficientResultSequence`, but computed for all
+            replicas on access, which needs the memory that streaming
+            avoids.
+    """
+
+    def __init__(self,
+        batches,
+        steps,
+        dt          = 1.0,
+        dtunit      = 'ms',
+        label       = '',
+        description = None,
+        engine      = None,
+        precision   = None):
+
+        self._batches    = batches
+        self.stderrs     = None
+        self.steps       = steps
+        self.dt          = dt
+        self.dtunit      = dtunit
+        self.label       = label
+        self.description = description
+        self.engine      = engine
+        self.precision   = precision
+
+    def __len__(self):
+        return self._batches.numboot
+
+    def _element(self, idx):
+        coefficients, activities, variances = \
+            self._batches.batch(idx // streamsize)
+        pos = idx % streamsize
+        return coefficients[pos], activities[pos:pos+1], \
+            variances[pos:pos+1]
+
+    def _all(self, which):
+        numbatches = -(-len(self) // streamsize)
+        return np.concatenate([self._batches.batch(bdx)[which]
+            for bdx in range(numbatches)])
+
+    @property
+    def coefficients(self):
+        return self._all(0)
+
+    @property
+    def trialactivities(self):
+        return self._all(1)
+
+    @property
+    def trialvariances(self):
+        return self._all(2)
+
+class CoefficientResultStack(Sequence):
+    """
+        Results of :func:`coefficients` for input of
+        ``shape(numchannels, numtrials, datalength)``, one
+        :obj:`CoefficientResult` per channel (or per population, with the
+        `populations` argument). All channels share the same steps and the
+        same bootstrap replicas (the same resampled trials).
+
+        The results are stored as stacked arrays with the channel as
+        first axis. Indexing creates the :obj:`CoefficientResult` of a
+        channel, whose arrays are views into the stack.
+
+        Attributes
+        ----------
+        coefficients : ~numpy.ndarray
+            Coefficients of all channels, of shape (numchannels, numsteps).
+
+        stderrs : ~numpy.ndarray or None
+            Standard errors, same shape as `coefficients`, or None if
+            bootstrapping was skipped.
+
+        trialactivities : ~numpy.ndarray
+            Mean activity of each channel and trial, shape
+            (numchannels, numtrials).
+
+        trialvariances : ~numpy.ndarray
+            Variance of the activity of each channel and trial.
+
+        bscoefficients : ~numpy.ndarray or None
+            Coefficients of the bootstrap (or jackknife) replicas, shape
+            (numchannels, numboot, numsteps).
+
+        trialcoefficients : ~numpy.ndarray or None
+            Coefficients of each trial, shape
+            (numchannels, numtrials, numsteps), for the `trialseparated`
+            method.
+
+        steps, dt, dtunit, description, engine, precision, resampling
+            As for :obj:`CoefficientResult`, the same for all channels.
+
+        label : str
+            What the entries are, `'Channel'` or `'Population'`.
+
+        names : ~numpy.ndarray or None
+            Name of each entry (e.g. the population labels), used in the
+            descriptions. None to use the index.
+
+        Example
+        -------
+        .. code-block:: python
+
+            import mrestimator as mre
+
+            # 16 channels with 10 trials each
+            data = mre.simulate_branching(m=0.98, a=10, numtrials=160)
+            data = data.reshape(16, 10, -1)
+
+            rks = mre.coefficients(data, steps=(1, 500))
+            print(rks.coefficients.shape)
+
+            ft = mre.fit(rks[3])
+        ..
+    """
+
+    def __init__(self,
+        coefficients,
+        trialactivities,
+        trialvariances,
+        steps,
+        dt                = 1.0,
+        dtunit            = 'ms',
+        stderrs           = None,
+        bscoefficients    = None,
+        bsactivities      = None,
+        bsvariances       = None,
+        trialcoefficients = None,
+        description       = None,
+        engine            = None,
+        precision         = None,
+        resampling        = None,
+        label             = 'Channel',
+        names             = None):
+
+        self.coefficients      = np.asarray(coefficients)
+        self.trialactivities   = np.asarray(trialactivities)
+        self.trialvariances    = np.asarray(trialvariances)
+        self.steps             = steps
+        self.dt                = dt
+        self.dtunit            = dtunit
+        self.stderrs           = stderrs
+        self.bscoefficients    = bscoefficients
+        self.bsactivities      = bsactivities
+        self.bsvariances       = bsvariances
+        self.trialcoefficients = trialcoefficients
+        self.description       = description
+        self.engine            = engine
+        self.precision         = precision
+        self.resampling        = resampling
+        self.label             = label
+        self.names             = names
+
+    def __len__(self):
+        return self.coefficients.shape[0]
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        idx = operator.index(idx)
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError('CoefficientResultStack index out of range')
+
+        description = '{} {}'.format(self.label,
+            idx if self.names is None else self.names[idx])
+        if self.description is not None:
+            description = '{} ({})'.format(self.description, description)
+
+        trialcrs = []
+        if self.trialcoefficients is not None:
+            trialcrs = CoefficientResultSequence(
+                coefficients    = self.trialcoefficients[idx],
+                trialactivities = self.trialactivities[idx],
+                trialvariances  = self.trialvariances[idx],
+                steps           = self.steps,
+                dt              = self.dt,
+                dtunit          = self.dtunit,
+                label           = 'Trial',
+                description     = description,
+                engine          = self.engine,
+                precision       = self.precision)
+        bootstrapcrs = []
+        if self.bscoefficients is not None:
+            bootstrapcrs = CoefficientResultSequence(
+                coefficients    = self.bscoefficients[idx],
+                trialactivities = self.bsactivities[idx],
+                trialvariances  = self.bsvariances[idx],
+                steps           = self.steps,
+                dt              = self.dt,
+                dtunit          = self.dtunit,
+                label           = '{} Replica'.format(
+                    self.resampling.capitalize()),
+                description     = description,
+                engine          = self.engine,
+                precision       = self.precision)
+
+        return CoefficientResultView(self, idx,
+            coefficients    = self.coefficients[idx],
+            trialactivities = self.trialactivities[idx],
+            trialvariances  = self.trialvariances[idx],
+            steps           = self.steps,
+            stderrs         = None if self.stderrs is None \
+                else self.stderrs[idx],
+            trialcrs        = trialcrs,
+            bootstrapcrs    = bootstrapcrs,
+            dt              = self.dt,
+            dtunit          = self.dtunit,
+            description     = description,
+            engine          = self.engine,
+            precision       = self.precision,
+            resampling      = self.resampling)
+
+    def __repr__(self):
+        return '<%s.%s of %d channels at %s>' % (
+        self.__class__.__module__,
+        self.__class__.__name__,
+        len(self),
+        hex(id(self))
+    )
+
+
+ # for idx, k in enumerate(steps):
+
+# ------------------------------------------------------------------ #
+# Input types
+# ------------------------------------------------------------------ #
+
+class PackedRaster:
+    """
+        Binary spike raster (zero or one event per time bin) with the bins
+        of each trial packed into bits, using 64 times less memory than an
+        array of integers. Accepted by :func:`coefficients` in place of the
+        `ndarray` of ``shape(numtrials, datalength)``, where the lagged
+        products are computed directly on the bits.
+
+        Parameters
+        ----------
+        bits : ~numpy.ndarray
+            Packed bins of ``shape(numtrials, ceil(numels/8))`` and type
+            `uint8`, as returned by ``np.packbits(raster, axis=1)``
+            (the first bin in the most significant bit).
+
+        numels : int
+            Number of time bins in each trial, as packing pads the last
+            byte.
+
+        Attributes
+        ----------
+        bits : ~numpy.ndarray
+            The packed bins.
+
+        numels : int
+            Number of time bins in each trial.
+
+        shape : tuple
+            Shape of the unpacked raster, ``(numtrials, numels)``.
+
+        Example
+        -------
+        .. code-block:: python
+
+            import numpy as np
+            import mrestimator as mre
+
+            # 10 trials of one hour, in bins of 0.1 ms
+            raster = np.random.rand(10, 36000000) < 0.001
+            packed = mre.PackedRaster.from_dense(raster)
+
+            rk = mre.coefficients(packed, steps=(1, 10000), dt=0.1)
+        ..
+    """
+
+    def __init__(self, bits, numels):
+        bits   = np.asarray(bits)
+        numels = int(numels)
+        if bits.ndim == 1:
+            bits = bits.reshape(1, -1)
+        if bits.ndim != 2 or bits.dtype != np.uint8:
+            log.exception('Packed bits need to be a two dimensional ' +
+                'array of type uint8')
+            raise ValueError
+        if numels < 1 or bits.shape[1] != -(-numels // 8):
+            log.exception('{} bytes per trial do not match {} bins'.format(
+                bits.shape[1], numels))
+            raise ValueError
+        # padding bits of the last byte have to be zero
+        mask = np.uint8((0xff << (8 - numels % 8)) & 0xff) \
+            if numels % 8 > 0 else np.uint8(0xff)
+        if np.any(bits[:, -1] & ~mask):
+            bits = bits.copy()
+            bits[:, -1] &= mask
+        self.bits   = bits
+        self.numels = numels
+
+    @classmethod
+    def from_dense(cls, data):
+        """
+            Packs an array of zeros and ones of ``shape(numtrials,
+            datalength)``.
+        """
+        data = np.asarray(data)
+        if data.ndim == 1:
+            data = data.reshape(1, -1)
+        if not np.all((data == 0) | (data == 1)):
+            log.exception('A packed raster can only hold zeros and ones')
+            raise ValueError
+        return cls(np.packbits(data.astype(np.uint8), axis=1), data.shape[1])
+
+    @property
+    def shape(self):
+        return (self.bits.shape[0], self.numels)
+
+    def __len__(self):
+        return self.bits.shape[0]
+
+    def unpack(self):
+        """
+            The raster as `ndarray` of type `uint8`.
+        """
+        return np.unpackbits(self.bits, axis=1)[:, 0:self.numels]
+
+    def ones(self):
+        """
+            Number of ones (events) in each trial.
+        """
+        table = np.array([bin(i).count('1') for i in range(256)],
+            dtype=np.uint8)
+        return np.sum(table[self.bits], axis=1, dtype=np.int64)
+
+    def words(self):
+        """
+            The bins as uint64 words, most significant bit first, followed
+            by one extra word of zeros.
+        """
+        numtrials, numbytes = self.bits.shape
+        numwords = -(-numbytes // 8) + 1
+        padded = np.zeros(shape=(numtrials, 8*numwords), dtype=np.uint8)
+        padded[:, 0:numbytes] = self.bits
+        return padded.view('>u8').astype(np.uint64)
+
+    def __repr__(self):
+        return '<%s.%s of %d trials with %d bins at %s>' % (
+        self.__class__.__module__,
+        self.__class__.__name__,
+        self.shape[0],
+        self.shape[1],
+        hex(id(self))
+    )
+
+def _bin_indices(times, dt, tmin=0):
+    """
+        Bins of size `dt` of the `times`, with edges ``tmin + i*dt``.
+        The division alone may round times on an edge into the previous
+        bin (e.g. 0.003/0.001 < 3), so the estimate is corrected against
+        the edges themselves.
+    """
+    times = np.asarray(times, dtype=ftype)
+    idx = np.floor((times - tmin) / dt).astype(np.int64)
+    idx += (tmin + (idx+1)*dt <= times)
+    idx -= (tmin + idx*dt > times)
+    return idx
+
+class SpikeTimes:
+    """
+        Sparse input, holding the times of events (e.g. spikes) of each
+        trial instead of the binned activity. Accepted by
+        :func:`coefficients` in place of the `ndarray` of
+        ``shape(numtrials, datalength)``, where the coefficients are
+        computed from the distances between events, without creating the
+        binned array. This pays off for low rates and fine time steps.
+
+        Events are assigned to bins of size `dt`, several events in one bin
+        add up. Bin `i` spans ``[tmin + i*dt, tmin + (i+1)*dt)``, as the
+        edges ``tmin + dt*np.arange(numels+1)`` of :func:`numpy.histogram`,
+        so that events on an edge go to the later bin.
+
+        Parameters
+        ----------
+        times : list of ~numpy.ndarray
+            Times of the events, one array per trial. If `dt` is `None`,
+            the times are taken as (integer) bin indices.
+
+        dt : float, optional
+            Size of the bins in units of the `times`. Pass the same value
+            to :func:`coefficients`, to get the steps in these units.
+
+        numels : int, optional
+            Number of bins in each trial. Per default, the trials end with
+            the bin of the last event.
+
+        tmin : float, optional
+            Time of the start of each trial. Default is 0.
+
+        Attributes
+        ----------
+        indices : ~numpy.ndarray
+            Sorted bin indices of the events of all trials, concatenated.
+
+        offsets : ~numpy.ndarray
+            The events of trial `i` are ``indices[offsets[i]:offsets[i+1]]``.
+
+        numels : int
+            Number of bins in each trial.
+
+        shape : tuple
+            Shape of the binned activity, ``(numtrials, numels)``.
+
+        Example
+        -------
+        .. code-block:: python
+
+            import numpy as np
+            import mrestimator as mre
+
+            # spike times in seconds, 5 trials of 10 minutes
+            times = [np.sort(np.random.uniform(0, 600, 3000))
+                for trial in range(5)]
+
+            # bins of 0.1 ms
+            spikes = mre.SpikeTimes(times, dt=1e-4, numels=6000000)
+            rk = mre.coefficients(spikes, steps=(1, 1000), dt=0.1,
+                dtunit='ms')
+        ..
+    """
+
+    def __init__(self, times, dt=None, numels=None, tmin=0):
+        if isinstance(times, np.ndarray) and times.ndim == 1:
+            times = [times]
+        indices = []
+        for trial in times:
+            trial = np.asarray(trial).ravel()
+            if dt is None:
+                if trial.size > 0 and \
+                    not np.all(np.mod(trial, 1) == 0):
+                    log.exception('Event times need a bin size dt, ' +
+                        'or have to be integer bin indices')
+                    raise ValueError
+                idx = trial.astype(np.int64)
+            else:
+                idx = _bin_indices(trial, float(dt), tmin)
+            indices.append(np.sort(idx))
+        if len(indices) == 0:
+            log.exception('Provide the event times of at least one trial')
+            raise ValueError
+
+        lengths = np.array([len(idx) for idx in indices], dtype=np.int64)
+        self.offsets = np.zeros(len(indices)+1, dtype=np.int64)
+        np.cumsum(lengths, out=self.offsets[1:])
+        self.indices = np.concatenate(indices)
+        if np.any(self.indices < 0):
+            log.exception('Events before the start of the trial')
+            raise ValueError
+
+        last = int(np.max(self.indices)) + 1 if self.indices.size > 0 else 1
+        if numels is None:
+            numels = last
+        numels = int(numels)
+        if numels < last:
+            log.exception('Events beyond the end of the trial, ' +
+                'numels needs to be at least {}'.format(last))
+            raise ValueError
+        self.numels = numels
+
+    @property
+    def shape(self):
+        return (len(self.offsets)-1, self.numels)
+
+    def __len__(self):
+        return len(self.offsets)-1
+
+    def counts(self):
+        """
+            Number of events in each trial.
+        """
+        return np.diff(self.offsets)
+
+    def squares(self):
+        """
+            Sum of the squared binned activity of each trial.
+        """
+        res = np.zeros(len(self), dtype=np.int64)
+        for tdx in range(len(self)):
+            _, cnt = np.unique(
+                self.indices[self.offsets[tdx]:self.offsets[tdx+1]],
+                return_counts=True)
+            res[tdx] = np.sum(cnt**2)
+        return res
+
+    def to_dense(self, dtype=np.int64):
+        """
+            The binned activity as `ndarray` of ``shape(numtrials, numels)``.
+        """
+        res = np.zeros(self.shape, dtype=dtype)
+        for tdx in range(len(self)):
+            np.add.at(res[tdx],
+                self.indices[self.offsets[tdx]:self.offsets[tdx+1]], 1)
+        return res
+
+    def __repr__(self):
+        return '<%s.%s of %d trials with %d events at %s>' % (
+        self.__class__.__module__,
+        self.__class__.__name__,
+        len(self),
+        len(self.indices),
+        hex(id(self))
+    )
+
+class RaggedTrials:
+    """
+        Trials of different length, stored as one concatenated buffer and
+        the offsets where each trial starts. Accepted by
+        :func:`coefficients` in place of the `ndarray` of
+        ``shape(numtrials, datalength)``, without truncating or padding
+        the trials. Returned by :func:`input_handler` for files of
+        different length.
+
+        Each trial contributes to the coefficient :math:`r_k` with weight
+        :math:`T_i-k`, its number of pairs of values :math:`k` steps apart.
+        Trials that are too short for a step do not contribute to it.
+
+        Parameters
+        ----------
+        trials : list of ~numpy.ndarray
+            One dimensional array of each trial. They are concatenated into
+            a new buffer, see :meth:`from_buffer` to avoid this copy.
+
+        Attributes
+        ----------
+        data : ~numpy.ndarray
+            All trials, concatenated.
+
+        offsets : ~numpy.ndarray
+            Trial `i` is ``data[offsets[i]:offsets[i+1]]``.
+
+        Example
+        -------
+        .. code-block:: python
+
+            import mrestimator as mre
+
+            trials = [
+                mre.simulate_branching(m=0.98, a=10, length=length)[0]
+                for length in [5000, 20000, 12000]]
+
+            rk = mre.coefficients(mre.RaggedTrials(trials), steps=(1, 2000))
+        ..
+    """
+
+    def __init__(self, trials):
+        trials = [np.asarray(trial).ravel() for trial in trials]
+        if len(trials) == 0:
+            log.exception('Provide at least one trial')
+            raise ValueError
+        offsets = np.zeros(len(trials)+1, dtype=np.int64)
+        np.cumsum([len(trial) for trial in trials], out=offsets[1:])
+        self._set(np.concatenate(trials), offsets)
+
+    @classmethod
+    def from_buffer(cls, data, offsets):
+        """
+            Uses the (possibly memory mapped) one dimensional `data` as
+            buffer, without copying. Trial `i` is
+            ``data[offsets[i]:offsets[i+1]]``.
+        """
+        res = cls.__new__(cls)
+        res._set(data, offsets)
+        return res
+
+    def _set(self, data, offsets):
+        offsets = np.asarray(offsets, dtype=np.int64)
+        if data.ndim != 1 or offsets.ndim != 1 or len(offsets) < 2 \
+            or offsets[0] != 0 or offsets[-1] != len(data) \
+            or np.any(np.diff(offsets) < 2):
+            log.exception('Offsets need to start at zero, end at the ' +
+                'length of the buffer and trials need at least two values')
+            raise ValueError
+        self.data    = data
+        self.offsets = offsets
+
+    @property
+    def shape(self):
+        """
+            ``(numtrials, length of the longest trial)``
+        """
+        return (len(self), int(np.max(self.lengths())))
+
+    def __len__(self):
+        return len(self.offsets)-1
+
+    def __getitem__(self, idx):
+        idx = operator.index(idx)
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError('RaggedTrials index out of range')
+        return self.data[self.offsets[idx]:self.offsets[idx+1]]
+
+    def lengths(self):
+        """
+            Number of values in each trial.
+        """
+        return np.diff(self.offsets)
+
+    def means(self):
+        """
+            Mean of each trial.
+        """
+        return np.array([np.mean(trial, dtype=ftype) for trial in self])
+
+    def variances(self):
+        """
+            Variance of each trial, with `ddof=1`.
+        """
+        return np.array([np.var(trial, ddof=1, dtype=ftype)
+            for trial in self])
+
+    def __repr__(self):
+        return '<%s.%s of %d trials with %d values at %s>' % (
+        self.__class__.__module__,
+        self.__class__.__name__,
+        len(self),
+        len(self.data),
+        hex(id(self))
+    )
+
+class TrialFiles:
+    """
+        Trials of equal length that are stored in several arrays, e.g. one
+        (memory mapped) file per trial, without stacking them into one
+        array. Accepted by :func:`coefficients` in place of the `ndarray`
+        of ``shape(numtrials, datalength)``, where the `'tiled'` engine
+        (default) reads the arrays one after another. Other engines stack
+        them into memory first. Returned by :func:`input_handler` for
+        several files with `mmap_mode`.
+
+        Parameters
+        ----------
+        parts : list of ~numpy.ndarray
+            Arrays of ``shape(numtrials, datalength)``, or one dimensional
+            for a single trial, all with the same `datalength`. They are
+            kept as they are, so memory maps are not read.
+
+        Attributes
+        ----------
+        parts : list of ~numpy.ndarray
+            The two dimensional arrays of trials.
+
+        Example
+        -------
+        .. code-block:: python
+
+            import numpy as np
+            import mrestimator as mre
+
+            # one file per trial
+            files = mre.TrialFiles([np.load(fname, mmap_mode='r')
+                for fname in ['trial_0.npy', 'trial_1.npy', 'trial_2.npy']])
+            rk = mre.coefficients(files, steps=(1, 500))
+        ..
+    """
+
+    def __init__(self, parts):
+        parts = [part.reshape((1, len(part))) if len(part.shape) == 1
+            else part for part in parts]
+        if len(parts) == 0 or any(len(part.shape) != 2 for part in parts):
+            log.exception('Provide at least one array of ' +
+                'shape(numtrials, datalength)')
+            raise ValueError
+        if len(set(part.shape[1] for part in parts)) > 1:
+            log.exception('All trials need the same length, ' +
+                'use RaggedTrials for trials of different length')
+            raise ValueError
+        self.parts = parts
+
+    @property
+    def shape(self):
+        """
+            ``(numtrials, datalength)``
+        """
+        return (len(self), self.parts[0].shape[1])
+
+    def __len__(self):
+        return sum(part.shape[0] for part in self.parts)
+
+    def __iter__(self):
+        for part in self.parts:
+            for trial in part:
+                yield trial
+
+    def to_array(self):
+        """
+            All trials stacked into one `ndarray`, in memory.
+        """
+        return np.vstack(self.parts)
+
+    def __repr__(self):
+        return '<%s.%s of %d trials in %d arrays at %s>' % (
+        self.__class__.__module__,
+        self.__class__.__name__,
+        len(self),
+        len(self.parts),
+        hex(id(self))
+    )
+
+# ------------------------------------------------------------------ #
+# Engine selection
+# ------------------------------------------------------------------ #
+
+# seconds per unit of work of each method and engine (see _engine_work),
+# for a single thread. rough defaults, measured once on one laptop (numba,
+# scipy.fft and openblas), that only get the order of magnitude right on
+# other machines. the fused kernel of ts does more per pair of values than
+# the one of sm. replaced by the results of benchmark_engines(), if saved
+# to disk
+_default_engine_costs = {
+    'trialseparated' : {'direct' : 9e-10, 'fft' : 2.7e-9, 'blas' : 2.2e-10},
+    'stationarymean' : {'direct' : 7e-10, 'fft' : 2.7e-9, 'blas' : 2.2e-10}}
+_engine_costs = None
+
+def _engine_costs_file():
+    return os.path.join(ut._targetdir or '', 'engine_costs.json')
+
+def _engine_work(engine, numtrials, numels, steps):
+    """
+        Work of an engine in arbitrary units, proportional to its run time.
+        `'direct'` has one pass over the trial per step, `'fft'` one
+        transform of the padded trial for all steps and `'blas'` one
+        matrix product per block of `lagblock` consecutive steps.
+    """
+    if engine == 'direct':
+        return numtrials * float(np.sum(numels - steps))
+    elif engine == 'fft':
+        nfft = 1 << int(numels + np.max(steps) - 1).bit_length()
+        return numtrials * nfft * np.log2(nfft)
+    elif engine == 'blas':
+        numblocks = len(np.unique(steps // lagblock))
+        return numtrials * float(numels) * numblocks * lagblock
+
+def _load_engine_costs():
+    global _engine_costs
+    if _engine_costs is None:
+        _engine_costs = {method : dict(costs)
+            for method, costs in _default_engine_costs.items()}
+        fname = _engine_costs_file()
+        if os.path.isfile(fname):
+            try:
+                with open(fname) as f:
+                    saved = json.load(f)
+                for method in _engine_costs:
+                    _engine_costs[method].update(saved.get(method, {}))
+                log.debug('Loaded engine costs from {}'.format(fname))
+            except Exception as e:
+                log.debug('Could not read engine costs from {}'.format(
+                    fname), exc_info=True)
+    return _engine_costs
+
+def _choose_engine(numtrials, numels, steps, method):
+    """
+        Engine with the lowest predicted run time for `method`. The engines
+        that are parallelized over threads ('direct' via numba, 'fft' via
+        scipy) are assumed to scale linearly with the number of threads.
+        Memory maps are not passed here, they always use 'tiled'.
+    """
+    costs   = _load_engine_costs()[method]
+    threads = _current_threads()
+    candidates = ['fft', 'blas']
+    if use_numba:
+        candidates.append('direct')
+    predicted = dict()
+    for engine in candidates:
+        predicted[engine] = costs[engine] \
+            * _engine_work(engine, numtrials, numels, steps)
+        if engine == 'direct' or (engine == 'fft' and scipy_fft is not None):
+            predicted[engine] /= threads
+    engine = min(predicted, key=predicted.get)
+    log.debug('Predicted run times {}, choosing \'{}\''.format(
+        predicted, engine))
+    return engine
+
+def benchmark_engines(save=False, numtrials=8, numels=2**15, maxstep=256):
+    """
+        Measures the speed of the engines of :func:`coefficients` on this
+        machine, to calibrate the choice of ``engine='auto'``.
+
+        Runs each engine on random data, for both methods, which differ in
+        their cost per value. The measured costs replace the rough defaults
+        for the rest of the session and, with `save`, are stored on disk.
+
+        Parameters
+        ----------
+        save : bool or str, optional
+            Write the results to disk. `True` writes ``engine_costs.json``
+            to the target directory (see
+            :func:`~mrestimator.utility.set_targetdir`), where later
+            sessions pick it up. A string gives the path of the file to
+            write instead. Default is `False`, nothing is written.
+
+        numtrials, numels, maxstep : int, optional
+            Size of the benchmark data and steps from 1 to `maxstep`.
+
+        Returns
+        -------
+        : dict
+            Seconds per unit of work of each engine, for one thread, by
+            method (`'trialseparated'` and `'stationarymean'`).
+    """
+    global _engine_costs
+    import time
+
+    rng   = np.random.RandomState(5330)
+    data  = rng.poisson(10, size=(numtrials, numels)).astype(ftype)
+    steps = np.arange(1, maxstep+1)
+    threads = _current_threads()
+
+    costs = {method : dict(methodcosts)
+        for method, methodcosts in _load_engine_costs().items()}
+    for method in costs:
+        for engine in ['direct', 'fft', 'blas']:
+            if engine == 'direct' and not use_numba:
+                continue
+            # the same per-trial terms as coefficients(), the first call
+            # compiles the numba kernels
+            _precompute(data[:, 0:2*maxstep], steps, method, engine)
+            best = np.inf
+            for _ in range(3):
+                start = time.perf_counter()
+                _precompute(data, steps, method, engine)
+                best = min(best, time.perf_counter() - start)
+            costs[method][engine] = float(
+                best / _engine_work(engine, numtrials, numels, steps))
+            if engine == 'direct' \
+                or (engine == 'fft' and scipy_fft is not None):
+                costs[method][engine] *= threads
+            log.debug('Engine \'{}\' took {:.3g} s for \'{}\''.format(
+                engine, best, method))
+
+    _engine_costs = costs
+    if save is not False and save is not None:
+        fname = _engine_costs_file() if save is True else save
+        try:
+            with open(fname, 'w') as f:
+                json.dump(costs, f)
+            ut._set_permissions(fname)
+            log.info('Saved engine costs to {}'.format(fname))
+        except Exception as e:
+            log.warning('Could not save engine costs to {}'.format(fname))
+
+    return costs
+
+# ------------------------------------------------------------------ #
+# Wrapper
+# ------------------------------------------------------------------ #
+
+def _check_steps(steps, numels):
+    """
+        Converts the `steps` argument of `coefficients()` to an array of
+        valid integer steps for trials of length `numels`.
+    """
+    if steps is None:
+        steps = (None, None)
+    try:
+        steps = np.array(steps)
+        assert len(steps.shape) == 1
+    except Exception as e:
+        log.exception('Please provide steps as ' +
+            'steps=(minstep, maxstep) or as one dimensional numpy ' +
+            'array containing all desired integer step values')
+        raise ValueError from e
+    if len(steps) == 2:
+        minstep=1
+        # default length not sure yet. but kmax > numels/2 is no use.
+        maxstep=int(numels/10)
+        if steps[0] is not None:
+            minstep = steps[0]
+        if steps[1] is not None:
+            maxstep = steps[1]
+        if minstep > maxstep or minstep < 1:
+            log.debug('minstep={} is invalid, setting to 1'.format(minstep))
+            minstep = 1
+
+        # it's important that kmax not larger than numels/2
+        if maxstep > numels/2 or maxstep < minstep:
+            log.debug('maxstep={} is invalid'.format(maxstep))
+            maxstep = int(numels/2)
+            log.debug('Adjusting maxstep to {}'.format(maxstep))
+        steps = np.arange(minstep, maxstep+1, dtype=int)
+        log.debug('Using steps between {} and {}'.format(minstep, maxstep))
+    else:
+        # dont overwrite provided argument
+        steps = np.array(steps, dtype=int, copy=True)
+        if (steps<1).any():
+            log.warning(
+                'All provided steps should be >= 1, modifying the input')
+            incorrect = np.nonzero(steps < 1)
+            correct = np.nonzero(steps >= 1)
+            # np.arange(0,1000,10) -> only first element is a problem
+            if (len(incorrect) == 1 and incorrect[0] == 0):
+                if not (steps == 1).any():
+                    steps[0] = 1
+                    log.debug('Changed first element to 1')
+                else:
+                    steps = steps[1:]
+                    log.debug('Removed first element')
+            else:
+                steps = steps[correct]
+                log.debug('Only using steps that are >= 1')
+        log.debug('Using provided custom steps between {} and {}'.format(
+            steps[0], steps[-1]))
+
+    return steps
+
+def coefficients(
+    data,
+    steps=None,
+    dt=1, dtunit='ms',
+    method=None,
+    numboot=100,
+    seed=5330,
+    description=None,
+    desc=None,
+    engine=None,
+    nthreads=None,
+    deterministic=False,
+    precision='float64',
+    mask=None,
+    populations=None,
+    resampling='bootstrap',
+    blocksize=None,
+    hierarchy=None,
+    groups=None,
+    streaming=False,
+    ):
+    """
+        Calculates the coefficients of correlation :math:`r_k`.
+
+        Parameters
+        ----------
+        data : ~numpy.ndarray, RaggedTrials, PackedRaster or SpikeTimes
+            Input data, containing the time series of activity in the trial
+            structure. If a one dimensional array is provieded instead, we
+            assume a single trial and reshape the input.
+            Trials of different length can be passed as
+            :class:`RaggedTrials`, binary spike rasters as
+            :class:`PackedRaster`, and the times of events as
+            :class:`SpikeTimes`.
+            An array of ``shape(numchannels, numtrials, datalength)``
+            computes all channels at once, with the same steps and the same
+            bootstrap replicas, and returns a
+            :class:`CoefficientResultStack`.
+
+        steps : ~numpy.array, optional
+            Specify the steps :math:`k` for which to compute coefficients
+            :math:`r_k`.
+            If an array of length two is provided, e.g.
+            ``steps=(minstep, maxstep)``, all enclosed integer values will be
+            used.
+            Arrays larger than two are assumed to contain a manual choice of
+            steps. Strides other than one are possible.
+
+        dt : float, optional
+            The size of each step in `dtunits`. Default is 1.
+
+        dtunit : str, optional
+            Units of step size. Default is `'ms'`.
+
+        description : str, optional
             Set the description of the :class:`CoefficientResult`. By default
             all results of functions working with this set inherit its
             description (e.g. plot legends).
 
-        Other Parameters
-        ----------------
+        Other Parameters
+        ----------------
+        method : str, optional
+            The estimation method to use, either `'trialseparated'` (``'ts'``,
+            default) or
+            `'stationarymean'` (``'sm'``). ``'ts'``
+            calculates the :math:`r_k` for each trial separately and averages
+            over trials. Each trials contribution is weighted with its
+            variance.
+            ``'sm'`` assumes the mean activity and its variance to be
+            constant across all trials.
+
+        numboot : int, optional
+            Enable bootstrapping to generate `numboot` (resampled)
+            series of trials from the provided one. This allows to approximate
+            statistical errors, returned in `stderrs`.
+            Default is `numboot=100`.
+
+        seed : int, None or 'random', optional
+            If bootstrapping (`numboot>0`), a custom seed can be passed to
+            the random number generator used for
+            resampling. Per default, it is set to the *same* value every time
+            `coefficients()` is called to return consistent results
+            when repeating the analysis on the same data. Set to `None` to
+            prevent (re)seeding. 'random' seeds using the wall clock time.
+            For more details, see
+            :obj:`numpy.random.RandomState`.
+
+        engine : str, optional
+            How the lagged products are computed. `'direct'` (default)
+            iterates over the steps and has costs proportional to
+            `numsteps`. `'fft'` obtains all steps at once via fast fourier
+            transforms, which is faster for many (dense) steps.
+            `'tiled'` reads the data in consecutive blocks of time, once,
+            and is the default for :obj:`numpy.memmap` input (e.g. from
+            ``np.load(fname, mmap_mode='r')``) and :class:`TrialFiles`, so
+            that data larger than memory is processed with sequential reads.
+            This includes channels, `groups` and the block bootstrap.
+            `'blas'` uses numpy only and computes blocks of steps as
+            matrix products, which is the default if numba is not
+            installed.
+            `'packed'` computes the lagged products of binary data
+            (zeros and ones) on the bits of a :class:`PackedRaster`, and
+            is the default for such input.
+            `'events'` computes them from the distances between the
+            events of :class:`SpikeTimes`, the default for such input.
+            `'auto'` picks the engine that is expected to be fastest,
+            from a cost model of the number of trials, their length and the
+            steps. Its constants are rough defaults until they are
+            calibrated for the machine, see :func:`benchmark_engines`.
+            All return the same results, up to floating point precision.
+            The engine used is recorded in the `engine` attribute of the
+            result.
+
+        nthreads : int, optional
+            Maximum number of threads for the parallelized computation.
+            Defaults to the environment variable `MRE_NUM_THREADS` and,
+            if not set, to all available cores. Requires numba >= 0.49, the
+            threading layer can be chosen via `NUMBA_THREADING_LAYER`.
+
+        deterministic : bool, optional
+            Bootstrap replicas are reduced over trials in a fixed order,
+            instead of a (multithreaded) BLAS matrix product, so that results
+            are bit-identical for any number of threads. The per-trial
+            terms always are, as each of their sums is computed by one
+            thread. Default is `False`.
+
+        precision : str or dtype, optional
+            Floating point type of the per-trial terms that are kept for
+            bootstrapping, `'float64'` (default) or `'float32'`.
+            Single precision halves their memory footprint, for many
+            trials and steps. Sums are accumulated in double precision
+            either way, so mainly the per-trial terms are rounded
+            (relative precision around `1e-7`).
+            The `'tiled'` engine always uses double precision, and with the
+            `'fft'` and `'blas'` engines, the `'trialseparated'` method
+            only stores its final table in single precision.
+            Integer data (e.g. spike counts) is summed exactly by the
+            `'direct'` engine, as long as the sums stay below `2**53`.
+            It does not need to be converted to float beforehand, which
+            would increase its memory several-fold.
+
+        mask : ~numpy.ndarray, optional
+            Boolean array of the same shape as `data`, `False` where values
+            are missing (e.g. artifacts or dropouts). Only pairs of values
+            :math:`k` steps apart where both are valid contribute to
+            :math:`r_k`, so long recordings with gaps do not need to be
+            split into trials. Each trial is weighted by its number of
+            such pairs. `NaN` values in `data` are treated as missing
+            without a mask (this is not checked for
+            :obj:`numpy.memmap` input).
+            Supported by the `'direct'` and `'fft'` engines, others fall
+            back to one of them.
+
+        populations : ~numpy.ndarray, optional
+            Estimate the coefficients of the summed activity of groups of
+            channels, instead of the channels. `data` is then of
+            ``shape(numchannels, datalength)`` or
+            ``shape(numchannels, numtrials, datalength)``, and
+            `populations` either holds one label per channel (e.g. the
+            brain area), where all channels with the same label form a
+            population, or the weights of shape (numpopulations,
+            numchannels) of each channel in each population.
+            The `'tiled'` engine (default) aggregates the populations while
+            reading the data once, in blocks of time, without creating the
+            population activities. Other engines compute these first.
+            Returns a :class:`CoefficientResultStack` with one entry per
+            population, ordered like the sorted labels.
+
+        resampling : str, optional
+            How to estimate the `stderrs`, `'bootstrap'` (default) or
+            `'jackknife'`. The delete-one jackknife creates `numtrials`
+            replicas that each leave out one trial, in place of the bootstrap
+            replicas (`numboot` and `seed` are ignored). All of them are
+            obtained from the sums over all trials minus each trial, so
+            their cost hardly grows with the number of trials.
+            The squared deviations of the replicas are then scaled by
+            `(numtrials-1)/numtrials` for the standard errors, and
+            :func:`fit` continues with the same resampling.
+            `'block'` resamples consecutive blocks of `blocksize` time steps
+            within each trial, instead of whole trials, so that errors can
+            be estimated for a single long trial. The lagged sums of every
+            block are computed once, and each replica combines the sums of
+            its blocks. A block holds the pairs of values :math:`k` steps
+            apart that start in the block. The activity (variance) of a
+            replica is that of the drawn blocks, as of the drawn trials
+            for the bootstrap.
+            `'hierarchical'` resamples trials that are nested in groups, e.g.
+            sessions or animals, given as `hierarchy`: each replica draws
+            the groups with replacement, and then the trials of every drawn
+            group with replacement. Like the bootstrap, all replicas are
+            weighted sums over the per-trial terms.
+
+        blocksize : int, optional
+            Length of the blocks for ``resampling='block'``, in time steps.
+            Blocks should be considerably longer than the largest step and
+            the autocorrelation time. Defaults to 1/50 of the trial length,
+            but at least twice the largest step.
+
+        hierarchy : ~numpy.ndarray, optional
+            One group label per trial for the hierarchical bootstrap, e.g.
+            the session of each trial. Implies
+            ``resampling='hierarchical'``. For three dimensional input, the
+            labels of the trials of each channel.
+
+        groups : ~numpy.ndarray, optional
+            One label per trial, e.g. the condition or stimulus of each
+            trial. Returns the results of the subsets of trials with the
+            same label, as dict from each label to its result. The per-trial
+            terms are computed once for all trials, and each group, its
+            estimate and its resampling, only reduces the terms of its
+            trials.
+
+        streaming : bool, optional
+            For a large `numboot`, compute the bootstrap replicas in
+            batches and only keep their running mean and variance (for the
+            `stderrs`), so that the memory does not grow with `numboot`.
+            `bootstrapcrs` is then a :obj:`CoefficientResultStream` that
+            computes a batch again when its replicas are accessed, e.g. by
+            :func:`fit`. For three dimensional input, only the `stderrs` are
+            kept. Ignored by the jackknife.
+
+        Returns
+        -------
+        : :class:`CoefficientResult`
+            The output is grouped and can be accessed
+            using its attributes (listed below).
+            For three dimensional input, a :class:`CoefficientResultStack`
+            that holds one :class:`CoefficientResult` per channel.
+            With `groups`, a dict that holds one of these per label.
+    """
+
+    # ------------------------------------------------------------------ #
+    # Check arguments to offer some more convenience
+    # ------------------------------------------------------------------ #
+    log.debug('coefficients() using \'{}\' method:'.format(method))
+    if method is None:
+        method = 'ts'
+    if method not in ['trialseparated', 'ts', 'stationarymean', 'sm']:
+        log.exception('Unknown method: "{}"'.format(method))
+        raise NotImplementedError
+    if method == 'ts':
+        method = 'trialseparated'
+    elif method == 'sm':
+        method = 'stationarymean'
+
+    packed = isinstance(data, PackedRaster)
+    events = isinstance(data, SpikeTimes)
+    ragged = isinstance(data, RaggedTrials)
+    files  = isinstance(data, TrialFiles)
+    popweights = None
+    if populations is not None:
+        if mask is not None:
+            log.exception('A mask is not supported with populations')
+            raise ValueError
+        data, popweights, popnames = _check_populations(data, populations)
+        if engine is None:
+            engine = 'tiled'
+        if engine != 'tiled' or not use_numba:
+            if engine == 'tiled':
+                engine = 'blas'
+            log.info("Aggregating the populations in memory for the " +
+                "'{}' engine".format(engine))
+            data = np.tensordot(popweights, data, axes=1)
+            popweights = None
+    if engine is None:
+        if events:
+            engine = 'events'
+        elif not use_numba:
+            engine = 'blas'
+        elif packed:
+            engine = 'packed'
+        elif isinstance(data, np.memmap) or files:
+            engine = 'tiled'
+        else:
+            engine = 'direct'
+    if engine not in ['auto', 'direct', 'fft', 'tiled', 'blas', 'packed',
+        'events']:
+        log.exception('Unknown engine: "{}"'.format(engine))
+        raise NotImplementedError
+    if hierarchy is not None and resampling == 'bootstrap':
+        resampling = 'hierarchical'
+    if resampling not in ['bootstrap', 'jackknife', 'block', 'hierarchical']:
+        log.exception('Unknown resampling: "{}"'.format(resampling))
+        raise NotImplementedError
+    if (resampling == 'hierarchical') != (hierarchy is not None):
+        log.exception('The hierarchical bootstrap needs the group of ' +
+            'each trial as hierarchy, and only works with it')
+        raise ValueError
+    if resampling == 'block' and (not isinstance(data, (np.ndarray,
+        TrialFiles)) or len(data.shape) > 2 or mask is not None
+        or populations is not None):
+        log.exception('The block bootstrap needs trials of equal length ' +
+            'as ndarray of shape(numtrials, datalength), without mask')
+        raise ValueError
+    if engine == 'auto' and packed and use_numba:
+        engine = 'packed'
+    if engine == 'auto' and events:
+        engine = 'events'
+    if packed and engine != 'packed':
+        log.info("Unpacking the raster for the '{}' engine".format(engine))
+        data = data.unpack()
+    if events and engine != 'events':
+        log.info("Binning the events for the '{}' engine".format(engine))
+        data = data.to_dense()
+    if engine == 'events' and not events:
+        log.exception("The 'events' engine needs SpikeTimes as input")
+        raise ValueError
+    if mask is not None and (packed or events or ragged or files):
+        log.exception('A mask is only supported for ndarray input')
+        raise ValueError
+    if ragged and engine in ['tiled', 'packed']:
+        log.info("Ragged trials are not supported by the '{}' engine, " \
+            .format(engine) + "using 'direct'")
+        engine = 'direct'
+
+    try:
+        dtype = np.dtype(precision)
+    except TypeError as e:
+        log.exception('Unknown precision: "{}"'.format(precision))
+        raise ValueError from e
+    if dtype not in [np.float32, np.float64]:
+        log.exception('Precision needs to be float32 or float64')
+        raise ValueError
+    if engine == 'tiled' and dtype != ftype:
+        log.debug("The 'tiled' engine uses double precision")
+        dtype = np.dtype(ftype)
+
+    if desc is not None and description is None:
+        description = str(desc);
+    if description is not None:
+        description = str(description)
+
+    # check dt
+    dt = float(dt)
+    if dt <= 0:
+        log.exception('Timestep dt needs to be a float > 0.0')
+        raise ValueError
+    dtunit = str(dtunit)
+
+    if popweights is not None:
+        return _population_coefficients(data, popweights, popnames, steps,
+            method, dt, dtunit, numboot, seed, description, nthreads,
+            deterministic, resampling, hierarchy, groups, streaming)
+
+    dim = -1
+    numchannels = None
+    try:
+        shape = data.shape
+        dim = len(shape)
+        if dim == 1:
+            log.warning('You should provide an ndarray of ' +
+                'shape(numtrials, datalength)\n' +
+                '\tContinuing with one trial, reshaping your input')
+            data = np.reshape(data, (1, len(data)))
+        elif dim == 3:
+            # channels are computed as one set of trials, and split later
+            numchannels = shape[0]
+            channels = data
+            data = np.reshape(data, (shape[0]*shape[1], shape[2]))
+        elif dim > 3:
+            log.exception('Provided ndarray is of dim {}\n'.format(dim) +
+                  '\tPlease provide a two or three dimensional ndarray')
+            raise ValueError
+    except Exception as e:
+        log.exception('Please provide a two or three dimensional ndarray')
+        raise ValueError from e
+
+    steps = _check_steps(steps, data.shape[1])
+
+    masked = False
+    if mask is not None:
+        mask = np.asarray(mask, dtype=bool)
+        if mask.shape != shape:
+            log.exception('The mask needs the same shape as the data')
+            raise ValueError
+        mask = np.reshape(mask, data.shape)
+        masked = True
+    elif isinstance(data, np.ndarray) and not isinstance(data, np.memmap) \
+        and data.dtype.kind == 'f':
+        missing = np.isnan(data)
+        if missing.any():
+            log.info('Treating NaN values as missing')
+            mask = ~missing
+            masked = True
+        del missing
+
+    if masked:
+        if engine == 'auto':
+            with num_threads(nthreads):
+                engine = _choose_engine(data.shape[0], data.shape[1], steps,
+                    method)
+        if engine not in ['direct', 'fft']:
+            fallback = 'direct' if use_numba else 'fft'
+            log.info("Missing values are not supported by the '{}' engine, "\
+                .format(engine) + "using '{}'".format(fallback))
+            engine = fallback
+
+    if engine == 'packed' and not isinstance(data, PackedRaster):
+        data = PackedRaster.from_dense(data)
+
+    if engine == 'auto':
+        if use_numba and (isinstance(data, np.memmap) or files):
+            # reading the data once is more important than the flops
+            engine = 'tiled'
+        else:
+            with num_threads(nthreads):
+                engine = _choose_engine(data.shape[0], data.shape[1], steps,
+                    method)
+
+    if files and engine != 'tiled':
+        log.info("Stacking the files into memory for the '{}' engine" \
+            .format(engine))
+        data  = data.to_array()
+        files = False
+
+    # ------------------------------------------------------------------ #
+    # Continue with trusted arguments
+    # ------------------------------------------------------------------ #
+
+    numsteps  = len(steps)        # number of steps for rks
+    numtrials = data.shape[0]     # number of trials
+    numels    = data.shape[1]     # number of measurements per trial
+
+    hierarchy = _check_hierarchy(hierarchy, numtrials if numchannels is None
+        else numtrials // numchannels)
+    if groups is not None:
+        groups = _check_groups(groups, numtrials if numchannels is None
+            else numtrials // numchannels)
+
+    if (ut._log_locals):
+        log.debug('Trusted Locals: {}'.format(locals()))
+
+    if numchannels is None:
+        log.info("coefficients() with '{}' method for {} trials of " \
+            .format(method, numtrials) + "length {}".format(numels))
+    else:
+        log.info("coefficients() with '{}' method for {} channels of {} " \
+            .format(method, numchannels, numtrials // numchannels) +
+            "trials of length {}".format(numels))
+    log.debug("coefficients() using '{}' engine".format(engine))
+
+    with num_threads(nthreads):
+        log.debug('coefficients() using {} threads'.format(
+            _current_threads()))
+        if engine == 'tiled':
+            # one accumulator per channel or file, over views of the data
+            if numchannels is not None:
+                parts = channels
+            elif files:
+                parts = data.parts
+            else:
+                parts = [data]
+            prepped, trialactivities, trialvariances = \
+                _tiled_precompute(parts, steps, method)
+        elif engine == 'packed':
+            # zeros and ones, the variance follows from the mean
+            ones = data.ones().astype(ftype)
+            trialactivities = ones/numels
+            trialvariances  = (ones - ones**2/numels)/(numels-1)
+        elif engine == 'events':
+            total = data.counts().astype(ftype)
+            trialactivities = total/numels
+            trialvariances  = (data.squares() - total**2/numels)/(numels-1)
+        elif ragged:
+            trialactivities = data.means()
+            trialvariances  = data.variances()
+        elif masked:
+            numvalid = np.sum(mask, axis=1)
+            trialactivities = np.sum(np.where(mask, data, 0), axis=1,
+                dtype=ftype) / numvalid
+            trialvariances  = np.sum(np.where(mask,
+                data - trialactivities[:, np.newaxis], 0)**2, axis=1,
+                dtype=ftype) / (numvalid - 1)
+        else:
+            trialactivities = np.mean(data, axis=1, dtype=ftype)
+            trialvariances  = np.var(data, axis=1, ddof=1, dtype=ftype)
+
+        # in single precision, store the sm terms relative to the mean
+        offset = 0.0 if dtype == ftype \
+            else float(np.mean(trialactivities))
+
+        stepweights = None
+        if engine == 'tiled':
+            # read along with the activities
+            pass
+        elif ragged:
+            prepped, stepweights = _ragged_precompute(data, steps, method,
+                engine, dtype, offset)
+        elif masked:
+            prepped, stepweights = _masked_precompute(data, mask, steps,
+                method, engine, dtype, offset)
+        else:
+            prepped = _precompute(data, steps, method, engine, dtype, offset)
+
+        blocks = None
+        if resampling == 'block':
+            if blocksize is None:
+                blocksize = max(2*int(np.max(steps)), -(-numels // 50))
+            blocksize = int(blocksize)
+            if blocksize < 1:
+                log.exception('The blocksize needs to be positive')
+                raise ValueError
+            if blocksize < np.max(steps):
+                log.warning('Blocks of {} steps are shorter than '.format(
+                    blocksize) + 'the largest step {}'.format(np.max(steps)))
+        if resampling == 'block' and numboot > 1:
+            log.debug('Block bootstrap with blocks of {} steps'.format(
+                blocksize))
+            blocks = _block_precompute(data, steps, blocksize, dtype,
+                offset)
+
+        if groups is not None:
+            if numchannels is not None:
+                trialactivities = np.reshape(trialactivities,
+                    (numchannels, -1))
+                trialvariances  = np.reshape(trialvariances,
+                    (numchannels, -1))
+            return _grouped_from_precomputed(groups, prepped, method, steps,
+                trialactivities, trialvariances, dt, dtunit, numboot, seed,
+                description, deterministic, engine, dtype.name, stepweights,
+                resampling, blocks, hierarchy, streaming, numchannels,
+                'Channel' if populations is None else 'Population',
+                None if populations is None else popnames)
+
+        if numchannels is not None:
+            stack = _stack_from_precomputed(prepped, method, steps,
+                np.reshape(trialactivities, (numchannels, -1)),
+                np.reshape(trialvariances, (numchannels, -1)), dt, dtunit,
+                numboot, seed, description, deterministic, engine,
+                dtype.name, stepweights, resampling, hierarchy, streaming)
+            if populations is not None:
+                stack.label = 'Population'
+                stack.names = popnames
+            return stack
+
+        return _coefficients_from_precomputed(prepped, method, steps,
+            trialactivities, trialvariances, dt, dtunit, numboot, seed,
+            description, deterministic, engine, dtype.name, stepweights,
+            resampling, blocks, hierarchy, streaming)
+
+def _precompute(data, steps, method, engine, dtype=ftype, offset=0.0):
+    """
+        Per-trial terms of `method` from the given engine: the table of
+        ts_precompute for 'trialseparated' and the terms of sm_precompute
+        for 'stationarymean'. For the latter, stored relative to `offset`.
+    """
+    dtype = np.dtype(dtype)
+    workers = _current_threads()
+
+    # spike counts can be summed exactly
+    integer = engine == 'direct' and _int_exact(data)
+    if integer:
+        log.debug('coefficients() summing integers exactly')
+
+    def terms(dtype, offset):
+        if engine == 'fft':
+            return fft_precompute(data, steps, workers=workers,
+                dtype=dtype, offset=offset)
+        elif engine == 'blas':
+            return blas_precompute(data, steps, dtype, offset)
+        elif engine == 'packed':
+            return packed_precompute(data.words(), data.numels, steps,
+                dtype, offset)
+        elif engine == 'events':
+            return events_precompute(data.indices, data.offsets,
+                data.numels, steps, dtype, offset)
+        else:
+            return sm_precompute(data, steps, dtype, offset)
+
+    if method == 'trialseparated':
+        if engine == 'direct':
+            prepped = ts_precompute(data, steps, dtype.type, integer)
+        elif engine in ('fft', 'blas'):
+            # from double precision terms, still centered on each trial.
+            # the per-trial coefficients do not depend on the shift, and
+            # undoing it would cancel digits for data with a large mean
+            prepped = ts_from_sm_precompute(terms(ftype, None))
+        else:
+            # from double precision terms
+            prepped = ts_from_sm_precompute(terms(ftype, 0.0))
+        return prepped.astype(dtype, copy=False)
+    elif method == 'stationarymean':
+        return terms(dtype.type, offset)
+
+def _tiled_precompute(parts, steps, method):
+    """
+        Per-trial terms of `method`, as from _precompute, and the activity
+        and variance of each trial, with one CoefficientAccumulator for
+        each part of the trials (e.g. a channel or a file). Every trial is
+        read once, in tiles of `tilesize` time steps that fit into cache.
+    """
+    res = []
+    for part in parts:
+        acc = CoefficientAccumulator(steps, method=method)
+        for trial in part:
+            for start in range(0, len(trial), tilesize):
+                acc.add_chunk(trial[start:start+tilesize])
+            acc.end_trial()
+        res.append(acc._precomputed())
+
+    if method == 'trialseparated':
+        prepped = np.concatenate([r[0] for r in res], axis=0)
+    elif method == 'stationarymean':
+        prepped = tuple(np.concatenate([r[0][idx] for r in res], axis=-1)
+            for idx in range(6))
+    return prepped, np.concatenate([r[1] for r in res]), \
+        np.concatenate([r[2] for r in res])
+
+def _ragged_precompute(data, steps, method, engine, dtype=ftype, offset=0.0):
+    """
+        _precompute for RaggedTrials. The engine runs on each trial (a view
+        of the buffer) with the steps that fit into it. Missing entries are
+        NaN, and `stepweights` of shape (numtrials, numsteps) holds the
+        number of products T-k of each trial and step, or zero if missing.
+    """
+    numsteps  = len(steps)
+    numtrials = len(data)
+    lengths   = data.lengths()
+
+    # ts needs two values for the variance of the front part
+    minlen = 2 if method == 'trialseparated' else 1
+    stepweights = (lengths[:, np.newaxis] - steps[np.newaxis, :]) \
+        .astype(ftype)
+    stepweights[stepweights < minlen] = 0
+
+    if method == 'trialseparated':
+        prepped = np.full((numtrials, numsteps), np.nan, dtype=dtype)
+    elif method == 'stationarymean':
+        prepped = (np.zeros(numtrials, dtype=ftype),
+            np.zeros(numtrials, dtype=ftype)) + tuple(
+            np.full((numsteps, numtrials), np.nan, dtype=dtype)
+            for term in range(4))
+
+    for tdx in range(numtrials):
+        valid = np.nonzero(stepweights[tdx] > 0)[0]
+        if len(valid) == 0:
+            continue
+        res = _precompute(data[tdx][np.newaxis, :], steps[valid], method,
+            engine, dtype, offset)
+        if method == 'trialseparated':
+            prepped[tdx, valid] = res[0]
+        elif method == 'stationarymean':
+            prepped[0][tdx] = res[0][0]
+            prepped[1][tdx] = res[1][0]
+            for table, term in zip(prepped[2:], res[2:]):
+                table[valid, tdx] = term[:, 0]
+
+    return prepped, stepweights
+
+def _check_populations(data, populations):
+    """
+        Converts the `populations` argument of `coefficients()` to weights
+        of shape (numpopulations, numchannels), and `data` to shape
+        (numchannels, numtrials, numels). Returns both and the names of the
+        populations (the sorted labels, or None for weights).
+    """
+    if not isinstance(data, np.ndarray) or len(data.shape) not in [2, 3]:
+        log.exception('Populations need an ndarray of ' +
+            'shape(numchannels, [numtrials,] datalength)')
+        raise ValueError
+    if len(data.shape) == 2:
+        data = data[:, np.newaxis, :]
+    numchannels = data.shape[0]
+
+    populations = np.asarray(populations)
+    if populations.shape == (numchannels,):
+        names, index = np.unique(populations, return_inverse=True)
+        weights = np.zeros(shape=(len(names), numchannels), dtype=ftype)
+        weights[index, np.arange(numchannels)] = 1
+    elif len(populations.shape) == 2 and \
+        populations.shape[1] == numchannels:
+        names = None
+        weights = populations.astype(ftype)
+    else:
+        log.exception('Provide one population label per channel or ' +
+            'weights of shape (numpopulations, numchannels)')
+        raise ValueError
+
+    return data, weights, names
+
+def _check_hierarchy(hierarchy, numtrials):
+    """
+        Converts the `hierarchy` argument of `coefficients()`, one group
+        label per trial, to the index of the group of each trial, ordered
+        like the sorted labels. None stays None.
+    """
+    if hierarchy is None:
+        return None
+    hierarchy = np.asarray(hierarchy)
+    if hierarchy.shape != (numtrials,):
+        log.exception('Provide one group label per trial for the ' +
+            'hierarchical bootstrap, {} labels for {} trials'.format(
+            len(hierarchy.ravel()), numtrials))
+        raise ValueError
+    names, index = np.unique(hierarchy, return_inverse=True)
+    if len(names) < 2:
+        log.info('All trials are in the same group, the hierarchical ' +
+            'bootstrap only resamples the trials')
+    return index.astype(np.int64)
+
+def _check_groups(groups, numtrials):
+    """
+        Converts the `groups` argument of `coefficients()`, one label per
+        trial, to the sorted labels and the index of the label of each
+        trial.
+    """
+    groups = np.asarray(groups)
+    if groups.shape != (numtrials,):
+        log.exception('Provide one group label per trial, ' +
+            '{} labels for {} trials'.format(len(groups.ravel()), numtrials))
+        raise ValueError
+    names, index = np.unique(groups, return_inverse=True)
+    return names, index
+
+def _population_coefficients(data, weights, names, steps, method, dt,
+    dtunit, numboot, seed, description, nthreads, deterministic,
+    resampling='bootstrap', hierarchy=None, groups=None, streaming=False):
+    """
+        coefficients() for populations with the fused 'tiled' engine, see
+        population_precompute. Returns a CoefficientResultStack, or a dict
+        of them for `groups`.
+    """
+    numpops   = weights.shape[0]
+    numtrials = data.shape[1]
+    numels    = data.shape[2]
+    steps     = _check_steps(steps, numels)
+    hierarchy = _check_hierarchy(hierarchy, numtrials)
+    if groups is not None:
+        groups = _check_groups(groups, numtrials)
+
+    log.info("coefficients() with '{}' method for {} populations of {} " \
+        .format(method, numpops, data.shape[0]) +
+        "channels, {} trials of length {}".format(numtrials, numels))
+
+    # only the nonzero weights of each population
+    pops, chans = np.nonzero(weights)
+    ptr = np.zeros(numpops+1, dtype=np.int64)
+    np.cumsum(np.bincount(pops, minlength=numpops), out=ptr[1:])
+
+    with num_threads(nthreads):
+        prepped, act, var = population_precompute(np.asarray(data),
+            chans.astype(np.int64), weights[pops, chans], ptr, steps)
+        if method == 'trialseparated':
+            prepped = ts_from_sm_precompute(prepped)
+
+        if groups is not None:
+            return _grouped_from_precomputed(groups, prepped, method, steps,
+                np.reshape(act, (numpops, numtrials)),
+                np.reshape(var, (numpops, numtrials)), dt, dtunit, numboot,
+                seed, description, deterministic, 'tiled',
+                np.dtype(ftype).name, resampling=resampling,
+                hierarchy=hierarchy, streaming=streaming,
+                numchannels=numpops, label='Population', names=names)
+
+        stack = _stack_from_precomputed(prepped, method, steps,
+            np.reshape(act, (numpops, numtrials)),
+            np.reshape(var, (numpops, numtrials)), dt, dtunit, numboot,
+            seed, description, deterministic, 'tiled',
+            np.dtype(ftype).name, resampling=resampling,
+            hierarchy=hierarchy, streaming=streaming)
+    stack.label = 'Population'
+    stack.names = names
+    return stack
+
+def _bootstrap(prepped, method, trialactivities, numboot, seed,
+    deterministic=False, stepweights=None, hierarchy=None, streaming=False):
+    """
+        Bootstrap replicas of the precomputed terms, as weighted reductions
+        over the trials. Returns the coefficients of the replicas, shape
+        (numboot, numcols) where the columns are the steps of the tables,
+        and the mean and variance of their trial activities, or None if
+        resampling is skipped.
+        `trialactivities` of shape (numtrials) or (numchannels, numtrials),
+        where all channels share the same replicas.
+        With the group index of each trial as `hierarchy`, groups and then
+        trials within groups are drawn, see hierarchical_counts.
+        With `streaming`, returns the _ReplicaBatches instead.
+    """
+    numtrials = trialactivities.shape[-1]
+    if numboot <= 1:
+        log.debug('Bootstrap needs at least numboot=2 replicas, ' +
+            'skipping the resampling')
+        return None
+    if numtrials < 2:
+        log.info('Bootstrapping needs at least 2 trials, skipping ' +
+            'the resampling')
+        return None
+
+    log.info('Bootstrapping {} replicas'.format(numboot))
+    log.debug('coefficients() seeding to {}'.format(seed))
+    if seed is None:
+        pass
+    elif seed == 'random':
+        np.random.seed(None)
+    else:
+        np.random.seed(seed)
+
+    # shift for numerical stability of the variance
+    shift  = np.mean(trialactivities, axis=-1, keepdims=True, dtype=ftype)
+    rel    = np.transpose(trialactivities - shift)
+
+    def replicas(numrep):
+        if hierarchy is None:
+            counts = bootstrap_counts(numtrials, numrep)
+        else:
+            counts = hierarchical_counts(hierarchy, numrep)
+
+        # all replicas at once, as weighted reductions over the trials
+        if method == 'trialseparated':
+            bscoefficients = ts_method_weighted(prepped, counts,
+                deterministic, stepweights)
+        elif method == 'stationarymean':
+            bscoefficients = sm_method_weighted(prepped, counts,
+                deterministic, stepweights)
+
+        # hierarchical replicas differ in their number of trials
+        num    = np.sum(counts, axis=1).reshape(
+            (numrep,) + (1,)*(rel.ndim-1))
+        bsact  = np.dot(counts, rel)
+        bssqu  = np.dot(counts, rel**2)
+        bsmean = bsact/num + np.transpose(shift)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            bsvar = (bssqu - bsact**2/num)/(num-1)
+
+        return bscoefficients, bsmean, bsvar
+
+    if streaming:
+        return _ReplicaBatches(replicas, numboot)
+    return replicas(numboot)
+
+def _jackknife(prepped, method, trialactivities, deterministic=False,
+    stepweights=None):
+    """
+        Delete-one jackknife replicas of the precomputed terms, one per
+        trial that is left out, in the format of _bootstrap.
+    """
+    numtrials = trialactivities.shape[-1]
+    if numtrials < 2:
+        log.info('The jackknife needs at least 2 trials, skipping ' +
+            'the resampling')
+        return None
+
+    log.info('Jackknife with {} replicas'.format(numtrials))
+    if method == 'trialseparated':
+        bscoefficients = ts_method_jackknife(prepped, deterministic,
+            stepweights)
+    elif method == 'stationarymean':
+        bscoefficients = sm_method_jackknife(prepped, deterministic,
+            stepweights)
+
+    # shift for numerical stability of the variance
+    shift  = np.mean(trialactivities, axis=-1, keepdims=True, dtype=ftype)
+    rel    = trialactivities - shift
+    bsact  = np.sum(rel,    axis=-1, keepdims=True) - rel
+    bssqu  = np.sum(rel**2, axis=-1, keepdims=True) - rel**2
+    bsmean = np.transpose(bsact/(numtrials-1) + shift)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bsvar = np.transpose(
+            (bssqu - bsact**2/(numtrials-1))/(numtrials-2))
+
+    return bscoefficients, bsmean, bsvar
+
+def _block_precompute(data, steps, blocksize, dtype=ftype, offset=0.0):
+    """
+        Per-block terms for the block bootstrap, see block_precompute.
+        Returns a dict with the terms (in the layout of sm_precompute,
+        blocks as trials), the number of pairs of each block and step,
+        shape (numtrials*numblocks, numsteps), the number of blocks per
+        trial, and the activity of each block relative to the common
+        `shift`.
+    """
+    dtype = np.dtype(dtype)
+    # the arrays of TrialFiles one after another, blocks stay trial-major
+    parts = data.parts if isinstance(data, TrialFiles) else [data]
+    terms, pairs = zip(*[block_precompute(part, blocksize, steps,
+        dtype.type, offset) for part in parts])
+    terms = tuple(np.concatenate(term, axis=1) for term in zip(*terms))
+    pairs = np.concatenate(pairs, axis=1)
+
+    numels  = data.shape[1]
+    starts  = np.arange(0, numels, blocksize)
+    lengths = np.diff(np.append(starts, numels)).astype(ftype)
+    shift   = np.mean([np.mean(trial, dtype=ftype) for trial in data])
+    bact    = np.empty(shape=(data.shape[0], len(starts)), dtype=ftype)
+    for tdx, trial in enumerate(data):
+        cent = np.asarray(trial, dtype=ftype) - shift
+        bact[tdx] = np.add.reduceat(cent, starts) / lengths
+
+    return dict(
+        terms      = (None, None) + terms,
+        pairs      = np.transpose(pairs).copy(),
+        numblocks  = len(starts),
+        activities = bact.ravel(),
+        shift      = shift)
+
+def _block_bootstrap(blocks, method, numtrials, numboot, seed,
+    deterministic=False, streaming=False):
+    """
+        Block bootstrap from the per-block terms of _block_precompute, in
+        the format of _bootstrap. Each replica draws, for every trial, as
+        many blocks of the trial as it has, with replacement, and combines
+        their terms as weighted reductions.
+        For 'trialseparated', the coefficients of each trial are obtained
+        from its blocks and averaged over trials. As trials in _bootstrap,
+        the activity (variance) of a replica is the mean (variance) of the
+        activities of its drawn blocks.
+        With `streaming`, returns the _ReplicaBatches instead.
+    """
+    numblocks = blocks['numblocks']
+    if numboot <= 1:
+        log.debug('Bootstrap needs at least numboot=2 replicas, ' +
+            'skipping the resampling')
+        return None
+    if numblocks < 2:
+        log.info('The block bootstrap needs at least 2 blocks per trial, ' +
+            'skipping the resampling')
+        return None
+
+    log.info('Block bootstrap with {} replicas of {} blocks'.format(
+        numboot, numtrials*numblocks))
+    log.debug('coefficients() seeding to {}'.format(seed))
+    if seed is None:
+        pass
+    elif seed == 'random':
+        np.random.seed(None)
+    else:
+        np.random.seed(seed)
+
+    terms   = blocks['terms']
+    pairs   = blocks['pairs']
+    rel     = blocks['activities']
+    num     = numtrials*numblocks
+
+    def replicas(numrep):
+        # blocks are drawn within each trial
+        counts = np.concatenate([bootstrap_counts(numblocks, numrep)
+            for tdx in range(numtrials)], axis=1)
+
+        if method == 'stationarymean' or numtrials == 1:
+            # for a single trial, both methods agree
+            bscoefficients = sm_method_weighted(terms, counts,
+                deterministic, pairs)
+        elif method == 'trialseparated':
+            bscoefficients = 0
+            for tdx in range(numtrials):
+                cols = slice(tdx*numblocks, (tdx+1)*numblocks)
+                bscoefficients = bscoefficients + sm_method_weighted(
+                    (None, None) + tuple(term[:, cols] for term in terms[2:]),
+                    counts[:, cols], deterministic, pairs[cols])
+            bscoefficients = bscoefficients / numtrials
+
+        bsact  = np.dot(counts, rel)
+        bssqu  = np.dot(counts, rel**2)
+        bsmean = bsact/num + blocks['shift']
+        bsvar  = (bssqu - bsact**2/num)/(num-1)
+
+        return bscoefficients, bsmean, bsvar
+
+    if streaming:
+        return _ReplicaBatches(replicas, numboot)
+    return replicas(numboot)
+
+class _ReplicaBatches:
+    """
+        Replicas of the streaming bootstrap, computed in batches of
+        `streamsize` by `replicas(numrep)`, which returns the coefficients,
+        activities and variances of `numrep` new replicas (see _bootstrap).
+        Only the running moments of the coefficients and the state of the
+        random number generator at the start of each batch are kept, from
+        which a batch is computed again on access.
+    """
+
+    def __init__(self, replicas, numboot):
+        self.numboot  = numboot
+        self.moments  = ut._RunningMoments()
+        self._replicas = replicas
+        self._states   = []
+        self._cached   = None
+        for start in range(0, numboot, streamsize):
+            self._states.append(np.random.get_state())
+            self.moments.add(replicas(min(streamsize, numboot-start))[0])
+
+    def batch(self, bdx):
+        """
+            Coefficients, activities and variances of the `bdx`-th batch.
+            The global random state is left untouched.
+        """
+        if self._cached is None or self._cached[0] != bdx:
+            state = np.random.get_state()
+            np.random.set_state(self._states[bdx])
+            try:
+                batch = self._replicas(
+                    min(streamsize, self.numboot - bdx*streamsize))
+            finally:
+                np.random.set_state(state)
+            self._cached = (bdx, batch)
+        return self._cached[1]
+
+def _resample(prepped, method, trialactivities, numboot, seed,
+    deterministic=False, stepweights=None, resampling='bootstrap',
+    blocks=None, hierarchy=None, streaming=False):
+    """
+        Replicas from `resampling`, 'bootstrap' (see _bootstrap),
+        'hierarchical' (_bootstrap over the groups in `hierarchy`),
+        'jackknife' (see _jackknife, ignores `numboot` and `seed`) or
+        'block' (see _block_bootstrap, from `blocks`), and the standard
+        errors of the columns of their coefficients.
+        With `streaming`, the bootstraps return _ReplicaBatches in place of
+        the coefficients, and None for the activities and variances.
+        Returns None if resampling is skipped.
+    """
+    if resampling == 'jackknife':
+        if streaming:
+            log.debug('The jackknife keeps its numtrials replicas')
+        replicas = _jackknife(prepped, method, trialactivities,
+            deterministic, stepweights)
+    elif resampling == 'block':
+        replicas = _block_bootstrap(blocks, method,
+            trialactivities.shape[-1], numboot, seed, deterministic,
+            streaming)
+    else:
+        replicas = _bootstrap(prepped, method, trialactivities, numboot,
+            seed, deterministic, stepweights,
+            hierarchy if resampling == 'hierarchical' else None, streaming)
+    if replicas is None:
+        return None
+
+    if isinstance(replicas, _ReplicaBatches):
+        log.info('{} {} replicas streamed'.format(numboot, resampling))
+        return replicas, None, None, \
+            np.sqrt(replicas.moments.variance(ddof=1))
+
+    bscoefficients, bsmean, bsvar = replicas
+    numrep = bscoefficients.shape[0]
+    log.info('{} {} replicas done'.format(numrep, resampling))
+
+    if resampling == 'jackknife':
+        # (n-1)/n times the sum of squared deviations from the mean
+        stderrs = np.sqrt(np.var(bscoefficients, axis=0, dtype=ftype) \
+            * (numrep-1))
+    else:
+        stderrs = np.sqrt(np.var(bscoefficients, axis=0, ddof=1,
+            dtype=ftype))
+
+    return bscoefficients, bsmean, bsvar, stderrs
+
+def _masked_precompute(data, mask, steps, method, engine, dtype=ftype,
+    offset=0.0):
+    """
+        _precompute for data with missing values, where `mask` is False.
+        Like _ragged_precompute, returns the terms and `stepweights` of
+        shape (numtrials, numsteps), the number of valid pairs of each trial
+        and step, or zero if there are too few.
+    """
+    dtype = np.dtype(dtype)
+    # ts from double precision terms
+    if method == 'trialseparated':
+        termtype, offset = ftype, 0.0
+    else:
+        termtype = dtype.type
+    if engine == 'fft':
+        prepped, pairs = fft_masked_precompute(data, mask, steps,
+            workers=_current_threads(), dtype=termtype, offset=offset)
+    else:
+        prepped, pairs = masked_precompute(data, mask, steps, termtype,
+            offset)
+
+    # ts needs two pairs for the variance of the front part
+    minlen = 2 if method == 'trialseparated' else 1
+    stepweights = np.transpose(pairs).copy()
+    stepweights[stepweights < minlen] = 0
+
+    if method == 'trialseparated':
+        with np.errstate(divide='ignore', invalid='ignore'):
+            prepped = ts_from_sm_precompute(prepped)
+        prepped = prepped.astype(dtype, copy=False)
+    return prepped, stepweights
+
+def _coefficients_from_precomputed(
+    prepped,
+    method,
+    steps,
+    trialactivities,
+    trialvariances,
+    dt, dtunit,
+    numboot,
+    seed,
+    description,
+    deterministic=False,
+    engine=None,
+    precision=None,
+    stepweights=None,
+    resampling='bootstrap',
+    blocks=None,
+    hierarchy=None,
+    streaming=False):
+    """
+        Second half of `coefficients()`, shared with other front ends.
+        Starting from the precomputed per-trial terms (ts_precompute for
+        'trialseparated', sm_precompute for 'stationarymean'), computes the
+        estimate, bootstrap (or jackknife) replicas and assembles the
+        result.
+        `engine` and `precision` are only recorded in the result.
+        `stepweights` weight the trials per step, see ts_method_weighted.
+        `blocks` holds the per-block terms for the block bootstrap, see
+        _block_precompute, and `hierarchy` the group index of each trial
+        for the hierarchical bootstrap. With `streaming`, the replicas are
+        a CoefficientResultStream.
+    """
+
+    numsteps  = len(steps)
+    numtrials = len(trialactivities)
+
+    trialcrs        = []
+    bootstrapcrs    = []
+    stderrs         = None
+    coefficients    = None                    # set later
+
+    if method == 'trialseparated':
+        ts_prepped   = prepped
+        if stepweights is None:
+            coefficients = ts_method(ts_prepped, steps)
+        else:
+            coefficients = ts_method_weighted(ts_prepped,
+                np.ones((1, numtrials)), deterministic, stepweights)[0]
+
+        # per-trial results, created on access
+        trialcrs = CoefficientResultSequence(
+            coefficients    = ts_prepped,
+            trialactivities = trialactivities,
+            trialvariances  = trialvariances,
+            steps           = steps,
+            dt              = dt,
+            dtunit          = dtunit,
+            label           = 'Trial',
+            description     = description,
+            engine          = engine,
+            precision       = precision)
+
+    elif method == 'stationarymean':
+        sm_prepped   = prepped
+        if stepweights is None:
+            coefficients = sm_method(sm_prepped, steps)
+        else:
+            coefficients = sm_method_weighted(sm_prepped,
+                np.ones((1, numtrials)), deterministic, stepweights)[0]
+
+
+    # ------------------------------------------------------------------ #
+    # Bootstrapping
+    # ------------------------------------------------------------------ #
+
+    replicas = _resample(prepped, method, trialactivities, numboot, seed,
+        deterministic, stepweights, resampling, blocks, hierarchy,
+        streaming)
+    if replicas is not None:
+        bscoefficients, bsmean, bsvar, stderrs = replicas
+
+        # replica results, created on access
+        if isinstance(bscoefficients, _ReplicaBatches):
+            bootstrapcrs = CoefficientResultStream(
+                batches     = bscoefficients,
+                steps       = steps,
+                dt          = dt,
+                dtunit      = dtunit,
+                label       = '{} Replica'.format(resampling.capitalize()),
+                description = description,
+                engine      = engine,
+                precision   = precision)
+        else:
+            bootstrapcrs = CoefficientResultSequence(
+                coefficients    = bscoefficients,
+                trialactivities = bsmean,
+                trialvariances  = bsvar,
+                steps           = steps,
+                dt              = dt,
+                dtunit          = dtunit,
+                label           = '{} Replica'.format(
+                    resampling.capitalize()),
+                description     = description,
+                engine          = engine,
+                precision       = precision)
+
+        if (stderrs == stderrs[0]).all():
+            stderrs = None
+
+    fulres =  CoefficientResult(
+        coefficients    = coefficients,
+        trialactivities = trialactivities,
+        trialvariances  = trialvariances,
+        steps           = steps,
+        stderrs         = stderrs,
+        trialcrs        = trialcrs,
+        bootstrapcrs    = bootstrapcrs,
+        dt              = dt,
+        dtunit          = dtunit,
+        description     = description,
+        engine          = engine,
+        precision       = precision,
+        resampling      = None if replicas is None else resampling)
+
+    return fulres
+
+def _stack_from_precomputed(
+    prepped,
+    method,
+    steps,
+    trialactivities,
+    trialvariances,
+    dt, dtunit,
+    numboot,
+    seed,
+    description,
+    deterministic=False,
+    engine=None,
+    precision=None,
+    stepweights=None,
+    resampling='bootstrap',
+    hierarchy=None,
+    streaming=False):
+    """
+        _coefficients_from_precomputed for several channels, returning a
+        CoefficientResultStack. The terms were precomputed for the trials
+        of all channels, channel-major. `trialactivities` and
+        `trialvariances` have shape (numchannels, numtrials).
+        The tables are rearranged so that the trials are the rows and the
+        columns hold all steps of all channels. The estimate and all
+        bootstrap replicas of all channels are then the same weighted
+        reductions as for one channel. With `streaming`, only the `stderrs`
+        of the replicas are kept.
+    """
+    numsteps    = len(steps)
+    numchannels = trialactivities.shape[0]
+    numtrials   = trialactivities.shape[1]
+
+    def columns(table):
+        # (numchannels*numtrials, numsteps) -> (numtrials, numchannels*numsteps)
+        return np.reshape(np.transpose(
+            np.reshape(table, (numchannels, numtrials, numsteps)),
+            (1, 0, 2)), (numtrials, numchannels*numsteps))
+
+    def rows(table):
+        # (numsteps, numchannels*numtrials) -> (numchannels*numsteps, numtrials)
+        return np.reshape(np.transpose(
+            np.reshape(table, (numsteps, numchannels, numtrials)),
+            (1, 0, 2)), (numchannels*numsteps, numtrials))
+
+    trialcoefficients = None
+    if method == 'trialseparated':
+        trialcoefficients = np.reshape(prepped,
+            (numchannels, numtrials, numsteps))
+        table = columns(prepped)
+        method_weighted = ts_method_weighted
+    elif method == 'stationarymean':
+        table = prepped[0:2] + tuple(rows(term) for term in prepped[2:])
+        method_weighted = sm_method_weighted
+    if stepweights is not None:
+        stepweights = columns(stepweights)
+
+    coefficients = method_weighted(table, np.ones((1, numtrials)),
+        deterministic, stepweights)[0]
+    coefficients = np.reshape(coefficients, (numchannels, numsteps))
+
+    stderrs        = None
+    bscoefficients = None
+    bsmean         = None
+    bsvar          = None
+    replicas = _resample(table, method, trialactivities, numboot, seed,
+        deterministic, stepweights, resampling, hierarchy=hierarchy,
+        streaming=streaming)
+    if replicas is not None:
+        bscoefficients, bsmean, bsvar, stderrs = replicas
+        stderrs = np.reshape(stderrs, (numchannels, numsteps))
+        if isinstance(bscoefficients, _ReplicaBatches):
+            bscoefficients = None
+        else:
+            bscoefficients = np.transpose(np.reshape(bscoefficients,
+                (-1, numchannels, numsteps)), (1, 0, 2))
+            bsmean  = np.transpose(bsmean)
+            bsvar   = np.transpose(bsvar)
+
+    return CoefficientResultStack(
+        coefficients      = coefficients,
+        trialactivities   = trialactivities,
+        trialvariances    = trialvariances,
+        steps             = steps,
+        dt                = dt,
+        dtunit            = dtunit,
+        stderrs           = stderrs,
+        bscoefficients    = bscoefficients,
+        bsactivities      = bsmean,
+        bsvariances       = bsvar,
+        trialcoefficients = trialcoefficients,
+        description       = description,
+        engine            = engine,
+        precision         = precision,
+        resampling        = None if replicas is None else resampling)
+
+def _take_trials(prepped, method, rows):
+    """
+        The precomputed terms of `method` of the trials in `rows`.
+    """
+    if method == 'trialseparated':
+        return prepped[rows]
+    mm, mm_squ = (None if term is None else term[rows]
+        for term in prepped[0:2])
+    return (mm, mm_squ) + tuple(term[:, rows] for term in prepped[2:])
+
+def _take_blocks(blocks, trials):
+    """
+        The per-block terms of _block_precompute of the given `trials`.
+    """
+    numblocks = blocks['numblocks']
+    cols = (np.asarray(trials)[:, np.newaxis]*numblocks \
+        + np.arange(numblocks)).ravel()
+    taken = dict(blocks)
+    taken['terms']   = _take_trials(blocks['terms'], 'stationarymean', cols)
+    taken['pairs']   = blocks['pairs'][cols]
+    taken['activities'] = blocks['activities'][cols]
+    return taken
+
+def _grouped_from_precomputed(
+    groups,
+    prepped,
+    method,
+    steps,
+    trialactivities,
+    trialvariances,
+    dt, dtunit,
+    numboot,
+    seed,
+    description,
+    deterministic=False,
+    engine=None,
+    precision=None,
+    stepweights=None,
+    resampling='bootstrap',
+    blocks=None,
+    hierarchy=None,
+    streaming=False,
+    numchannels=None,
+    label='Channel',
+    names=None):
+    """
+        _coefficients_from_precomputed (or _stack_from_precomputed with
+        `numchannels`) for subsets of the trials. `groups` holds the labels
+        and the index of the label of each trial, see _check_groups.
+        The terms were precomputed once for all trials, each group only
+        takes the rows of its trials, and is estimated and resampled on
+        its own. Returns a dict from each label to its result.
+    """
+    labels, index = groups
+    numtrials = len(index)
+    results = {}
+    for gdx, name in enumerate(labels.tolist()):
+        trials = np.flatnonzero(index == gdx)
+        rows = trials if numchannels is None else \
+            (numtrials*np.arange(numchannels)[:, np.newaxis] + trials).ravel()
+
+        groupdesc = 'Group {}'.format(name)
+        if description is not None:
+            groupdesc = '{} ({})'.format(description, groupdesc)
+        log.debug('coefficients() of {} trials for {}'.format(len(trials),
+            groupdesc))
+
+        kwargs = dict(
+            deterministic = deterministic,
+            engine        = engine,
+            precision     = precision,
+            stepweights   = None if stepweights is None \
+                else stepweights[rows],
+            resampling    = resampling,
+            hierarchy     = None if hierarchy is None \
+                else _check_hierarchy(hierarchy[trials], len(trials)),
+            streaming     = streaming)
+        if numchannels is None:
+            results[name] = _coefficients_from_precomputed(
+                _take_trials(prepped, method, rows), method, steps,
+                trialactivities[trials], trialvariances[trials], dt, dtunit,
+                numboot, seed, groupdesc,
+                blocks=None if blocks is None \
+                    else _take_blocks(blocks, trials),
+                **kwargs)
+        else:
+            stack = _stack_from_precomputed(
+                _take_trials(prepped, method, rows), method, steps,
+                trialactivities[:, trials], trialvariances[:, trials], dt,
+                dtunit, numboot, seed, groupdesc, **kwargs)
+            stack.label = label
+            stack.names = names
+            results[name] = stack
+    return results
+
+# ------------------------------------------------------------------ #
+# Streaming
+# ------------------------------------------------------------------ #
+
+class CoefficientAccumulator:
+    """
+        Calculates the coefficients of correlation :math:`r_k` from data
+        that is provided block by block, for recordings that do not fit into
+        memory.
+
+        Trials can be added as a whole, or as consecutive chunks of one
+        long trial. Only the lagged sums of each trial and the last
+        `maxstep` values of the open trial are kept, so the memory needed
+        is bounded by the size of the blocks.
+        Call :meth:`result` to obtain the :class:`CoefficientResult`, which
+        matches the one of :func:`coefficients` on the full data.
+
+        Parameters
+        ----------
+        steps : ~numpy.array
+            The steps :math:`k` for which to compute coefficients. Has to be
+            provided, either as ``steps=(minstep, maxstep)`` or as array of
+            the desired integer step values. Every trial needs to be longer
+            than `maxstep`.
+
+        dt : float, optional
+            The size of each step in `dtunits`. Default is 1.
+
+        dtunit : str, optional
+            Units of step size. Default is `'ms'`.
+
         method : str, optional
-            The estimation method to use, either `'trialseparated'` (``'ts'``,
-            default) or
-            `'stationarymean'` (``'sm'``). ``'ts'``
-            calculates the :math:`r_k` for each trial separately and averages
-            over trials. Each trials contribution is weighted with its
-            variance.
-            ``'sm'`` assumes the mean activity and its variance to be
-            constant across all trials.
+            The estimation method, `'trialseparated'` (``'ts'``, default) or
+            `'stationarymean'` (``'sm'``). See :func:`coefficients`.
 
         numboot : int, optional
-            Enable bootstrapping to generate `numboot` (resampled)
-            series of trials from the provided one. This allows to approximate
-            statistical errors, returned in `stderrs`.
-            Default is `numboot=100`.
+            Number of bootstrap replicas, see :func:`coefficients`.
 
         seed : int, None or 'random', optional
-            If bootstrapping (`numboot>0`), a custom seed can be passed to
-            the random number generator used for
-            resampling. Per default, it is set to the *same* value every time
-            `coefficients()` is called to return consistent results
-            when repeating the analysis on the same data. Set to `None` to
-            prevent (re)seeding. 'random' seeds using the wall clock time.
-            For more details, see
-            :obj:`numpy.random.RandomState`.
+            Seed for the bootstrapping, see :func:`coefficients`.
+
+        description : str, optional
+            Set the description of the :class:`CoefficientResult`.
+
+        nthreads : int, optional
+            Maximum number of threads, see :func:`coefficients`.
+
+        deterministic : bool, optional
+            Thread independent bootstrapping, see :func:`coefficients`.
+
+        resampling : str, optional
+            `'bootstrap'` (default), `'jackknife'` or `'hierarchical'`, see
+            :func:`coefficients`.
+
+        hierarchy : ~numpy.ndarray, optional
+            One group label per trial for the hierarchical bootstrap, see
+            :func:`coefficients`. Checked against the trials that were
+            added when calling :meth:`result`.
+
+        streaming : bool, optional
+            Only keep the running moments of the replicas, see
+            :func:`coefficients`.
+
+        Example
+        -------
+        .. code-block:: python
+
+            import numpy as np
+            import mrestimator as mre
+
+            acc = mre.CoefficientAccumulator(steps=(1, 500))
+
+            # one long trial, stored in many files
+            for fname in ['part_0.npy', 'part_1.npy', 'part_2.npy']:
+                acc.add_chunk(np.load(fname))
+            acc.end_trial()
+
+            # complete trials
+            acc.add_trials(np.load('more_trials.npy', mmap_mode='r'))
+
+            rk = acc.result()
+        ..
+    """
+
+    def __init__(self,
+        steps,
+        dt=1, dtunit='ms',
+        method=None,
+        numboot=100,
+        seed=5330,
+        description=None,
+        desc=None,
+        nthreads=None,
+        deterministic=False,
+        resampling='bootstrap',
+        hierarchy=None,
+        streaming=False):
+
+        if method is None:
+            method = 'ts'
+        if method not in ['trialseparated', 'ts', 'stationarymean', 'sm']:
+            log.exception('Unknown method: "{}"'.format(method))
+            raise NotImplementedError
+        if method == 'ts':
+            method = 'trialseparated'
+        elif method == 'sm':
+            method = 'stationarymean'
+        if hierarchy is not None and resampling == 'bootstrap':
+            resampling = 'hierarchical'
+        if resampling not in ['bootstrap', 'jackknife', 'hierarchical']:
+            log.exception('Unknown resampling: "{}"'.format(resampling))
+            raise NotImplementedError
+        if (resampling == 'hierarchical') != (hierarchy is not None):
+            log.exception('The hierarchical bootstrap needs the group of ' +
+                'each trial as hierarchy, and only works with it')
+            raise ValueError
+
+        if desc is not None and description is None:
+            description = str(desc);
+        if description is not None:
+            description = str(description)
+
+        dt = float(dt)
+        if dt <= 0:
+            log.exception('Timestep dt needs to be a float > 0.0')
+            raise ValueError
+
+        try:
+            steps = np.array(steps, dtype=int)
+            assert len(steps.shape) == 1
+            if len(steps) == 2:
+                steps = np.arange(steps[0], steps[1]+1, dtype=int)
+            assert len(steps) > 0 and (steps >= 1).all()
+        except Exception as e:
+            log.exception('Please provide steps as ' +
+                'steps=(minstep, maxstep) or as one dimensional numpy ' +
+                'array containing all desired integer step values >= 1')
+            raise ValueError from e
+
+        self.steps       = steps
+        self.dt          = dt
+        self.dtunit      = str(dtunit)
+        self.method      = method
+        self.numboot     = numboot
+        self.seed        = seed
+        self.description = description
+        self.nthreads    = _check_nthreads(nthreads)
+        self.deterministic = bool(deterministic)
+        self.resampling  = resampling
+        self.hierarchy   = hierarchy
+        self.streaming   = bool(streaming)
+
+        self._kmax   = int(np.max(steps))
+        self._trials = []       # terms of finished trials
+        self._open   = None     # state of the trial that is being added
+
+    @property
+    def numtrials(self):
+        """Number of finished trials."""
+        return len(self._trials)
+
+    def add_trials(self, data):
+        """
+            Add complete trials. `data` is of shape (numtrials, numels),
+            one dimensional arrays are a single trial.
+            Trials are read one at a time, so `data` can be a
+            :obj:`numpy.memmap`.
+        """
+        if self._open is not None:
+            log.exception('Finish the current trial with end_trial() ' +
+                'before adding complete trials')
+            raise ValueError
+        if len(np.shape(data)) == 1:
+            data = [data]
+        for trial in data:
+            self.add_chunk(trial)
+            self.end_trial()
+
+    def add_chunk(self, chunk):
+        """
+            Append the one dimensional `chunk` to the current trial.
+            A new trial is started if none is open.
+        """
+        chunk = np.asarray(chunk, dtype=ftype)
+        if len(chunk.shape) != 1:
+            log.exception('Chunks need to be one dimensional')
+            raise ValueError
+        if len(chunk) == 0:
+            return
+
+        st = self._open
+        if st is None:
+            # shifting by the mean of the first chunk improves precision
+            st = dict(
+                shift  = np.mean(chunk, dtype=ftype),
+                numels = 0,
+                total  = ftype(0),
+                squ    = ftype(0),
+                head   = np.empty(0, dtype=ftype),
+                tail   = np.empty(0, dtype=ftype),
+                x_y    = np.zeros(len(self.steps), dtype=ftype))
+            self._open = st
+
+        cent = chunk - st['shift']
+        buf  = np.concatenate((st['tail'], cent))
+        with num_threads(self.nthreads):
+            lagged_sums(buf, len(st['tail']), self.steps, st['x_y'])
+
+        st['numels'] += len(cent)
+        st['total']  += np.sum(cent, dtype=ftype)
+        st['squ']    += np.sum(cent**2, dtype=ftype)
+        if len(st['head']) < self._kmax:
+            st['head'] = np.concatenate(
+                (st['head'], cent[:self._kmax-len(st['head'])]))
+        st['tail'] = buf[-self._kmax:].copy()
+
+    def end_trial(self):
+        """
+            Finish the current trial.
+        """
+        st = self._open
+        if st is None:
+            log.debug('No open trial to finish')
+            return
+        self._open = None
+
+        numels = st['numels']
+        if numels - self._kmax < 2:
+            log.exception('Trial of length {} is too short '.format(numels) +
+                'for maxstep={}'.format(self._kmax))
+            raise ValueError
+
+        nn = (numels - self.steps).astype(ftype)
+        # sums over the first and last k elements
+        head = np.cumsum(st['head'])[self.steps-1]
+        tail = np.cumsum(st['tail'][::-1])[self.steps-1]
+        tsqu = np.cumsum(st['tail'][::-1]**2)[self.steps-1]
+
+        self._trials.append(dict(
+            shift    = st['shift'],
+            mx       = (st['total'] - tail)/nn,
+            my       = (st['total'] - head)/nn,
+            x_x      = (st['squ']   - tsqu)/nn,
+            x_y      = st['x_y']/nn,
+            activity = st['total']/numels + st['shift'],
+            variance = (st['squ'] - st['total']**2/numels)/(numels-1),
+            mm       = st['total'] + numels*st['shift'],
+            mm_squ   = st['squ'] + 2*st['shift']*st['total'] \
+                + numels*st['shift']**2))
+
+    def result(self):
+        """
+            Returns the :class:`CoefficientResult` of all trials added so
+            far. An open trial is finished first.
+        """
+        self.end_trial()
+        if self.numtrials == 0:
+            log.exception('No trials were added to the accumulator')
+            raise ValueError
+        hierarchy = _check_hierarchy(self.hierarchy, self.numtrials)
+
+        log.info("CoefficientAccumulator with '{}' method for {} trials" \
+            .format(self.method, self.numtrials))
+
+        prepped, activities, variances = self._precomputed()
+        return _coefficients_from_precomputed(prepped, self.method,
+            self.steps, activities, variances,
+            self.dt, self.dtunit, self.numboot, self.seed, self.description,
+            self.deterministic, engine='tiled',
+            precision=np.dtype(ftype).name, resampling=self.resampling,
+            hierarchy=hierarchy, streaming=self.streaming)
+
+    def _precomputed(self):
+        """
+            Per-trial terms of the finished trials, as from _precompute,
+            and the activity and variance of each trial.
+        """
+        def stack(key):
+            return np.array([trial[key] for trial in self._trials])
+
+        shift = stack('shift')[np.newaxis, :]
+        mx    = stack('mx' ).T
+        my    = stack('my' ).T
+        x_x   = stack('x_x').T
+        x_y   = stack('x_y').T
+
+        if self.method == 'trialseparated':
+            # the per-trial coefficients do not depend on the shift
+            prepped = ts_from_sm_precompute((None, None, mx, my, x_y, x_x))
+        elif self.method == 'stationarymean':
+            # undo the shift
+            prepped = (
+                stack('mm'),
+                stack('mm_squ'),
+                mx + shift,
+                my + shift,
+                x_y + shift*(mx + my) + shift**2,
+                x_x + 2*shift*mx + shift**2)
+
+        return prepped, stack('activity'), stack('variance')
+
+# ------------------------------------------------------------------ #
+# Time resolved
+# ------------------------------------------------------------------ #
+
+def coefficients_windowed(
+    data,
+    window,
+    hop=None,
+    steps=None,
+    dt=1, dtunit='ms',
+    method=None,
+    numboot=100,
+    seed=5330,
+    description=None,
+    desc=None,
+    nthreads=None,
+    deterministic=False):
+    """
+        Calculates the coefficients of correlation :math:`r_k` in sliding
+        windows, to track changes of the branching parameter over time.
+
+        The lagged sums are updated incrementally as the window slides,
+        adding the pairs of time steps that enter the window and removing
+        those that leave it. The costs hence scale with the length of the
+        data and not with the number of windows. Each window is estimated
+        as soon as its sums are complete, only the running sums of each
+        trial and step are kept.
+
+        Parameters
+        ----------
+        data : ~numpy.ndarray
+            Input data in the trial structure, see :func:`coefficients`.
+            All trials share the same windows. Missing (`NaN`) values are
+            not supported.
+
+        window : int
+            Length of each window in time steps.
+
+        hop : int, optional
+            Number of time steps between the starts of consecutive windows.
+            Default is half the `window`. Window ``i`` covers
+            ``data[:, i*hop:i*hop+window]``.
+
+        steps : ~numpy.array, optional
+            The steps :math:`k` for which to compute coefficients, see
+            :func:`coefficients`. Defaults and limits are relative to the
+            `window` length.
+
+        dt : float, optional
+            The size of each step in `dtunits`. Default is 1.
+
+        dtunit : str, optional
+            Units of step size. Default is `'ms'`.
+
+        method : str, optional
+            The estimation method, `'trialseparated'` (``'ts'``, default) or
+            `'stationarymean'` (``'sm'``), applied in every window.
+
+        numboot : int, optional
+            Number of bootstrap replicas (over trials) to estimate the
+            `stderrs` of each window. The same resampled trials are used for
+            all windows, replicas are not kept. Default is `numboot=100`.
+
+        seed : int, None or 'random', optional
+            Seed for the bootstrapping, see :func:`coefficients`.
+
+        description : str, optional
+            Set the description of the results.
+
+        nthreads : int, optional
+            Maximum number of threads, see :func:`coefficients`.
+
+        deterministic : bool, optional
+            Thread independent bootstrapping, see :func:`coefficients`.
 
         Returns
         -------
-        : :class:`CoefficientResult`
-            The output is grouped and can be accessed
-            using its attributes (listed below).
+        : :class:`CoefficientResultSequence`
+            One :class:`CoefficientResult` per window. The stacked
+            coefficients are available as ``.coefficients`` of shape
+            (numwindows, numsteps), along with ``.stderrs``, and the
+            mean activity (variance) of each window in
+            ``.trialactivities`` (``.trialvariances``).
+
+        Example
+        -------
+        .. code-block:: python
+
+            import numpy as np
+            import mrestimator as mre
+
+            bp = mre.simulate_branching(m=0.98, a=10, numtrials=5,
+                length=100000)
+            rks = mre.coefficients_windowed(bp, window=10000, hop=1000,
+                steps=(1, 200))
+
+            # branching parameter over time
+            mt = np.array([mre.fit(rk).mre for rk in rks])
+        ..
     """
 
-    # ------------------------------------------------------------------ #
-    # Check arguments to offer some more convenience
-    # ------------------------------------------------------------------ #
-    log.debug('coefficients() using \'{}\' method:'.format(method))
+    log.debug('coefficients_windowed() using \'{}\' method:'.format(method))
     if method is None:
         method = 'ts'
     if method not in ['trialseparated', 'ts', 'stationarymean', 'sm']:
@@ -497,188 +4369,124 @@ def coefficients(
     if description is not None:
         description = str(description)
 
-    # check dt
     dt = float(dt)
     if dt <= 0:
         log.exception('Timestep dt needs to be a float > 0.0')
         raise ValueError
     dtunit = str(dtunit)
 
-    dim = -1
     try:
-        dim = len(data.shape)
-        if dim == 1:
-            log.warning('You should provide an ndarray of ' +
-                'shape(numtrials, datalength)\n' +
-                '\tContinuing with one trial, reshaping your input')
+        data = np.asarray(data)
+        if len(data.shape) == 1:
             data = np.reshape(data, (1, len(data)))
-        elif dim >= 3:
-            log.exception('Provided ndarray is of dim {}\n'.format(dim) +
-                  '\tPlease provide a two dimensional ndarray')
-            raise ValueError
+        assert len(data.shape) == 2
     except Exception as e:
         log.exception('Please provide a two dimensional ndarray')
         raise ValueError from e
+    if data.dtype.kind == 'f' and np.isnan(data).any():
+        log.exception('coefficients_windowed() does not support missing ' +
+            '(NaN) values, use coefficients() with a mask on each window')
+        raise ValueError
 
-    if steps is None:
-        steps = (None, None)
-    try:
-        steps = np.array(steps)
-        assert len(steps.shape) == 1
-    except Exception as e:
-        log.exception('Please provide steps as ' +
-            'steps=(minstep, maxstep) or as one dimensional numpy ' +
-            'array containing all desired integer step values')
-        raise ValueError from e
-    if len(steps) == 2:
-        minstep=1
-        # default length not sure yet. but kmax > numels/2 is no use.
-        maxstep=int(data.shape[1]/10)
-        if steps[0] is not None:
-            minstep = steps[0]
-        if steps[1] is not None:
-            maxstep = steps[1]
-        if minstep > maxstep or minstep < 1:
-            log.debug('minstep={} is invalid, setting to 1'.format(minstep))
-            minstep = 1
-
-        # it's important that kmax not larger than numels/2
-        if maxstep > data.shape[1]/2 or maxstep < minstep:
-            log.debug('maxstep={} is invalid'.format(maxstep))
-            maxstep = int(data.shape[1]/2)
-            log.debug('Adjusting maxstep to {}'.format(maxstep))
-        steps = np.arange(minstep, maxstep+1, dtype=int)
-        log.debug('Using steps between {} and {}'.format(minstep, maxstep))
-    else:
-        # dont overwrite provided argument
-        steps = np.array(steps, dtype=int, copy=True)
-        if (steps<1).any():
-            log.warning(
-                'All provided steps should be >= 1, modifying the input')
-            incorrect = np.nonzero(steps < 1)
-            correct = np.nonzero(steps >= 1)
-            # np.arange(0,1000,10) -> only first element is a problem
-            if (len(incorrect) == 1 and incorrect[0] == 0):
-                if not (steps == 1).any():
-                    steps[0] = 1
-                    log.debug('Changed first element to 1')
-                else:
-                    steps = steps[1:]
-                    log.debug('Removed first element')
-            else:
-                steps = steps[correct]
-                log.debug('Only using steps that are >= 1')
-        log.debug('Using provided custom steps between {} and {}'.format(
-            steps[0], steps[-1]))
-
-    # ------------------------------------------------------------------ #
-    # Continue with trusted arguments
-    # ------------------------------------------------------------------ #
-
-    numsteps  = len(steps)        # number of steps for rks
-    numtrials = data.shape[0]     # number of trials
-    numels    = data.shape[1]     # number of measurements per trial
-
-    if (ut._log_locals):
-        log.debug('Trusted Locals: {}'.format(locals()))
-
-    log.info("coefficients() with '{}' method for {} trials of length {}" \
-        .format(method, numtrials, numels))
+    numtrials = data.shape[0]
+    numels    = data.shape[1]
 
-    trialcrs        = []
-    bootstrapcrs    = []
-    stderrs         = None
-    trialactivities = np.mean(data, axis=1, dtype=ftype)
-    trialvariances  = np.var(data, axis=1, ddof=1, dtype=ftype)
-    coefficients    = None                    # set later
+    window = int(window)
+    hop    = max(1, window//2) if hop is None else int(hop)
+    if window < 4 or window > numels or hop < 1:
+        log.exception('Window needs to be at least 4 and at most ' +
+            '{} time steps long, hop at least 1'.format(numels))
+        raise ValueError
 
-    if method == 'trialseparated':
-        ts_prepped   = ts_precompute(data, steps)
-        coefficients = ts_method(ts_prepped, steps)
-
-        # save per-trial result
-        for tdx in range(numtrials):
-            tempdesc = 'Trial {}'.format(tdx)
-            if description is not None:
-                tempdesc = '{} ({})'.format(description, tempdesc)
-            temp = CoefficientResult(
-                coefficients    = ts_prepped[tdx],
-                trialactivities = np.array([trialactivities[tdx]]),
-                trialvariances  = np.array([trialvariances[tdx]]),
-                steps           = steps,
-                dt              = dt,
-                dtunit          = dtunit,
-                description     = tempdesc)
-            trialcrs.append(temp)
+    steps  = _check_steps(steps, window)
+    starts = np.arange(0, numels-window+1, hop)
 
-    elif method == 'stationarymean':
-        sm_prepped   = sm_precompute(data, steps)
-        coefficients = sm_method(sm_prepped, steps)
+    numsteps   = len(steps)
+    numwindows = len(starts)
 
+    log.info("coefficients_windowed() with '{}' method for ".format(method) +
+        '{} windows of length {} in {} trials'.format(
+        numwindows, window, numtrials))
 
-    # ------------------------------------------------------------------ #
-    # Bootstrapping
-    # ------------------------------------------------------------------ #
+    # activity in each window, pooled over trials
+    shift = np.mean(data, axis=1, dtype=ftype)
+    pool  = np.mean(shift)
+    wsum = np.zeros(numwindows, dtype=ftype)
+    wsqu = np.zeros(numwindows, dtype=ftype)
+    for trial in data:
+        cent = np.asarray(trial, dtype=ftype) - pool
+        csum = np.concatenate(([0], np.cumsum(cent)))
+        csqu = np.concatenate(([0], np.cumsum(cent**2)))
+        wsum += csum[starts+window] - csum[starts]
+        wsqu += csqu[starts+window] - csqu[starts]
+    num = numtrials*window
+    activities = wsum/num + pool
+    variances  = (wsqu - wsum**2/num)/(num-1)
 
+    counts = None
     if numboot <= 1:
         log.debug('Bootstrap needs at least numboot=2 replicas, ' +
             'skipping the resampling')
     elif numtrials < 2:
         log.info('Bootstrapping needs at least 2 trials, skipping ' +
             'the resampling')
-    elif numboot > 1:
+    else:
         log.info('Bootstrapping {} replicas'.format(numboot))
-        log.debug('coefficients() seeding to {}'.format(seed))
+        log.debug('coefficients_windowed() seeding to {}'.format(seed))
         if seed is None:
             pass
         elif seed == 'random':
             np.random.seed(None)
         else:
             np.random.seed(seed)
+        # the same resampled trials for all windows
+        counts = bootstrap_counts(numtrials, numboot)
 
-        bscoefficients = np.zeros(shape=(numboot, numsteps), dtype='float64')
+    coefficients = np.empty(shape=(numwindows, numsteps), dtype=ftype)
+    stderrs = None if counts is None \
+        else np.empty(shape=(numwindows, numsteps), dtype=ftype)
+    ones = np.ones(shape=(1, numtrials))
+    sums = np.zeros(shape=(4, numtrials, numsteps), dtype=ftype)
+    norm = (window - steps).astype(ftype)
 
-        for tdx in range(numboot):
-            # log.info('{}/{} replicas'.format(tdx+1, numboot))
-            choices = np.random.choice(np.arange(0, numtrials), size=numtrials)
-            bsmean  = np.mean(trialactivities[choices],         dtype=ftype)
-            bsvar   = np.var( trialactivities[choices], ddof=1, dtype=ftype)
+    with num_threads(nthreads):
+        for wdx, start in enumerate(starts):
+            windowed_update(data, steps, shift, sums,
+                -1 if wdx == 0 else starts[wdx-1], start, window)
 
+            # terms of this window, in the layout of ts_precompute and
+            # sm_precompute
+            mx, my, x_x, x_y = (sums[0]/norm, sums[1]/norm, sums[2]/norm,
+                sums[3]/norm)
             if method == 'trialseparated':
-                bscoefficients[tdx] = ts_method(ts_prepped, steps, choices)
-
+                # the per-trial coefficients do not depend on the shift
+                prepped = (x_y - mx*my) / (x_x - mx**2)
+                def estimate(weights):
+                    return ts_method_weighted(prepped, weights,
+                        deterministic)
             elif method == 'stationarymean':
-                bscoefficients[tdx] = sm_method(sm_prepped, steps, choices)
-
-            tempdesc = 'Bootstrap Replica {}'.format(tdx)
-            if description is not None:
-                tempdesc = '{} ({})'.format(description, tempdesc)
-            temp = CoefficientResult(
-                coefficients    = bscoefficients[tdx],
-                trialactivities = np.array([bsmean]),
-                trialvariances  = np.array([bsvar]),
-                steps           = steps,
-                dt              = dt,
-                dtunit          = dtunit,
-                description     = tempdesc)
-            bootstrapcrs.append(temp)
+                # undo the shift
+                c  = shift[:, np.newaxis]
+                sm = (None, None, np.transpose(mx + c),
+                    np.transpose(my + c),
+                    np.transpose(x_y + c*(mx + my) + c**2),
+                    np.transpose(x_x + 2*c*mx + c**2))
+                def estimate(weights):
+                    return sm_method_weighted(sm, weights, deterministic)
 
-        log.info('{} bootstrap replicas done'.format(numboot))
+            coefficients[wdx] = estimate(ones)[0]
+            if counts is not None:
+                stderrs[wdx] = np.sqrt(np.var(
+                    estimate(counts), axis=0, ddof=1, dtype=ftype))
 
-        stderrs = np.sqrt(np.var(bscoefficients, axis=0, ddof=1, dtype=ftype))
-        if (stderrs == stderrs[0]).all():
-            stderrs = None
-
-    fulres =  CoefficientResult(
+    return CoefficientResultSequence(
         coefficients    = coefficients,
-        trialactivities = trialactivities,
-        trialvariances  = trialvariances,
-        steps           = steps,
+        trialactivities = activities,
+        trialvariances  = variances,
         stderrs         = stderrs,
-        trialcrs        = trialcrs,
-        bootstrapcrs    = bootstrapcrs,
+        steps           = steps,
         dt              = dt,
         dtunit          = dtunit,
-        description     = description)
-
-    return fulres
+        label           = 'Window',
+        description     = description,
+        engine          = 'windowed')
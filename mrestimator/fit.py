@@ -10,6 +10,7 @@ import scipy.optimize
 from mrestimator import utility as ut
 log = ut.log
 from mrestimator import CoefficientResult
+from mrestimator.coefficients import CoefficientResultStream
 
 def f_linear(k, A, O):
     """:math:`A k + O`"""
@@ -323,7 +324,9 @@ def fit(
     quantiles=None,
     seed=101,
     desc=None,
-    description=None):
+    description=None,
+    resampling=None,
+    streaming=None):
     """
         Estimate the Multistep Regression Estimator by fitting the provided
         correlation coefficients :math:`r_k`. The fit is performed using
@@ -385,6 +388,24 @@ def fit(
             (between 0 and 1). See :obj:`numpy.quantile`.
             Defaults are ``[.125, .25, .4, .5, .6, .75, .875]``
 
+        resampling : str, optional
+            `'bootstrap'`, `'block'`, `'hierarchical'` or `'jackknife'`,
+            has to match the `resampling` of :func:`coefficients` that
+            created the replicas in `data`. Block and hierarchical bootstrap
+            replicas are fitted like bootstrap replicas.
+            Per default, jackknife replicas are refitted when `numboot`
+            is not zero. The jackknife refits all `numtrials` replicas
+            (regardless of `numboot`) and returns the jackknife standard
+            errors in `taustderr` and `mrestderr`, but no quantiles.
+
+        streaming : bool, optional
+            Only keep the running mean and variance and a sketch of the
+            quantiles of `tau` and `mre` while refitting the replicas,
+            instead of all values, so that the memory does not grow with
+            `numboot`. The quantiles are then approximate once there are
+            more than 1024 replicas. Per default, streams if the replicas
+            in `data` were streamed by ``coefficients(streaming=True)``.
+
         maxfev : int, optional
             Maximum iterations for the fit.
 
@@ -407,6 +428,11 @@ def fit(
 
     fitfunc = fitfunc_check(fitfunc)
 
+    if resampling not in [None, 'bootstrap', 'jackknife', 'block',
+        'hierarchical']:
+        log.exception('Unknown resampling: "{}"'.format(resampling))
+        raise NotImplementedError
+
     # check input data type
     if isinstance(data, CoefficientResult):
         log.debug('Coefficients given in default format')
@@ -648,6 +674,19 @@ def fit(
     mrestderr = None
     tauquantiles = None
     mrequantiles = None
+    srcresampling = getattr(src, 'resampling', None)
+    jackknife = resampling == 'jackknife' or (resampling is None and
+        srcresampling == 'jackknife' and numboot != 0)
+    if streaming is None:
+        streaming = isinstance(getattr(src, 'bootstrapcrs', None),
+            CoefficientResultStream)
+    if resampling is not None and src.numboot > 1 and \
+        resampling != ('bootstrap' if srcresampling is None \
+            else srcresampling):
+        log.exception("The replicas of the coefficients were created " +
+            "with '{}' resampling, not '{}'".format(srcresampling,
+            resampling))
+        raise ValueError
     if src.numboot <= 1:
         log.debug('Fitting of bootstrapsamples can only be done if ' +
             "coefficients() was called with sufficient trials and " +
@@ -655,7 +694,10 @@ def fit(
     elif fitfunc == f_linear:
         log.warning('Bootstrap is not suppored for the f_linear fitfunction')
     elif src.numboot>1:
-        if numboot > src.numboot:
+        if jackknife:
+            # the jackknife needs all replicas
+            numboot = src.numboot
+        elif numboot > src.numboot:
             log.debug("The provided data does not contain enough " +
                 "bootstrapsamples (%d) to do the requested " +
                 "'numboot=%d' fits.\n\tCall 'coefficeints()' and 'fit()' " +
@@ -676,8 +718,27 @@ def fit(
             else:
                 np.random.seed(seed)
 
-            bstau = np.full(numboot+1, np.nan)
-            bsmre = np.full(numboot+1, np.nan)
+            if streaming:
+                # running moments and quantile sketches of tau and mre,
+                # NaN of failed fits are skipped like by nanvar
+                bsmoments  = [ut._RunningMoments(),  ut._RunningMoments()]
+                bssketches = [ut._QuantileSketch(), ut._QuantileSketch()]
+            else:
+                bstau = np.full(numboot+1, np.nan)
+                bsmre = np.full(numboot+1, np.nan)
+
+            def collect(tdx, tau):
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    mre = np.exp(-1*dt/tau)
+                if not streaming:
+                    bstau[tdx] = tau
+                    bsmre[tdx] = mre
+                    return
+                for value, moments, sketch in zip([tau, mre], bsmoments,
+                    bssketches):
+                    if np.isfinite(value):
+                        moments.add(value)
+                        sketch.add(value)
 
             # use scipy default maxfev for errors
             maxfev = 100*(len(fitpars[0])+1)
@@ -689,28 +750,48 @@ def fit(
                     src.bootstrapcrs[tdx].coefficients[stepinds],
                     int(maxfev), False)
                 try:
-                    bstau[tdx] = bspopt[0]
-                    bsmre[tdx] = np.exp(-1*dt/bspopt[0])
+                    collect(tdx, bspopt[0])
                 except TypeError:
                     log.debug('Exception passed', exc_info=True)
-                    bstau[tdx] = np.nan
-                    bsmre[tdx] = np.nan
+                    collect(tdx, np.nan)
 
             ut._logstreamhandler.terminator = "\n"
             log.info('{} Bootstrap replicas done'.format(numboot))
 
-            # add source sample?
-            bstau[-1] = fulpopt[0]
-            bsmre[-1] = np.exp(-1*dt/fulpopt[0])
-
-            taustderr = np.sqrt(np.nanvar(bstau, ddof=1))
-            mrestderr = np.sqrt(np.nanvar(bsmre, ddof=1))
-            if quantiles is None:
-                quantiles = np.array([.125, .25, .4, .5, .6, .75, .875])
+            if jackknife:
+                # (n-1)/n times the sum of squared deviations, without the
+                # source sample
+                def jkstderr(values):
+                    num = np.sum(np.isfinite(values))
+                    return np.sqrt(np.nanvar(values) * (num-1))
+                if streaming:
+                    taustderr, mrestderr = [np.sqrt(moments.variance()
+                        * (moments.count-1)).item() for moments in bsmoments]
+                else:
+                    taustderr = jkstderr(bstau[:-1])
+                    mrestderr = jkstderr(bsmre[:-1])
+                quantiles = None
+                log.debug('No quantiles for jackknife replicas')
             else:
-                quantiles = np.array(quantiles)
-            tauquantiles = np.nanpercentile(bstau, quantiles*100.)
-            mrequantiles = np.nanpercentile(bsmre, quantiles*100.)
+                # add source sample?
+                collect(-1, fulpopt[0])
+
+                if quantiles is None:
+                    quantiles = np.array([.125, .25, .4, .5, .6, .75, .875])
+                else:
+                    quantiles = np.array(quantiles)
+                if streaming:
+                    taustderr, mrestderr = [
+                        np.sqrt(moments.variance(ddof=1)).item()
+                        for moments in bsmoments]
+                    tauquantiles, mrequantiles = [
+                        sketch.quantiles(quantiles)[:, 0]
+                        for sketch in bssketches]
+                else:
+                    taustderr = np.sqrt(np.nanvar(bstau, ddof=1))
+                    mrestderr = np.sqrt(np.nanvar(bsmre, ddof=1))
+                    tauquantiles = np.nanpercentile(bstau, quantiles*100.)
+                    mrequantiles = np.nanpercentile(bsmre, quantiles*100.)
 
     tau = fulpopt[0]
     mre = np.exp(-1*dt/fulpopt[0])
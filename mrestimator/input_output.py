@@ -7,6 +7,10 @@ import logging
 from mrestimator import utility as ut
 log = ut.log
 from mrestimator import CoefficientResult
+from mrestimator import PackedRaster
+from mrestimator import SpikeTimes
+from mrestimator import RaggedTrials
+from mrestimator import TrialFiles
 from mrestimator import FitResult
 from mrestimator import __version__
 
@@ -17,15 +21,38 @@ if os.environ.get('DISPLAY', '') == '':
     matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 
+def _spiketimes_handler(items, dt=None, numels=None, tmin=0, **kwargs):
+    """
+        Part of input_handler() for spike times, one trial per array or
+        file. Remaining kwargs are passed to np.loadtxt.
+    """
+    if isinstance(items, str):
+        items = [items]
+    if isinstance(items, np.ndarray) and items.dtype.kind in ['i', 'f', 'u']:
+        items = [items] if items.ndim == 1 else list(items)
+    if isinstance(items, (list, tuple)) \
+        and all(isinstance(item, str) for item in items):
+        files = []
+        for item in items:
+            files.extend(sorted(glob.glob(os.path.expanduser(item))))
+        if len(files) == 0:
+            log.exception('No files found matching {}'.format(items))
+            raise FileNotFoundError
+        log.info('input_handler() loading spike times from {} files'.format(
+            len(files)))
+        items = [np.loadtxt(fname, ndmin=1, **kwargs).ravel()
+            for fname in files]
+    return SpikeTimes(items, dt=dt, numels=numels, tmin=tmin)
+
 def input_handler(items, **kwargs):
     """
         Helper function that attempts to detect provided input and convert it
         to the format used by the toolbox. Ideally, you provide the native
         format, a :class:`numpy.ndarray` of ``shape(numtrials, datalength)``.
 
-        *Not implemented yet*:
-        All trials should have the same data length, otherwise they will be
-        padded.
+        Trials of different length (e.g. from files of different length)
+        are returned as :class:`~mrestimator.RaggedTrials`, without
+        truncating or padding them.
 
         The toolbox uses two dimensional `ndarrays` for
         providing the data to/from functions. This allows to
@@ -41,6 +68,10 @@ def input_handler(items, **kwargs):
             Alternatively, you can provide a `list` or `ndarray` containing
             strings or already imported data. In the latter case,
             `input_handler` attempts to convert it to the right format.
+            A :class:`~mrestimator.PackedRaster`,
+            :class:`~mrestimator.SpikeTimes`,
+            :class:`~mrestimator.RaggedTrials` or
+            :class:`~mrestimator.TrialFiles` is returned as is.
 
         kwargs
             Keyword arguments passed to :func:`numpy.loadtxt` when filenames
@@ -50,12 +81,24 @@ def input_handler(items, **kwargs):
             contain trial data you want to use.
             The input handler adds each column in each file to the list of
             trials.
+            Passing ``mmap_mode='r'`` loads ``.npy`` files with
+            :func:`numpy.load` as memory map, without reading them into
+            memory. A single file is returned as :obj:`numpy.memmap`
+            of ``shape(numtrials, datalength)``, several files of equal
+            length as :class:`~mrestimator.TrialFiles` that hold their
+            memory maps without copying them.
+            Passing ``spiketimes=True`` treats `items` as times of events
+            instead, a list of arrays or files with one trial each, and
+            returns :class:`~mrestimator.SpikeTimes`. The arguments `dt`,
+            `numels` and `tmin` are passed on to it.
 
         Returns
         -------
         : :class:`~numpy.ndarray`
             containing your data (hopefully)
-            formatted correctly. Access via ``[trial, datapoint]``
+            formatted correctly. Access via ``[trial, datapoint]``.
+            :class:`~mrestimator.RaggedTrials` for trials of different
+            length, access via ``[trial][datapoint]``.
 
         Example
         -------
@@ -74,6 +117,10 @@ def input_handler(items, **kwargs):
 
             # access your data, e.g. measurement 10 of trial 3
             pt = prepared[3, 10]
+
+            # spike times in seconds, one file per trial, in bins of 1 ms
+            spikes = mre.input_handler('~/data/spikes_*.txt',
+                spiketimes=True, dt=0.001)
         ..
     """
     invstr = '\nInvalid input, please provide one of the following:\n' \
@@ -82,6 +129,20 @@ def input_handler(items, **kwargs):
         '\t- numpy array or list containing spike data or filenames\n'
 
     log.debug('input_handler()')
+    if isinstance(items, PackedRaster):
+        log.info('input_handler() detected packed raster')
+        return items
+    if isinstance(items, SpikeTimes):
+        log.info('input_handler() detected spike times')
+        return items
+    if isinstance(items, RaggedTrials):
+        log.info('input_handler() detected ragged trials')
+        return items
+    if isinstance(items, TrialFiles):
+        log.info('input_handler() detected trial files')
+        return items
+    if kwargs.pop('spiketimes', False):
+        return _spiketimes_handler(items, **kwargs)
     situation = -1
     # cast tuple to list, maybe this can be done for other types in the future
     if isinstance(items, tuple):
@@ -144,7 +205,14 @@ def input_handler(items, **kwargs):
 
 
     if situation == 0:
-        retdata = np.stack((items), axis=0)
+        # avoid copying arrays (and reading memory maps), stack lists only
+        if isinstance(items, np.ndarray):
+            retdata = items
+        elif len(set(np.shape(item) for item in items)) > 1:
+            log.info('input_handler() detected trials of different length')
+            return RaggedTrials(items)
+        else:
+            retdata = np.stack((items), axis=0)
         if len(retdata.shape) == 1: retdata = retdata.reshape((1, len(retdata)))
     elif situation == 1:
         if len(items) == 0:
@@ -155,8 +223,17 @@ def input_handler(items, **kwargs):
                 'working directory to the location of your script file')
             raise FileNotFoundError
 
+        mmap_mode = kwargs.pop('mmap_mode', None)
+
         data = []
         for idx, item in enumerate(items):
+            if mmap_mode is not None:
+                log.debug('Loading with np.load as memory map: {}'.format(item))
+                result = np.load(item, mmap_mode=mmap_mode)
+                if len(result.shape) == 1:
+                    result = result.reshape((1, len(result)))
+                data.append(result)
+                continue
             try:
                 log.debug('Loading with np.loadtxt: {}'.format(item))
                 if 'unpack' in kwargs and not kwargs.get('unpack'):
@@ -182,16 +259,20 @@ def input_handler(items, **kwargs):
                 data.append(result)
 
         try:
-            retdata = np.vstack(data)
+            if len(data) == 1 and len(data[0].shape) == 2:
+                retdata = data[0]
+            elif mmap_mode is not None \
+                and len(set(dat.shape[1:] for dat in data)) == 1:
+                # keep the memory maps, coefficients() reads them in turn
+                retdata = TrialFiles(data)
+                log.info('input_handler() returning TrialFiles with ' +
+                    '{} trial(s) in {} files'.format(len(retdata), len(data)))
+                return retdata
+            else:
+                retdata = np.vstack(data)
         except ValueError:
-            minlenx = min(l.shape[0] for l in data)
-            minleny = min(l.shape[1] for l in data)
-
-            log.debug('Files have different length, resizing to shortest '
-                'one ({}, {})'.format(minlenx, minleny), exc_info=True)
-            for d, dat in enumerate(data):
-                data[d] = np.resize(dat, (minlenx, minleny))
-            retdata = np.vstack(data)
+            log.info('Files have different length, returning ragged trials')
+            return RaggedTrials([trial for dat in data for trial in dat])
 
     else:
         log.exception('Unknown situation%s', invstr)
@@ -1091,8 +1172,17 @@ def overview(src, rks, fits, **kwargs):
     # ------------------------------------------------------------------ #
 
     tsout = OutputHandler(ax=axes[0])
-    tsout.add_ts(src, label='Trials')
-    if (src.shape[0] > 1):
+    if isinstance(src, RaggedTrials):
+        # trials of different length are only drawn, without average
+        for idx, trial in enumerate(src):
+            tsout.ax.plot(np.arange(1, len(trial)+1), trial, alpha=0.1,
+                zorder=-1, color='C0', label='Trials' if idx == 0 else None)
+        tsout.ax.legend()
+    else:
+        tsout.add_ts(src, label='Trials')
+    if isinstance(src, RaggedTrials):
+        pass
+    elif (src.shape[0] > 1):
         try:
             prevclr = plt.rcParams["axes.prop_cycle"].by_key()["color"][0]
         except Exception:
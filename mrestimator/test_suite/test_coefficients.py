@@ -2,11 +2,17 @@ import unittest
 import pickle
 import time
 import sys
+import os
+import glob
+import tempfile
 
 import numpy as np
 
 import mrestimator as mre
-from mrestimator.utility import log
+from mrestimator.coefficients import bootstrap_counts, hierarchical_counts, \
+    sm_method, sm_method_weighted, sm_precompute, ts_method, \
+    ts_method_weighted, ts_precompute
+from mrestimator.utility import log, _QuantileSketch, _RunningMoments
 
 
 def test_similarity(value1, value2, ratio_different=1e-10):
@@ -49,6 +55,35 @@ def calc_corr_mat_separate(activity_mat, k_arr):
                               np.var(x, axis=1))
     return corr_arr
 
+def sm_precompute_baseline(activity_mat, k_arr):
+    # terms of sm_precompute, summing the edges for every step
+    numels = activity_mat.shape[1]
+    mm     = np.sum(activity_mat,    axis=1)
+    mm_squ = np.sum(activity_mat**2, axis=1)
+    mx, my, x_y, x_x = [], [], [], []
+    for k in k_arr:
+        x_y.append( np.sum(activity_mat[:, :-k]*activity_mat[:, k:], axis=1)
+            /(numels-k))
+        x_x.append((mm_squ - np.sum(activity_mat[:, -k:]**2, axis=1))
+            /(numels-k))
+        mx.append( (mm - np.sum(activity_mat[:, -k:], axis=1))/(numels-k))
+        my.append( (mm - np.sum(activity_mat[:, :k],  axis=1))/(numels-k))
+    return mm, mm_squ, np.array(mx), np.array(my), np.array(x_y), \
+        np.array(x_x)
+
+def ts_precompute_baseline(activity_mat, k_arr):
+    # per-trial coefficients of ts_precompute, in separate passes
+    numels = activity_mat.shape[1]
+    res = np.zeros((activity_mat.shape[0], len(k_arr)))
+    for i, k in enumerate(k_arr):
+        x = activity_mat[:, :-k]
+        y = activity_mat[:, k:]
+        x_mean = np.mean(x, axis=1)[:, np.newaxis]
+        y_mean = np.mean(y, axis=1)[:, np.newaxis]
+        res[:, i] = np.mean((x-x_mean) * (y - y_mean), axis=1) \
+            / np.mean((x-x_mean)**2, axis=1)
+    return res
+
 class TestCorrCoeff(unittest.TestCase):
     log.setLevel(40)
 
@@ -108,5 +143,895 @@ class TestCorrCoeff(unittest.TestCase):
             self.assertTrue(test_similarity_abs(mre_res.coefficients, np.mean(bootstrap_mat, axis=0),
                                                 max_difference=0.04/np.sqrt(numboot)))
 
+    def test_fft_engine(self):
+        print("\nTesting fft engine against direct computation: \n")
+
+        name_data = "./data/activity_mat_{}.pickled".format(30)
+        activity_mat = pickle.load(open(name_data, "rb"))
+        activity_mat = activity_mat.astype(dtype="float64")
+        k_arr = np.arange(7, 1500, 1)
+        numboot = 10
+        for method in ['trialseparated', 'stationarymean']:
+            rk_direct = mre.coefficients(activity_mat, steps=k_arr,
+                method=method, numboot=numboot, engine='direct')
+            rk_fft = mre.coefficients(activity_mat, steps=k_arr,
+                method=method, numboot=numboot, engine='fft')
+
+            self.assertTrue(test_similarity(rk_direct.coefficients,
+                rk_fft.coefficients, ratio_different = 1e-10))
+            self.assertTrue(test_similarity(rk_direct.stderrs,
+                rk_fft.stderrs, ratio_different = 1e-8))
+            self.assertEqual(len(rk_direct.trialcrs), len(rk_fft.trialcrs))
+            if len(rk_direct.trialcrs) > 0:
+                trial_direct = np.array(
+                    [trial.coefficients for trial in rk_direct.trialcrs])
+                trial_fft = np.array(
+                    [trial.coefficients for trial in rk_fft.trialcrs])
+                self.assertTrue(test_similarity_abs(trial_direct, trial_fft,
+                    max_difference=1e-10))
+
+        # a large mean must not cancel the per-trial coefficients
+        rk_direct = mre.coefficients(activity_mat + 1e6, steps=k_arr[:300],
+            method='trialseparated', numboot=0, engine='direct')
+        rk_fft = mre.coefficients(activity_mat + 1e6, steps=k_arr[:300],
+            method='trialseparated', numboot=0, engine='fft')
+        self.assertTrue(test_similarity_abs(rk_direct.coefficients,
+            rk_fft.coefficients, max_difference=1e-10))
+
+    def test_sm_precompute(self):
+        print("\nTesting prefix sums of sm_precompute: \n")
+
+        # steps up to half the length, where the edges are largest
+        data  = np.random.RandomState(2236).rand(5, 400)*10
+        k_arr = np.array([1, 2, 17, 100, 199, 200])
+        baseline = sm_precompute_baseline(data, k_arr)
+        for term, expected in zip(sm_precompute(data, k_arr), baseline):
+            self.assertTrue(test_similarity_abs(term, expected,
+                max_difference=1e-10))
+
+        # with offset, all terms but mm and mm_squ are of data - offset
+        shifted = sm_precompute_baseline(data - 5.0, k_arr)
+        terms   = sm_precompute(data, k_arr, offset=5.0)
+        for term, expected in zip(terms[2:], shifted[2:]):
+            self.assertTrue(test_similarity_abs(term, expected,
+                max_difference=1e-10))
+
+        # edge terms for steps up to the full length, in any order, from
+        # the head and tail tables of the largest step only
+        k_arr = np.array([399, 1, 250, 3, 398])
+        baseline = sm_precompute_baseline(data, k_arr)
+        for term, expected in zip(sm_precompute(data, k_arr), baseline):
+            self.assertTrue(test_similarity_abs(term, expected,
+                max_difference=1e-10))
+        for k in [1, 7, 398]:
+            mm, mm_squ, mx, my, x_y, x_x = sm_precompute(data, np.array([k]))
+            self.assertTrue(test_similarity_abs(mx[0],
+                np.mean(data[:, :-k], axis=1), max_difference=1e-12))
+            self.assertTrue(test_similarity_abs(my[0],
+                np.mean(data[:, k:], axis=1), max_difference=1e-12))
+            self.assertTrue(test_similarity_abs(x_x[0],
+                np.mean(data[:, :-k]**2, axis=1), max_difference=1e-10))
+
+        # integer input is converted while summing
+        counts = np.random.RandomState(5330).poisson(3, size=(3, 500))
+        for term, expected in zip(sm_precompute(counts, k_arr),
+            sm_precompute_baseline(counts.astype('float64'), k_arr)):
+            self.assertTrue(test_similarity_abs(term, expected,
+                max_difference=1e-10))
+
+    def test_ts_precompute(self):
+        print("\nTesting the fused kernel of ts_precompute: \n")
+
+        k_arr = np.array([1, 2, 17, 100, 199, 200])
+        data  = np.random.RandomState(2236).rand(5, 400)
+        self.assertTrue(test_similarity_abs(ts_precompute(data, k_arr),
+            ts_precompute_baseline(data, k_arr), max_difference=1e-12))
+
+        # the one-pass variance is shifted by the trial mean, so a large
+        # offset does not cancel
+        self.assertTrue(test_similarity_abs(
+            ts_precompute(data + 1e6, k_arr),
+            ts_precompute_baseline(data, k_arr), max_difference=1e-8))
+
+        # trials with different means
+        data[1] += 50
+        data[3] -= 1e3
+        self.assertTrue(test_similarity_abs(ts_precompute(data, k_arr),
+            ts_precompute_baseline(data, k_arr), max_difference=1e-10))
+
+        counts = np.random.RandomState(5330).poisson(3, size=(3, 500))
+        self.assertTrue(test_similarity_abs(
+            ts_precompute(counts, k_arr, intshift=True),
+            ts_precompute_baseline(counts.astype('float64'), k_arr),
+            max_difference=1e-12))
+
+    def test_weighted_bootstrap(self):
+        print("\nTesting batched bootstrap against single replicas: \n")
+
+        name_data = "./data/activity_mat_{}.pickled".format(10)
+        activity_mat = pickle.load(open(name_data, "rb"))
+        activity_mat = activity_mat.astype(dtype="float64")
+        k_arr = np.arange(7, 1500, 1)
+        numtrials = activity_mat.shape[0]
+
+        np.random.seed(42)
+        choices = [np.random.choice(np.arange(0, numtrials), size=numtrials)
+            for _ in range(5)]
+        np.random.seed(42)
+        counts = bootstrap_counts(numtrials, 5)
+        for tdx in range(5):
+            self.assertTrue(np.all(counts[tdx] ==
+                np.bincount(choices[tdx], minlength=numtrials)))
+
+        ts_prepped = ts_precompute(activity_mat, k_arr)
+        sm_prepped = sm_precompute(activity_mat, k_arr)
+        ts_batched = ts_method_weighted(ts_prepped, counts)
+        sm_batched = sm_method_weighted(sm_prepped, counts)
+        for tdx in range(5):
+            self.assertTrue(test_similarity(ts_batched[tdx],
+                ts_method(ts_prepped, k_arr, choices[tdx]),
+                ratio_different = 1e-10))
+            self.assertTrue(test_similarity(sm_batched[tdx],
+                sm_method(sm_prepped, k_arr, choices[tdx]),
+                ratio_different = 1e-8))
+
+    def test_lazy_results(self):
+        print("\nTesting lazy bootstrap and trial results: \n")
+
+        name_data = "./data/activity_mat_{}.pickled".format(0)
+        activity_mat = pickle.load(open(name_data, "rb"))
+        activity_mat = activity_mat.astype(dtype="float64")
+        numboot = 20
+        rk = mre.coefficients(activity_mat, steps=(1, 100),
+            method='trialseparated', numboot=numboot, desc='lazy')
+
+        self.assertEqual(rk.numboot, numboot)
+        self.assertEqual(len(rk.trialcrs), rk.numtrials)
+        self.assertEqual(rk.bootstrapcrs.coefficients.shape,
+            (numboot, rk.numsteps))
+        for crs in [rk.bootstrapcrs, rk.trialcrs]:
+            for idx in [0, 3, -1]:
+                self.assertIsInstance(crs[idx], mre.CoefficientResult)
+                self.assertTrue(np.all(
+                    crs[idx].coefficients == crs.coefficients[idx]))
+            self.assertEqual(len(crs[2:5]), 3)
+            with self.assertRaises(IndexError):
+                crs[len(crs)]
+        self.assertEqual(rk.trialcrs[3].description, 'lazy (Trial 3)')
+        self.assertEqual(rk.trialcrs[3].trialactivities[0],
+            rk.trialactivities[3])
+
+        # elements compare like the elements of a list
+        for crs in [rk.bootstrapcrs, rk.trialcrs]:
+            self.assertEqual(crs[0], crs[0])
+            self.assertEqual(crs[-1], crs[len(crs)-1])
+            self.assertNotEqual(crs[0], crs[1])
+            self.assertIn(crs[3], crs)
+            self.assertEqual(crs.index(crs[3]), 3)
+        self.assertNotIn(rk.bootstrapcrs[0], rk.trialcrs)
+        stack = mre.coefficients(activity_mat[np.newaxis], steps=(1, 10),
+            numboot=0)
+        self.assertEqual(stack[0], stack[0])
+        self.assertIn(stack[0], stack)
+
+    def test_accumulator(self):
+        print("\nTesting streaming accumulator against full data: \n")
+
+        name_data = "./data/activity_mat_{}.pickled".format(30)
+        activity_mat = pickle.load(open(name_data, "rb"))
+        activity_mat = activity_mat.astype(dtype="float64")
+        k_arr = np.arange(7, 1000, 1)
+        numboot = 10
+        rng = np.random.RandomState(42)
+        for method in ['trialseparated', 'stationarymean']:
+            rk_full = mre.coefficients(activity_mat, steps=k_arr,
+                method=method, numboot=numboot)
+
+            acc = mre.CoefficientAccumulator(steps=k_arr, method=method,
+                numboot=numboot)
+            acc.add_trials(activity_mat[:40])
+            for trial in activity_mat[40:]:
+                cuts = np.sort(rng.randint(0, len(trial), size=5))
+                for chunk in np.split(trial, cuts):
+                    acc.add_chunk(chunk)
+                acc.end_trial()
+            rk_acc = acc.result()
+
+            self.assertEqual(rk_acc.numtrials, rk_full.numtrials)
+            self.assertTrue(test_similarity(rk_full.coefficients,
+                rk_acc.coefficients, ratio_different = 1e-10))
+            self.assertTrue(test_similarity(rk_full.stderrs,
+                rk_acc.stderrs, ratio_different = 1e-8))
+            self.assertTrue(test_similarity(rk_full.trialvariances,
+                rk_acc.trialvariances, ratio_different = 1e-10))
+
+    def test_memmap(self):
+        print("\nTesting memory mapped input: \n")
+
+        name_data = "./data/activity_mat_{}.pickled".format(20)
+        activity_mat = pickle.load(open(name_data, "rb"))
+        activity_mat = activity_mat.astype(dtype="float64")
+        k_arr = np.arange(7, 1000, 1)
+        numboot = 10
+        with tempfile.TemporaryDirectory() as tempdir:
+            fname = os.path.join(tempdir, 'activity_mat.npy')
+            np.save(fname, activity_mat)
+            mapped = mre.input_handler(fname, mmap_mode='r')
+            self.assertIsInstance(mapped, np.memmap)
+            self.assertEqual(mapped.shape, activity_mat.shape)
+
+            for method in ['trialseparated', 'stationarymean']:
+                rk_full = mre.coefficients(activity_mat, steps=k_arr,
+                    method=method, numboot=numboot)
+                rk_mapped = mre.coefficients(mapped, steps=k_arr,
+                    method=method, numboot=numboot)
+                self.assertTrue(test_similarity(rk_full.coefficients,
+                    rk_mapped.coefficients, ratio_different = 1e-10))
+                self.assertTrue(test_similarity(rk_full.stderrs,
+                    rk_mapped.stderrs, ratio_different = 1e-8))
+
+            # channels, groups and the block bootstrap stay tiled
+            channels = np.stack([activity_mat[:42], activity_mat[42:]])
+            cname = os.path.join(tempdir, 'channels.npy')
+            np.save(cname, channels)
+            cmapped = np.load(cname, mmap_mode='r')
+            labels = np.arange(10) % 3
+            for method in ['trialseparated', 'stationarymean']:
+                rks_full = mre.coefficients(channels, steps=k_arr,
+                    method=method, numboot=numboot, engine='direct')
+                rks_mapped = mre.coefficients(cmapped, steps=k_arr,
+                    method=method, numboot=numboot)
+                for rk_full, rk_mapped in zip(rks_full, rks_mapped):
+                    self.assertEqual(rk_mapped.engine, 'tiled')
+                    self.assertTrue(test_similarity(rk_full.coefficients,
+                        rk_mapped.coefficients, ratio_different = 1e-10))
+                    self.assertTrue(test_similarity(rk_full.stderrs,
+                        rk_mapped.stderrs, ratio_different = 1e-8))
+
+                grouped_full = mre.coefficients(activity_mat[:10],
+                    steps=k_arr, method=method, numboot=numboot,
+                    groups=labels, engine='direct')
+                grouped_mapped = mre.coefficients(mapped[:10], steps=k_arr,
+                    method=method, numboot=numboot, groups=labels)
+                for label in grouped_full:
+                    self.assertEqual(grouped_mapped[label].engine, 'tiled')
+                    self.assertTrue(test_similarity_abs(
+                        grouped_full[label].coefficients,
+                        grouped_mapped[label].coefficients,
+                        max_difference = 1e-10))
+
+                rk_full = mre.coefficients(activity_mat, steps=k_arr[:50],
+                    method=method, numboot=numboot, resampling='block',
+                    engine='direct')
+                rk_mapped = mre.coefficients(mapped, steps=k_arr[:50],
+                    method=method, numboot=numboot, resampling='block')
+                self.assertEqual(rk_mapped.engine, 'tiled')
+                self.assertTrue(test_similarity(rk_full.coefficients,
+                    rk_mapped.coefficients, ratio_different = 1e-10))
+                self.assertTrue(test_similarity(rk_full.stderrs,
+                    rk_mapped.stderrs, ratio_different = 1e-8))
+
+            # one file per trial, kept as memory maps
+            for tdx, trial in enumerate(activity_mat):
+                np.save(os.path.join(tempdir,
+                    'trial_{:02d}.npy'.format(tdx)), trial)
+            files = mre.input_handler(os.path.join(tempdir, 'trial_*.npy'),
+                mmap_mode='r')
+            self.assertIsInstance(files, mre.TrialFiles)
+            self.assertEqual(files.shape, activity_mat.shape)
+            self.assertTrue(all(isinstance(part, np.memmap)
+                for part in files.parts))
+            # in order, so that the bootstrap draws the same trials
+            files = mre.TrialFiles([np.load(fname, mmap_mode='r')
+                for fname in sorted(glob.glob(
+                os.path.join(tempdir, 'trial_*.npy')))])
+            for method in ['trialseparated', 'stationarymean']:
+                for resampling, steps in [('bootstrap', k_arr),
+                    ('block', k_arr[:50])]:
+                    rk_full = mre.coefficients(activity_mat, steps=steps,
+                        method=method, numboot=numboot,
+                        resampling=resampling)
+                    rk_files = mre.coefficients(files, steps=steps,
+                        method=method, numboot=numboot,
+                        resampling=resampling)
+                    self.assertEqual(rk_files.engine, 'tiled')
+                    self.assertTrue(test_similarity(rk_full.coefficients,
+                        rk_files.coefficients, ratio_different = 1e-10))
+                    self.assertTrue(test_similarity(rk_full.stderrs,
+                        rk_files.stderrs, ratio_different = 1e-8))
+                rk_fft = mre.coefficients(files, steps=k_arr[:50],
+                    method=method, numboot=numboot, engine='fft')
+                self.assertTrue(test_similarity(rk_full.coefficients,
+                    rk_fft.coefficients, ratio_different = 1e-10))
+            del mapped, cmapped, files
+
+    def test_windowed(self):
+        print("\nTesting sliding windows against separate windows: \n")
+
+        name_data = "./data/activity_mat_{}.pickled".format(30)
+        activity_mat = pickle.load(open(name_data, "rb"))
+        activity_mat = activity_mat.astype(dtype="float64")
+        k_arr = np.arange(1, 200, 1)
+        window = 600
+        numboot = 10
+        for method in ['trialseparated', 'stationarymean']:
+            for hop in [100, 700]:
+                rks = mre.coefficients_windowed(activity_mat, window=window,
+                    hop=hop, steps=k_arr, method=method, numboot=numboot)
+                starts = np.arange(0, activity_mat.shape[1]-window+1, hop)
+                self.assertEqual(len(rks), len(starts))
+                for wdx, start in enumerate(starts):
+                    rk = mre.coefficients(
+                        activity_mat[:, start:start+window], steps=k_arr,
+                        method=method, numboot=numboot)
+                    self.assertTrue(test_similarity(rk.coefficients,
+                        rks[wdx].coefficients, ratio_different = 1e-10))
+                    self.assertTrue(test_similarity(rk.stderrs,
+                        rks[wdx].stderrs, ratio_different = 1e-8))
+
+        missing = activity_mat.copy()
+        missing[0, 10] = np.nan
+        with self.assertRaises(ValueError):
+            mre.coefficients_windowed(missing, window=window, hop=100,
+                steps=k_arr)
+
+    def test_nthreads(self):
+        print("\nTesting thread control: \n")
+
+        name_data = "./data/activity_mat_{}.pickled".format(10)
+        activity_mat = pickle.load(open(name_data, "rb"))
+        activity_mat = activity_mat.astype(dtype="float64")
+        k_arr = np.arange(7, 500, 1)
+        for method in ['trialseparated', 'stationarymean']:
+            rk_default = mre.coefficients(activity_mat, steps=k_arr,
+                method=method, numboot=0)
+            rk_single = mre.coefficients(activity_mat, steps=k_arr,
+                method=method, numboot=0, nthreads=1)
+            self.assertTrue(test_similarity(rk_default.coefficients,
+                rk_single.coefficients, ratio_different = 1e-12))
+        with self.assertRaises(ValueError):
+            mre.coefficients(activity_mat, steps=k_arr, nthreads=0)
+
+    def test_deterministic(self):
+        print("\nTesting deterministic reductions: \n")
+
+        name_data = "./data/activity_mat_{}.pickled".format(10)
+        activity_mat = pickle.load(open(name_data, "rb"))
+        activity_mat = activity_mat.astype(dtype="float64")
+        k_arr = np.arange(7, 500, 1)
+        for method in ['trialseparated', 'stationarymean']:
+            rk_default = mre.coefficients(activity_mat, steps=k_arr,
+                method=method, numboot=50, deterministic=True)
+            rk_single = mre.coefficients(activity_mat, steps=k_arr,
+                method=method, numboot=50, deterministic=True, nthreads=1)
+            rk_blas = mre.coefficients(activity_mat, steps=k_arr,
+                method=method, numboot=50)
+            self.assertTrue(np.array_equal(rk_default.coefficients,
+                rk_single.coefficients))
+            self.assertTrue(np.array_equal(rk_default.stderrs,
+                rk_single.stderrs))
+            self.assertTrue(test_similarity(rk_default.stderrs,
+                rk_blas.stderrs, ratio_different = 1e-10))
+
+    def test_blas_engine(self):
+        print("\nTesting numpy-only engine against direct computation: \n")
+
+        name_data = "./data/activity_mat_{}.pickled".format(30)
+        activity_mat = pickle.load(open(name_data, "rb"))
+        activity_mat = activity_mat.astype(dtype="float64")
+        # sparse steps and a partial block at the end
+        k_arr = np.concatenate([np.arange(7, 300, 1), [511, 512, 1000]])
+        for method in ['trialseparated', 'stationarymean']:
+            rk_direct = mre.coefficients(activity_mat, steps=k_arr,
+                method=method, numboot=10, engine='direct')
+            rk_blas = mre.coefficients(activity_mat, steps=k_arr,
+                method=method, numboot=10, engine='blas')
+
+            self.assertTrue(test_similarity(rk_direct.coefficients,
+                rk_blas.coefficients, ratio_different = 1e-10))
+            self.assertTrue(test_similarity(rk_direct.stderrs,
+                rk_blas.stderrs, ratio_different = 1e-8))
+
+        # a large mean must not cancel the per-trial coefficients
+        rk_direct = mre.coefficients(activity_mat + 1e6, steps=k_arr,
+            method='trialseparated', numboot=0, engine='direct')
+        rk_blas = mre.coefficients(activity_mat + 1e6, steps=k_arr,
+            method='trialseparated', numboot=0, engine='blas')
+        self.assertTrue(test_similarity_abs(rk_direct.coefficients,
+            rk_blas.coefficients, max_difference=1e-10))
+
+    def test_auto_engine(self):
+        print("\nTesting automatic engine selection: \n")
+
+        name_data = "./data/activity_mat_{}.pickled".format(30)
+        activity_mat = pickle.load(open(name_data, "rb"))
+        activity_mat = activity_mat.astype(dtype="float64")
+        costs = mre.benchmark_engines(save=False, numels=2**12, maxstep=64)
+        self.assertEqual(set(costs), {'trialseparated', 'stationarymean'})
+        self.assertTrue(all(cost > 0 for method in costs
+            for cost in costs[method].values()))
+        for method in ['trialseparated', 'stationarymean']:
+            for k_arr in [np.arange(1, 4), np.arange(1, 1500)]:
+                rk_direct = mre.coefficients(activity_mat, steps=k_arr,
+                    method=method, numboot=0, engine='direct')
+                rk_auto = mre.coefficients(activity_mat, steps=k_arr,
+                    method=method, numboot=0, engine='auto')
+                self.assertEqual(rk_direct.engine, 'direct')
+                self.assertIn(rk_auto.engine, ['direct', 'fft', 'blas'])
+                if method == 'trialseparated':
+                    self.assertEqual(rk_auto.trialcrs[0].engine,
+                        rk_auto.engine)
+                self.assertTrue(test_similarity(rk_direct.coefficients,
+                    rk_auto.coefficients, ratio_different = 1e-10))
+
+        # memory maps, also of channels, are read once
+        with tempfile.TemporaryDirectory() as tempdir:
+            fname = os.path.join(tempdir, 'channels.npy')
+            np.save(fname, activity_mat.reshape(2, 42, -1))
+            mapped = np.load(fname, mmap_mode='r')
+            for method in ['trialseparated', 'stationarymean']:
+                rks = mre.coefficients(mapped, steps=np.arange(1, 1500),
+                    method=method, numboot=0, engine='auto')
+                self.assertTrue(all(rk.engine == 'tiled' for rk in rks))
+            del mapped, rks
+
+    def test_precision(self):
+        print("\nTesting single precision per-trial terms: \n")
+
+        name_data = "./data/activity_mat_{}.pickled".format(30)
+        activity_mat = pickle.load(open(name_data, "rb"))
+        activity_mat = activity_mat.astype(dtype="float64")
+        k_arr = np.arange(7, 500, 1)
+        for method in ['trialseparated', 'stationarymean']:
+            for engine in ['direct', 'fft', 'blas']:
+                rk_double = mre.coefficients(activity_mat, steps=k_arr,
+                    method=method, numboot=10, engine=engine)
+                rk_single = mre.coefficients(activity_mat, steps=k_arr,
+                    method=method, numboot=10, engine=engine,
+                    precision='float32')
+                self.assertEqual(rk_double.precision, 'float64')
+                self.assertEqual(rk_single.precision, 'float32')
+                self.assertEqual(rk_single.coefficients.dtype, np.float64)
+                self.assertTrue(test_similarity_abs(rk_double.coefficients,
+                    rk_single.coefficients, max_difference=1e-6))
+                self.assertTrue(test_similarity(rk_double.stderrs,
+                    rk_single.stderrs, ratio_different = 1e-4))
+        with self.assertRaises(ValueError):
+            mre.coefficients(activity_mat, steps=k_arr, precision='int8')
+
+    def test_integer_input(self):
+        print("\nTesting exact sums for integer input: \n")
+
+        activity_mat = mre.simulate_branching(m=0.98, a=10, numtrials=10,
+            length=10000, seed=1)
+        k_arr = np.arange(1, 200, 1)
+        rk_int = mre.coefficients(activity_mat, steps=k_arr, numboot=0)
+        rk_offset = mre.coefficients((activity_mat+1000).astype(np.uint16),
+            steps=k_arr, numboot=0)
+        rk_float = mre.coefficients(activity_mat.astype(np.float64),
+            steps=k_arr, numboot=0)
+        # exact sums do not depend on the (integer) offset
+        self.assertTrue(np.array_equal(rk_int.coefficients,
+            rk_offset.coefficients))
+        self.assertTrue(test_similarity(rk_int.coefficients,
+            rk_float.coefficients, ratio_different = 1e-12))
+
+    def test_packed_raster(self):
+        print("\nTesting bit-packed binary rasters: \n")
+
+        rng = np.random.RandomState(5330)
+        raster = (rng.rand(8, 20003) < 0.1).astype(np.uint8)
+        packed = mre.PackedRaster.from_dense(raster)
+        self.assertEqual(packed.shape, raster.shape)
+        self.assertTrue(np.array_equal(packed.unpack(), raster))
+        k_arr = np.concatenate([np.arange(1, 200), [1000, 15000]])
+        for method in ['trialseparated', 'stationarymean']:
+            rk_dense = mre.coefficients(raster, steps=k_arr,
+                method=method, numboot=10, engine='direct')
+            rk_packed = mre.coefficients(packed, steps=k_arr,
+                method=method, numboot=10)
+            self.assertEqual(rk_packed.engine, 'packed')
+            self.assertTrue(test_similarity_abs(rk_dense.coefficients,
+                rk_packed.coefficients, max_difference=1e-12))
+            self.assertTrue(test_similarity_abs(rk_dense.stderrs,
+                rk_packed.stderrs, max_difference=1e-12))
+            self.assertTrue(test_similarity(rk_dense.trialvariances,
+                rk_packed.trialvariances, ratio_different=1e-12))
+        with self.assertRaises(ValueError):
+            mre.PackedRaster.from_dense(raster*2)
+
+    def test_spike_times(self):
+        print("\nTesting sparse spike time input: \n")
+
+        rng = np.random.RandomState(5330)
+        times = [np.sort(rng.uniform(0, 20, 400)) for trial in range(6)]
+        spikes = mre.input_handler(times, spiketimes=True, dt=1e-3,
+            numels=20000)
+        self.assertIsInstance(spikes, mre.SpikeTimes)
+        self.assertEqual(spikes.shape, (6, 20000))
+        binned = spikes.to_dense()
+        self.assertEqual(np.sum(binned), 2400)
+        k_arr = np.arange(1, 500)
+        for method in ['trialseparated', 'stationarymean']:
+            rk_dense = mre.coefficients(binned, steps=k_arr,
+                method=method, numboot=10, engine='direct')
+            rk_events = mre.coefficients(spikes, steps=k_arr,
+                method=method, numboot=10)
+            self.assertEqual(rk_events.engine, 'events')
+            self.assertTrue(test_similarity_abs(rk_dense.coefficients,
+                rk_events.coefficients, max_difference=1e-12))
+            self.assertTrue(test_similarity_abs(rk_dense.stderrs,
+                rk_events.stderrs, max_difference=1e-12))
+            self.assertTrue(test_similarity(rk_dense.trialvariances,
+                rk_events.trialvariances, ratio_different=1e-12))
+        with self.assertRaises(ValueError):
+            mre.SpikeTimes(times, dt=1e-3, numels=1000)
+
+        # events exactly on the bin edges go to the later bin
+        for dt, tmin in [(1e-3, 0), (1e-3, 0.5), (0.1, 0), (2.5e-4, 1.25)]:
+            edges = tmin + dt*np.arange(1001)
+            onedge = np.concatenate([edges[rng.randint(0, 1000, 300)],
+                rng.uniform(edges[0], edges[-1], 300)])
+            spikes = mre.SpikeTimes([onedge], dt=dt, numels=1000, tmin=tmin)
+            self.assertTrue(np.array_equal(spikes.to_dense()[0],
+                np.histogram(onedge, bins=edges)[0]))
+
+    def test_ragged_trials(self):
+        print("\nTesting trials of different length: \n")
+
+        rng = np.random.RandomState(7331)
+        trials = [rng.normal(size=1500).cumsum() * 0.01 + rng.normal(size=1500)
+            for trial in range(4)]
+        k_arr = np.arange(1, 200)
+        ragged = mre.RaggedTrials(trials)
+        self.assertEqual(ragged.shape, (4, 1500))
+        for method in ['trialseparated', 'stationarymean']:
+            for engine in ['direct', 'fft', 'blas']:
+                rk_dense = mre.coefficients(np.array(trials), steps=k_arr,
+                    method=method, numboot=10, engine='direct', seed=1)
+                rk_ragged = mre.coefficients(ragged, steps=k_arr,
+                    method=method, numboot=10, engine=engine, seed=1)
+                self.assertTrue(test_similarity_abs(rk_dense.coefficients,
+                    rk_ragged.coefficients, max_difference=1e-10))
+                self.assertTrue(test_similarity_abs(rk_dense.stderrs,
+                    rk_ragged.stderrs, max_difference=1e-10))
+
+        # trials of different length are weighted by their number of pairs
+        lengths = [1500, 900, 300, 150]
+        trials = [trial[:length] for trial, length in zip(trials, lengths)]
+        ragged = mre.input_handler(trials)
+        self.assertIsInstance(ragged, mre.RaggedTrials)
+        np.testing.assert_array_equal(ragged.lengths(), lengths)
+        rk = mre.coefficients(ragged, steps=k_arr, numboot=0)
+        single = np.array([mre.coefficients(trial, steps=k_arr,
+            numboot=0).coefficients for trial in trials])
+        pairs = np.array([length - k_arr for length in lengths], dtype=float)
+        pairs[pairs < 2] = 0
+        expected = np.nansum(single * pairs, axis=0) / np.sum(pairs, axis=0)
+        self.assertTrue(test_similarity_abs(rk.coefficients, expected,
+            max_difference=1e-12))
+
+    def test_missing_values(self):
+        print("\nTesting masked input with gaps: \n")
+
+        rng = np.random.RandomState(3141)
+        data = mre.simulate_branching(m=0.95, a=10, length=5000, numtrials=3,
+            seed=2718)
+        k_arr = np.arange(1, 300)
+        valid = np.ones(data.shape, dtype=bool)
+        for method in ['trialseparated', 'stationarymean']:
+            rk_full = mre.coefficients(data, steps=k_arr, method=method,
+                numboot=10)
+            for engine in ['direct', 'fft']:
+                rk_mask = mre.coefficients(data, steps=k_arr, method=method,
+                    numboot=10, engine=engine, mask=valid)
+                self.assertTrue(test_similarity_abs(rk_full.coefficients,
+                    rk_mask.coefficients, max_difference=1e-10))
+                self.assertTrue(test_similarity_abs(rk_full.stderrs,
+                    rk_mask.stderrs, max_difference=1e-10))
+
+        for start in rng.randint(0, 4500, 10):
+            valid[rng.randint(3), start:start+rng.randint(10, 400)] = False
+        gappy = data.astype(float)
+        gappy[~valid] = np.nan
+        rk = mre.coefficients(gappy, steps=k_arr, numboot=0)
+        rk_fft = mre.coefficients(data, steps=k_arr, numboot=0,
+            engine='fft', mask=valid)
+        self.assertTrue(test_similarity_abs(rk.coefficients,
+            rk_fft.coefficients, max_difference=1e-10))
+        # per trial, only pairs where both values are valid
+        for tdx in range(3):
+            for idx in [0, 49, 298]:
+                k = k_arr[idx]
+                sel = valid[tdx, :-k] & valid[tdx, k:]
+                front = data[tdx, :-k][sel]
+                back  = data[tdx, k:][sel]
+                expected = np.mean((front - np.mean(front)) \
+                    * (back - np.mean(back))) / np.var(front)
+                self.assertAlmostEqual(
+                    rk.trialcrs[tdx].coefficients[idx], expected, places=10)
+        self.assertAlmostEqual(rk.trialactivities[0],
+            np.mean(data[0][valid[0]]), places=10)
+
+    def test_channels(self):
+        print("\nTesting three dimensional input of several channels: \n")
+
+        data = mre.simulate_branching(m=0.95, a=10, length=3000,
+            numtrials=12, seed=1618).reshape(4, 3, -1)
+        k_arr = np.arange(1, 150)
+        for method in ['trialseparated', 'stationarymean']:
+            for engine in ['direct', 'fft']:
+                stack = mre.coefficients(data, steps=k_arr, method=method,
+                    numboot=10, engine=engine)
+                self.assertIsInstance(stack, mre.CoefficientResultStack)
+                self.assertEqual(len(stack), 4)
+                self.assertEqual(stack.coefficients.shape, (4, len(k_arr)))
+                for cdx in range(4):
+                    # same seed, so the same replicas as a single channel
+                    rk = mre.coefficients(data[cdx], steps=k_arr,
+                        method=method, numboot=10, engine=engine)
+                    self.assertTrue(test_similarity_abs(rk.coefficients,
+                        stack[cdx].coefficients, max_difference=1e-12))
+                    self.assertTrue(test_similarity_abs(rk.stderrs,
+                        stack[cdx].stderrs, max_difference=1e-12))
+                    self.assertTrue(test_similarity_abs(
+                        rk.bootstrapcrs.coefficients,
+                        stack[cdx].bootstrapcrs.coefficients,
+                        max_difference=1e-12))
+                    self.assertEqual(len(rk.trialcrs),
+                        len(stack[cdx].trialcrs))
+        with self.assertRaises(ValueError):
+            mre.coefficients(data[np.newaxis], steps=k_arr)
+
+    def test_populations(self):
+        print("\nTesting populations aggregated from channels: \n")
+
+        data = mre.simulate_branching(m=0.95, a=2, length=6000,
+            numtrials=30, seed=1414).reshape(10, 3, -1)
+        labels = np.array([2, 0, 2, 1, 0, 2, 1, 1, 2, 0])
+        k_arr = np.arange(1, 300)
+        summed = np.stack([np.sum(data[labels == label], axis=0)
+            for label in range(3)])
+        for method in ['trialseparated', 'stationarymean']:
+            rk_ref = mre.coefficients(summed, steps=k_arr, method=method,
+                numboot=10)
+            for engine in ['tiled', 'fft']:
+                rk_pop = mre.coefficients(data, steps=k_arr, method=method,
+                    numboot=10, populations=labels, engine=engine)
+                self.assertEqual(len(rk_pop), 3)
+                self.assertTrue(test_similarity_abs(rk_ref.coefficients,
+                    rk_pop.coefficients, max_difference=1e-12))
+                self.assertTrue(test_similarity_abs(rk_ref.stderrs,
+                    rk_pop.stderrs, max_difference=1e-12))
+                self.assertTrue(test_similarity(rk_ref.trialvariances,
+                    rk_pop.trialvariances, ratio_different=1e-12))
+
+        # weights, for channels of a single trial
+        weights = np.random.RandomState(42).rand(4, 10)
+        rk_pop = mre.coefficients(data[:, 0], steps=k_arr, numboot=0,
+            populations=weights)
+        rk_ref = mre.coefficients(np.tensordot(weights, data[:, 0:1],
+            axes=1), steps=k_arr, numboot=0)
+        self.assertTrue(test_similarity_abs(rk_ref.coefficients,
+            rk_pop.coefficients, max_difference=1e-12))
+        with self.assertRaises(ValueError):
+            mre.coefficients(data, steps=k_arr, populations=labels[1:])
+
+        # a single population is parallelized over its trials, each trial
+        # summed by one thread
+        single = np.zeros(10, dtype=int)
+        rk_one = mre.coefficients(data, steps=k_arr, numboot=10,
+            populations=single, nthreads=1, deterministic=True)
+        for nthreads in [2, 4]:
+            rk_many = mre.coefficients(data, steps=k_arr, numboot=10,
+                populations=single, nthreads=nthreads, deterministic=True)
+            self.assertTrue(np.array_equal(rk_one[0].coefficients,
+                rk_many[0].coefficients))
+            self.assertTrue(np.array_equal(rk_one[0].stderrs,
+                rk_many[0].stderrs))
+
+    def test_jackknife(self):
+        print("\nTesting the delete-one jackknife: \n")
+
+        data = mre.simulate_branching(m=0.95, a=10, length=3000,
+            numtrials=6, seed=1732)
+        k_arr = np.arange(1, 100)
+        for method in ['trialseparated', 'stationarymean']:
+            rk = mre.coefficients(data, steps=k_arr, method=method,
+                resampling='jackknife')
+            self.assertEqual(rk.resampling, 'jackknife')
+            self.assertEqual(rk.numboot, 6)
+            left = np.array([mre.coefficients(np.delete(data, tdx, axis=0),
+                steps=k_arr, method=method, numboot=0).coefficients
+                for tdx in range(6)])
+            stderrs = np.sqrt(5/6*np.sum((left - np.mean(left, axis=0))**2,
+                axis=0))
+            self.assertTrue(test_similarity_abs(left,
+                rk.bootstrapcrs.coefficients, max_difference=1e-12))
+            self.assertTrue(test_similarity_abs(stderrs, rk.stderrs,
+                max_difference=1e-12))
+
+        taus = np.array([mre.fit(mre.coefficients(
+            np.delete(data, tdx, axis=0), steps=k_arr, method=method,
+            numboot=0)).tau for tdx in range(6)])
+        ft = mre.fit(rk, resampling='jackknife')
+        self.assertAlmostEqual(ft.taustderr,
+            np.sqrt(5/6*np.sum((taus - np.mean(taus))**2)), places=5)
+        with self.assertRaises(ValueError):
+            mre.fit(mre.coefficients(data, steps=k_arr, numboot=10),
+                resampling='jackknife')
+
+    def test_block_bootstrap(self):
+        print("\nTesting the block bootstrap of a single trial: \n")
+
+        data = np.random.RandomState(2236).rand(1, 4000)
+        k_arr = np.arange(1, 10)
+        for method in ['trialseparated', 'stationarymean']:
+            rk = mre.coefficients(data, steps=k_arr, method=method,
+                resampling='block', blocksize=1000, numboot=2, seed=5330)
+            self.assertEqual(rk.resampling, 'block')
+            self.assertEqual(rk.numboot, 2)
+
+            # replica from the pairs that start in the drawn blocks
+            np.random.seed(5330)
+            counts = bootstrap_counts(4, 2)[0]
+            expected = []
+            for k in k_arr:
+                front, back = [], []
+                for bdx in range(4):
+                    idx = np.arange(bdx*1000, min(bdx*1000+1000, 4000-k))
+                    front += [data[0, idx]]*counts[bdx]
+                    back  += [data[0, idx+k]]*counts[bdx]
+                front = np.concatenate(front)
+                back  = np.concatenate(back)
+                expected.append(np.mean((front - np.mean(front)) \
+                    * (back - np.mean(back))) / np.var(front))
+            self.assertTrue(test_similarity_abs(np.array(expected),
+                rk.bootstrapcrs.coefficients[0], max_difference=1e-12))
+
+            # activities of the drawn blocks, as of trials in the bootstrap
+            drawn = np.repeat(np.mean(data[0].reshape(4, 1000), axis=1),
+                counts)
+            self.assertTrue(test_similarity_abs(np.mean(drawn),
+                rk.bootstrapcrs.trialactivities[0], max_difference=1e-12))
+            self.assertTrue(test_similarity_abs(np.var(drawn, ddof=1),
+                rk.bootstrapcrs.trialvariances[0], max_difference=1e-12))
+
+        rk = mre.coefficients(data, steps=k_arr, resampling='block',
+            numboot=20)
+        self.assertIsNotNone(rk.stderrs)
+        for numboot in [0, 20]:
+            with self.assertRaises(ValueError):
+                mre.coefficients(data, steps=k_arr, resampling='block',
+                    blocksize=0, numboot=numboot)
+        with self.assertRaises(ValueError):
+            mre.coefficients(mre.RaggedTrials([data[0], data[0, :100]]),
+                steps=k_arr, resampling='block')
+
+    def test_hierarchical_bootstrap(self):
+        print("\nTesting the hierarchical bootstrap: \n")
+
+        # every drawn group contributes as many trials as it has
+        groups = np.array([0, 0, 0, 1, 1, 2, 2, 2, 2, 2])
+        sizes  = np.bincount(groups)
+        np.random.seed(5330)
+        counts = hierarchical_counts(groups, 500)
+        pergroup = np.stack([np.sum(counts[:, groups == gdx], axis=1)
+            for gdx in range(3)], axis=1)
+        self.assertTrue((pergroup % sizes == 0).all())
+        self.assertTrue((np.sum(pergroup // sizes, axis=1) == 3).all())
+
+        data = mre.simulate_branching(m=0.95, a=10, numtrials=12,
+            length=1000, seed=2236)
+        labels = np.repeat(['a', 'b', 'c', 'd'], 3)
+        k_arr = np.arange(1, 20)
+        for method in ['trialseparated', 'stationarymean']:
+            rk = mre.coefficients(data, steps=k_arr, method=method,
+                hierarchy=labels, numboot=10, seed=5330)
+            self.assertEqual(rk.resampling, 'hierarchical')
+            self.assertEqual(rk.numboot, 10)
+
+            # a replica is the estimate of the drawn trials
+            np.random.seed(5330)
+            drawn = np.repeat(np.arange(12),
+                hierarchical_counts(np.repeat(np.arange(4), 3), 10)[3])
+            rd = mre.coefficients(data[drawn], steps=k_arr, method=method,
+                numboot=0)
+            self.assertTrue(test_similarity_abs(rd.coefficients,
+                rk.bootstrapcrs.coefficients[3], max_difference=1e-12))
+            self.assertAlmostEqual(np.mean(data[drawn]),
+                rk.bootstrapcrs[3].trialactivities[0])
+
+        acc = mre.CoefficientAccumulator(steps=k_arr, hierarchy=labels)
+        acc.add_trials(data)
+        self.assertTrue(test_similarity_abs(acc.result().stderrs,
+            mre.coefficients(data, steps=k_arr, hierarchy=labels).stderrs,
+            max_difference=1e-12))
+
+        ft = mre.fit(rk, numboot=10)
+        self.assertIsNotNone(ft.tauquantiles)
+        with self.assertRaises(ValueError):
+            mre.coefficients(data, steps=k_arr, hierarchy=labels[:-1])
+        with self.assertRaises(ValueError):
+            mre.coefficients(data, steps=k_arr, resampling='hierarchical')
+
+    def test_groups(self):
+        print("\nTesting coefficients of groups of trials: \n")
+
+        data = mre.simulate_branching(m=0.95, a=10, numtrials=12,
+            length=1000, seed=2236)
+        labels = np.array(['x', 'y', 'z'])[np.arange(12) % 3]
+        k_arr = np.arange(1, 20)
+        for method in ['trialseparated', 'stationarymean']:
+            rks = mre.coefficients(data, steps=k_arr, method=method,
+                groups=labels, numboot=10, description='test')
+            self.assertEqual(list(rks.keys()), ['x', 'y', 'z'])
+            for label, rk in rks.items():
+                rd = mre.coefficients(data[labels == label], steps=k_arr,
+                    method=method, numboot=10)
+                self.assertEqual(rk.numtrials, 4)
+                self.assertEqual(rk.description,
+                    'test (Group {})'.format(label))
+                self.assertTrue(test_similarity_abs(rk.coefficients,
+                    rd.coefficients, max_difference=1e-12))
+                self.assertTrue(test_similarity_abs(rk.stderrs,
+                    rd.stderrs, max_difference=1e-12))
+
+        # channels of each group
+        rks = mre.coefficients(np.stack([data, 2*data]), steps=k_arr,
+            groups=labels, numboot=10)
+        rd = mre.coefficients(data[labels == 'z'], steps=k_arr, numboot=10)
+        self.assertEqual(len(rks['z']), 2)
+        self.assertTrue(test_similarity_abs(rks['z'][1].stderrs,
+            rd.stderrs, max_difference=1e-12))
+
+        with self.assertRaises(ValueError):
+            mre.coefficients(data, steps=k_arr, groups=labels[:-1])
+
+    def test_streaming_bootstrap(self):
+        print("\nTesting the streaming bootstrap: \n")
+
+        values = np.random.RandomState(2236).standard_normal((20000, 2))
+        moments = _RunningMoments()
+        sketch  = _QuantileSketch()
+        merged  = _QuantileSketch()
+        for start in range(0, 9900, 300):
+            moments.add(values[start:start+300])
+            sketch.add(values[start:start+300])
+        moments.add(values[9900:])
+        merged.add(values[9900:])
+        sketch.merge(merged)
+        self.assertTrue(test_similarity_abs(moments.variance(ddof=1),
+            np.var(values, axis=0, ddof=1), max_difference=1e-12))
+        quantiles = np.array([.125, .5, .875])
+        self.assertTrue(test_similarity_abs(sketch.quantiles(quantiles),
+            np.percentile(values, quantiles*100, axis=0),
+            max_difference=0.05))
+
+        data = mre.simulate_branching(m=0.95, a=10, numtrials=10,
+            length=1000, seed=2236)
+        k_arr = np.arange(1, 20)
+        for method in ['trialseparated', 'stationarymean']:
+            rk = mre.coefficients(data, steps=k_arr, method=method,
+                numboot=2100)
+            rs = mre.coefficients(data, steps=k_arr, method=method,
+                numboot=2100, streaming=True)
+            self.assertEqual(rs.numboot, 2100)
+            self.assertTrue(test_similarity_abs(rk.stderrs, rs.stderrs,
+                max_difference=1e-12))
+            # replicas of the last batch are computed again
+            self.assertTrue(test_similarity_abs(
+                rk.bootstrapcrs.coefficients[2099],
+                rs.bootstrapcrs[2099].coefficients, max_difference=1e-12))
+
+        # exact quantiles for less replicas than the sketch holds
+        fk = mre.fit(rk, numboot=50)
+        fs = mre.fit(rs, numboot=50)
+        self.assertAlmostEqual(fk.taustderr, fs.taustderr)
+        self.assertTrue(test_similarity_abs(fk.tauquantiles,
+            fs.tauquantiles, max_difference=1e-12))
+        self.assertTrue(test_similarity_abs(fk.mrequantiles,
+            fs.mrequantiles, max_difference=1e-12))
+
 if __name__ == "__main__":
     unittest.main()
@@ -193,6 +193,105 @@ def _at_index(data, indices, keepdim=None, padding=np.nan):
             res[0:indices.size-1] = data[i]
         return res
 
+class _RunningMoments:
+    """
+        Running mean and variance of each column of a stream of rows, in
+        constant memory. Rows are added in batches of shape (num, numcols),
+        combined with the moments so far as by Welford (or Chan et al. for
+        batches). NaN values propagate, like in `np.var`.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean  = 0.0
+        self._m2   = 0.0
+
+    def add(self, values):
+        values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+        num = values.shape[0]
+        if num == 0:
+            return
+        mean  = np.mean(values, axis=0)
+        m2    = np.sum((values - mean)**2, axis=0)
+        delta = mean - self.mean
+        total = self.count + num
+        self.mean  = self.mean + delta*num/total
+        self._m2   = self._m2 + m2 + delta**2*self.count*num/total
+        self.count = total
+
+    def variance(self, ddof=0):
+        if self.count <= ddof:
+            return np.full(np.shape(self._m2), np.nan)
+        return self._m2/(self.count - ddof)
+
+class _QuantileSketch:
+    """
+        Mergeable sketch of the quantiles of each column of a stream of
+        rows, in memory that only grows with the log of the number of rows.
+        Rows are collected in a buffer of `size` rows, a full buffer is
+        sorted per column and every other row (alternating which) moves up
+        one level, where each row stands for twice as many.
+        The rank error is of the order of log2(count/size)/size, quantiles
+        are exact as long as less than `size` rows were added.
+    """
+
+    def __init__(self, size=2**10):
+        self.size    = int(size)
+        self.count   = 0
+        self._levels = []
+        self._flips  = []
+
+    def add(self, values):
+        values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+        self.count += values.shape[0]
+        self._insert(0, values)
+
+    def merge(self, other):
+        """
+            Adds the rows represented by another sketch.
+        """
+        self.count += other.count
+        for lvl, values in enumerate(other._levels):
+            self._insert(lvl, values)
+
+    def _insert(self, lvl, values):
+        if lvl == len(self._levels):
+            self._levels.append(values[0:0])
+            self._flips.append(0)
+        buf = np.concatenate((self._levels[lvl], values))
+        if len(buf) < self.size:
+            self._levels[lvl] = buf
+            return
+        # keep one row if odd, promote every other of the sorted rest
+        buf  = np.sort(buf, axis=0)
+        keep = len(buf) % 2
+        flip = self._flips[lvl]
+        self._flips[lvl] = 1 - flip
+        self._levels[lvl] = buf[len(buf)-keep:] if flip else buf[0:keep]
+        rest = buf[0:len(buf)-keep] if flip else buf[keep:]
+        self._insert(lvl+1, rest[flip::2])
+
+    def quantiles(self, quantiles):
+        """
+            Quantiles of each column, shape (len(quantiles), numcols),
+            linearly interpolated like `np.percentile`.
+        """
+        quantiles = np.asarray(quantiles, dtype=np.float64)
+        if self.count == 0:
+            return np.full((len(quantiles), 1), np.nan)
+        if len(self._levels) == 1:
+            return np.percentile(self._levels[0], quantiles*100., axis=0)
+        values  = np.concatenate(self._levels)
+        weights = np.concatenate([np.full(len(level), 2.0**lvl)
+            for lvl, level in enumerate(self._levels)])
+        order   = np.argsort(values, axis=0)
+        res = np.empty(shape=(len(quantiles), values.shape[1]))
+        for col in range(values.shape[1]):
+            wts = weights[order[:, col]]
+            cum = (np.cumsum(wts) - wts/2) / np.sum(wts)
+            res[:, col] = np.interp(quantiles, cum, values[order[:, col], col])
+        return res
+
 def _printeger(f, maxprec=5):
     try:
         f = float(f)
@@ -5,7 +5,7 @@ import numpy as np
 
 from mrestimator import utility as ut
 log = ut.log
-from mrestimator.coefficients import CoefficientResult, coefficients
+from mrestimator.coefficients import CoefficientResult, RaggedTrials, coefficients
 from mrestimator.input_output import *
 from mrestimator.fit import *
 
@@ -331,6 +331,9 @@ def full_analysis(
     src = input_handler(data)
 
     if substracttrialaverage:
+        if isinstance(src, RaggedTrials):
+            log.exception('The trial average needs trials of equal length')
+            raise ValueError
         src = src - np.mean(src, axis=0)
 
     log.debug('full_analysis() seeding to {}'.format(seed))